@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import Sequence, List, Tuple, Dict
+
+from config import data_path
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None    # Windows, appends are then only serialized within the process
+
+
+logger = logging.getLogger(__name__)
+
+_archive_folder = data_path['root_path'] + 'archive/'
+
+# Parameters holding credentials are never archived
+_secret_params = ('apikey', 'token')
+
+
+def _public_params(params: dict) -> dict:
+    return {key: str(params[key]) for key in sorted(params) if key not in _secret_params}
+
+
+class ResponseArchive(object):
+    '''Archive of raw api responses. Each distinct response is stored once as a gzip
+       compressed JSON file named by the sha256 of its content. An append-only index
+       maps (provider, function, symbol, params, fetch time) to the content
+    '''
+
+    def __init__(self, root_path: str = _archive_folder):
+        self.root_path = root_path
+        self._index_file = os.path.join(root_path, 'index.jsonl')
+        self._index = None
+        self._lock = threading.Lock()
+
+
+    def _object_file(self, digest: str) -> str:
+        return os.path.join(self.root_path, 'objects', digest[:2], digest + '.json.gz')
+
+
+    def _load_index(self) -> List[dict]:
+        if self._index is None:
+            self._index = []
+
+            if os.path.exists(self._index_file):
+                with open(self._index_file, 'r') as f:
+                    self._index = [json.loads(line) for line in f if line.strip()]
+
+        return self._index
+
+
+    def store(self, provider: str, function: str, symbol: str, params: dict,
+              data: dict, fetch_time: str = '') -> str:
+        '''Archive a decoded api response
+
+           @param: provider: name of the api provider, e.g. alpha_vantage
+           @param: function: api function/endpoint called
+           @param: symbol: stock symbol, or 'Market' for general news
+           @param: params: parameters of the api call
+           @param: data: decoded JSON object returned by the api call
+           @param: fetch_time: time of the call, yyyy-mm-dd hh:mm:ss. Default to now
+           @return: content digest
+        '''
+
+        content = json.dumps(data, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        digest = hashlib.sha256(content).hexdigest()
+
+        entry = {
+            'provider'  : provider,
+            'function'  : function,
+            'symbol'    : symbol,
+            'params'    : _public_params(params),
+            'fetch_time': fetch_time or datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'digest'    : digest,
+        }
+
+        object_file = self._object_file(digest)
+
+        with self._lock:
+            if not os.path.exists(object_file):
+                os.makedirs(os.path.dirname(object_file), exist_ok=True)
+
+                temp_file = '{0}.{1}.{2}.tmp'.format(object_file, os.getpid(), threading.get_ident())
+                with gzip.open(temp_file, 'wb') as f:
+                    f.write(content)
+                os.replace(temp_file, object_file)
+
+            index = self._load_index()
+            with open(self._index_file, 'a') as f:
+                # Collect runs of other processes may append at the same time
+                if fcntl: fcntl.flock(f, fcntl.LOCK_EX)
+                f.write(json.dumps(entry, sort_keys=True) + '\n')
+            index.append(entry)
+
+        return digest
+
+
+    def load(self, digest: str) -> dict:
+        with gzip.open(self._object_file(digest), 'rb') as f:
+            return json.loads(f.read().decode('utf-8'))
+
+
+    def entries(self, provider: str = '', function: str = '',
+                symbol: str = '') -> List[dict]:
+        '''Index entries matching the provided fields, ordered by fetch time'''
+
+        with self._lock:
+            index = list(self._load_index())
+
+        entries = [entry for entry in index
+                   if (not provider or entry['provider'] == provider)
+                   and (not function or entry['function'] == function)
+                   and (not symbol or entry['symbol'] == symbol)]
+
+        return sorted(entries, key=lambda entry: entry['fetch_time'])
+
+
+    def lookup(self, provider: str, function: str, symbol: str, params: dict,
+               ignored: Sequence[str] = ()) -> dict:
+        '''Latest archived response of the api call, None if never archived
+
+           @param: ignored: parameters that may differ from those of the archived call
+        '''
+
+        def key(params: dict) -> dict:
+            return {name: value for name, value in params.items() if name not in ignored}
+
+        params = key(_public_params(params))
+        entries = [entry for entry in self.entries(provider, function, symbol)
+                   if key(entry['params']) == params]
+
+        return self.load(entries[-1]['digest']) if entries else None
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,404 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Sequence, List, Tuple, Dict
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import accuracy_score
+
+from config import backtest as backtest_config
+from config import data_path, db_init, forest_inference, model_registry
+from database import Database
+from feature_loader import FeatureLoader
+from forest_inference import FlatForest
+from model import Model
+from model_registry import grow_forest
+from util import available_cores
+
+
+logger = logging.getLogger(__name__)
+
+_data_folder = data_path['root_path'] + 'backtest/'
+_portfolio_file = _data_folder + 'portfolio.csv'
+
+# Classes of the labels, in the order of the probabilities (neg, neu, pos)
+_classes = (-1, 0, 1)
+
+
+def simulate(open_: np.ndarray, close: np.ndarray, probs: np.ndarray, total_value: float = 500000,
+             value_each_stock: float = 25000) -> Dict[str, np.ndarray]:
+    '''Replay the trading rule of transaction.finalize_transaction over a (date x symbol)
+       grid at once. Shares are bought on the first date with the initial fund, then
+       each date trades int(round(init_share * (pos - neg) / 2)) shares at the open
+       price without short-selling, and is valued at the close price
+
+       @param: open_: open prices, (date x symbol)
+       @param: close: close prices, (date x symbol)
+       @param: probs: predicted probabilities (neg, neu, pos) for each date,
+                      (date x symbol x 3). Those of the first date are not used
+       @return: share, transaction, cash, total_value and benchmark of each date, with
+                cash reset to a higher value if it is negative, as by _validate_cash
+    '''
+
+    init_share = (value_each_stock / close[0]).astype('int64')
+    init_cash = total_value - (init_share * close[0]).sum()
+
+    # Desired transactions, then clamped so that shares never go below zero. With the
+    # running sum S of the desired transactions from the initial shares, the clamped
+    # shares follow W[t] = max(0, W[t - 1] + X[t]), i.e. W = S - min(0, running min of S)
+    desired = np.round(init_share * (probs[1:, :, 2] - probs[1:, :, 0]) / 2).astype('int64')
+    running = init_share + np.cumsum(desired, axis=0)
+    share = np.vstack([init_share, running - np.minimum(np.minimum.accumulate(running, axis=0), 0)])
+
+    transaction = np.diff(share, axis=0, prepend=share[:1])
+    cash = init_cash - np.cumsum((transaction * open_).sum(axis=1))
+
+    total = cash + (share * close).sum(axis=1)
+    benchmark = init_cash + (init_share * close).sum(axis=1)
+
+    # Always sufficient cash for trading
+    shift = max(-cash.min(), 0.0)
+
+    return {'share': share, 'transaction': transaction, 'cash': cash + shift,
+            'total_value': total + shift, 'benchmark': benchmark + shift}
+
+
+def _walk_forward_job(X: np.ndarray, Y: np.ndarray, rows: np.ndarray, retrain_every: int,
+                      param: dict, n_jobs: int) -> np.ndarray:
+    '''Probabilities predicted from the feature rows, by a model updated every
+       retrain_every predictions on all rows before the first prediction of the block.
+       As by the model registry, the forest is fitted once and then grows by trees
+       fitted on the extended rows, and is refitted when it cannot grow. The trees
+       added and the most trees are those of model_registry, in proportion to the
+       trees of the forest against those of Model.param. Rows -1 have no prediction
+    '''
+
+    scale = param['n_estimators'] / Model.param['n_estimators']
+    trees_per_update = max(1, int(round(model_registry['trees_per_update'] * scale)))
+    max_estimators = max(1, int(round(model_registry['max_estimators'] * scale)))
+
+    probs = np.zeros((len(rows), len(_classes)))
+    clf = None
+
+    for start in range(0, len(rows), retrain_every):
+        block = np.arange(start, min(start + retrain_every, len(rows)))
+        block = block[rows[block] >= 0]
+
+        # As by Model.fit, the rows before the row to predict from
+        n_train = rows[block[0]] if len(block) > 0 else 0
+        if n_train == 0:
+            continue
+
+        if clf is None or not grow_forest(clf, X[:n_train], Y[:n_train], n_jobs, trees_per_update, max_estimators):
+            clf = RandomForestClassifier(**param, n_jobs=n_jobs)
+            clf.fit(X[:n_train], Y[:n_train])
+
+        predictor = FlatForest(clf) if forest_inference['enabled'] else clf
+        prob = predictor.predict_proba(X[rows[block]])
+        for j, label in enumerate(clf.classes_):
+            probs[block, _classes.index(label)] = prob[:, j]
+
+    # As written to and read from prob_pred.csv
+    return np.round(probs, 4)
+
+
+def backtest(symbols: Sequence[str] = (), start: str = '', end: str = '', retrain_every: int = 0,
+             n_estimators: int = 0, max_workers: int = 0, loader: FeatureLoader = None,
+             db: str = '') -> pd.DataFrame:
+    '''Replay the strategy over the history in the feature store. Models are retrained
+       walk-forward, and predict the probabilities of a block of dates at once. The
+       trades of all dates and symbols are then simulated on arrays
+
+       @param: symbols: symbols to trade. If empty, use all symbols
+       @param: start: date of the initial holding, yyyy-mm-dd. If empty, the first date
+                      with features of all symbols
+       @param: end: last date to trade, yyyy-mm-dd. If empty, the last date with prices
+       @param: retrain_every: number of dates between retraining. If 0, use
+                              backtest['retrain_every']
+       @param: n_estimators: trees of the forests. If 0, use backtest['n_estimators'], or
+                             those of Model.param, the model that trades
+       @param: max_workers: number of cores. If 0, use backtest['max_workers']
+       @param: loader: feature loader. If None, one on the default feature store
+       @param: db: name of the database of the prices. If empty, use the default one
+       @return: portfolio of each date, as in transaction/portfolio.csv
+    '''
+    logger.info('Called')
+
+    db = db or db_init['db']
+    symbols = tuple(symbols or db_init['symbols'])
+    retrain_every = retrain_every or backtest_config['retrain_every']
+    loader = loader or FeatureLoader()
+
+    start_time = time.monotonic()
+
+    feature = loader.load_all(symbols)
+    prices = {symbol: Database.get_data_daily_arrays(db, symbol, start=start or '1900-01-01')
+              for symbol in symbols}
+
+    # Dates with prices of all symbols, from the first date with features of all symbols
+    dates = None
+    for symbol in symbols:
+        days = prices[symbol]['date'].astype(str)
+        dates = days if dates is None else np.intersect1d(dates, days)
+
+    first_date = max(str(feature[symbol]['dates'][0]) for symbol in symbols)
+    dates = dates[(dates >= (start or first_date)) & (dates <= (end or dates[-1]))]
+
+    if len(dates) < 2:
+        raise ValueError('Not enough dates to backtest from {0} to {1}'.format(start, end))
+
+    def grid(name: str) -> np.ndarray:
+        columns = []
+        for symbol in symbols:
+            rows = pd.Index(prices[symbol]['date'].astype(str)).get_indexer(dates)
+            columns.append(prices[symbol][name].astype('float64')[rows])
+        return np.column_stack(columns)
+
+    open_, close = grid('open'), grid('close')
+
+    # Each date trades on the prediction from the features of the previous date
+    n_estimators = n_estimators or backtest_config['n_estimators'] or Model.param['n_estimators']
+    param = dict(Model.param, n_estimators=n_estimators)
+
+    budget = max_workers or backtest_config['max_workers'] or available_cores()
+    workers = max(1, min(budget, len(symbols)))
+    n_jobs = max(1, budget // workers)
+
+    jobs = {}
+    for symbol in symbols:
+        matrix = feature[symbol]
+        rows = pd.Index(matrix['dates'].astype(str)).get_indexer(dates[:-1])
+        jobs[symbol] = (matrix['values'][:, :-1], matrix['Y'], rows, retrain_every, param, n_jobs)
+
+    if workers <= 1:
+        probs = {symbol: _walk_forward_job(*args) for symbol, args in jobs.items()}
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {symbol: executor.submit(_walk_forward_job, *args) for symbol, args in jobs.items()}
+            probs = {symbol: future.result() for symbol, future in futures.items()}
+
+    train_time = time.monotonic() - start_time
+
+    probs = np.stack([np.vstack([np.zeros(len(_classes)), probs[symbol]]) for symbol in symbols], axis=1)
+    result = simulate(open_, close, probs)
+
+    # Accuracy of the most probable class against the realized change
+    for j, symbol in enumerate(symbols):
+        rows = jobs[symbol][2]
+        predicted = np.array(_classes)[probs[1:, j].argmax(axis=1)][rows >= 0]
+        realized = feature[symbol]['Y'][rows[rows >= 0]]
+
+        if len(realized) > 0:
+            logger.info('Accuracy for %s: %.4f on %d dates', symbol, accuracy_score(realized, predicted),
+                        len(realized))
+
+    portfolio = {'date': dates}
+    for j, symbol in enumerate(symbols):
+        portfolio[symbol + '_share'] = result['share'][:, j]
+        portfolio[symbol + '_open'] = open_[:, j]
+        portfolio[symbol + '_close'] = close[:, j]
+    for name in ('cash', 'total_value', 'benchmark'):
+        portfolio[name] = np.round(result[name], 4)
+
+    portfolio = pd.DataFrame(portfolio)
+
+    logger.info('Backtest %d symbols on %d dates from %s to %s in %.1f seconds, %.1f for training',
+                len(symbols), len(dates), dates[0], dates[-1], time.monotonic() - start_time, train_time)
+    logger.info('Total value: %.2f, benchmark: %.2f', portfolio['total_value'].iloc[-1],
+                portfolio['benchmark'].iloc[-1])
+
+    return portfolio
+
+
+def _test_simulate(n_dates: int = 500, n_symbols: int = 10, seed: int = 0):
+    '''Parity of the simulation with the trading rule of finalize_transaction applied
+       one date and one symbol at a time
+    '''
+
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, (n_dates, n_symbols)), axis=0))
+    open_ = close * np.exp(rng.normal(0, 0.01, (n_dates, n_symbols)))
+    probs = np.round(rng.dirichlet((1, 1, 1), (n_dates, n_symbols)), 4)
+
+    # Mostly selling, so that shares run out and the clamp applies
+    probs[:, :, [0, 2]] = np.sort(probs[:, :, [0, 2]], axis=-1)[:, :, ::-1]
+
+    actual = simulate(open_, close, probs)
+
+    init_share = [int(25000 / close[0, j]) for j in range(n_symbols)]
+    cash = 500000 - sum(init_share[j] * close[0, j] for j in range(n_symbols))
+    init_cash, curr_share = cash, list(init_share)
+    expected = {'share': [list(init_share)], 'cash': [cash], 'total_value': [500000.0], 'benchmark': [500000.0]}
+
+    for t in range(1, n_dates):
+        for j in range(n_symbols):
+            pos, neg = probs[t, j, 2], probs[t, j, 0]
+            transaction = int(round(init_share[j] * (pos - neg) / 2, 0))
+
+            if curr_share[j] + transaction < 0:
+                transaction = -curr_share[j]
+
+            curr_share[j] += transaction
+            cash -= transaction * open_[t, j]
+
+        expected['share'].append(list(curr_share))
+        expected['cash'].append(cash)
+        expected['total_value'].append(cash + sum(curr_share[j] * close[t, j] for j in range(n_symbols)))
+        expected['benchmark'].append(init_cash + sum(init_share[j] * close[t, j] for j in range(n_symbols)))
+
+    shift = max(-min(expected['cash']), 0.0)
+
+    assert np.array_equal(actual['share'], np.array(expected['share']))
+    assert (actual['share'] == 0).any()
+
+    for name in ('cash', 'total_value', 'benchmark'):
+        assert np.allclose(actual[name], np.array(expected[name]) + shift, rtol=0, atol=1e-6), name
+
+    logger.info('Simulation matches the trading rule on %d dates and %d symbols', n_dates, n_symbols)
+
+
+def _test_backtest(n_days: int = 300, retrain_every: int = 20, n_estimators: int = 20, seed: int = 0):
+    '''End to end on a temporary DuckDB database and feature store: the date grid,
+       dates without features, and the forests fitted, grown and refitted walk-forward
+       against a model rebuilt for each date
+    '''
+
+    import tempfile
+    import database
+    from feature import build_news_feature_array, build_ta_feature
+    from feature_store import FeatureStore
+
+    rng = np.random.default_rng(seed)
+    days = np.datetime_as_string(np.datetime64('2018-01-01') + np.arange(n_days))
+    symbols = ('AAA', 'BBB', 'CCC')
+
+    # Prices of CCC missing on some dates, features of BBB starting later and missing
+    # on some dates
+    price_days = {'AAA': days, 'BBB': days, 'CCC': np.delete(days, [100, 101, 150])}
+    dropped = {'AAA': [], 'BBB': [120, 121, 122, 200], 'CCC': []}
+
+    scale = n_estimators / Model.param['n_estimators']
+    trees_per_update = max(1, int(round(model_registry['trees_per_update'] * scale)))
+    max_estimators = max(1, int(round(model_registry['max_estimators'] * scale)))
+
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+
+    with tempfile.TemporaryDirectory() as root_path:
+        stored = database._backend
+        database._backend = database.DuckDBBackend(root_path + '/{db}.duckdb')
+        database._cache.clear()
+        logger.addHandler(handler)
+
+        try:
+            store = FeatureStore(root_path + '/feature/')
+            Database.init_db('BacktestDB', *symbols)
+
+            for i, symbol in enumerate(symbols):
+                n = len(price_days[symbol])
+                close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, n)))
+                open_ = close * np.exp(rng.normal(0, 0.005, n))
+                volume = rng.integers(1e6, 1e7, n)
+
+                Database.insert_data_daily('BacktestDB', symbol, [
+                    (day, 'US/Eastern', '%.4f' % o, '%.4f' % (max(o, c) * 1.01), '%.4f' % (min(o, c) * 0.99),
+                     '%.4f' % c, '%.4f' % c, str(v), '0.0000', '1.0000')
+                    for day, o, c, v in zip(price_days[symbol], open_, close, volume)])
+
+                daily = Database.get_data_daily_arrays('BacktestDB', symbol)
+                ta = build_ta_feature(symbol, daily, save_feature=False).iloc[10 * i:]
+                store.write('ta', symbol, ta.drop(index=ta.index[[k for k in dropped[symbol] if k < len(ta)]]))
+                store.write('news', symbol, build_news_feature_array(tuple(days), []))
+
+            store.write('news', 'Market', build_news_feature_array(tuple(days), []))
+
+            loader = FeatureLoader(store)
+            portfolio = backtest(symbols, retrain_every=retrain_every, n_estimators=n_estimators,
+                                 max_workers=1, loader=loader, db='BacktestDB')
+
+            # Dates with prices of all symbols, from the first date with all features
+            feature = loader.load_all(symbols)
+            first_date = max(str(feature[symbol]['dates'][0]) for symbol in symbols)
+            dates = [day for day in price_days['CCC'] if day >= first_date]
+            assert portfolio['date'].tolist() == dates
+
+            probs = np.zeros((len(dates), len(symbols), len(_classes)))
+            param = dict(Model.param, n_estimators=n_estimators)
+            n_grown, n_refitted = 0, 0
+
+            for j, symbol in enumerate(symbols):
+                prices = Database.get_data_daily_arrays('BacktestDB', symbol)
+                on_date = dict(zip(prices['date'].astype(str), zip(prices['open'], prices['close'])))
+                assert portfolio[symbol + '_open'].tolist() == [float(on_date[day][0]) for day in dates]
+                assert portfolio[symbol + '_close'].tolist() == [float(on_date[day][1]) for day in dates]
+
+                X, Y = feature[symbol]['values'][:, :-1], feature[symbol]['Y']
+                row_of = {str(day): k for k, day in enumerate(feature[symbol]['dates'])}
+                clf, n_trees = None, 0
+
+                # One date at a time, trading on the features of the previous date
+                for t in range(1, len(dates)):
+                    if (t - 1) % retrain_every == 0:
+                        block = [row_of[dates[u - 1]] for u in range(t, min(t + retrain_every, len(dates)))
+                                 if dates[u - 1] in row_of]
+
+                        # No prediction in a block without rows to train on
+                        trained = len(block) > 0 and block[0] > 0
+                        if not trained:
+                            continue
+
+                        n_trees += trees_per_update
+                        if clf is None or n_trees > max_estimators or set(Y[:block[0]]) != set(clf.classes_):
+                            clf, n_trees = RandomForestClassifier(**param).fit(X[:block[0]], Y[:block[0]]), n_estimators
+                            n_refitted += 1
+                        else:
+                            clf.set_params(warm_start=True, n_estimators=n_trees).fit(X[:block[0]], Y[:block[0]])
+                            n_grown += 1
+
+                    if trained and dates[t - 1] in row_of:
+                        prob = clf.predict_proba(X[[row_of[dates[t - 1]]]])[0]
+                        for k, label in enumerate(clf.classes_):
+                            probs[t, j, _classes.index(label)] = round(prob[k], 4)
+
+            assert n_grown > 0 and n_refitted > len(symbols)
+            assert (probs[1:].sum(axis=2) == 0).any()
+
+            expected = simulate(portfolio[[symbol + '_open' for symbol in symbols]].to_numpy(),
+                                portfolio[[symbol + '_close' for symbol in symbols]].to_numpy(), probs)
+
+            for j, symbol in enumerate(symbols):
+                assert np.array_equal(portfolio[symbol + '_share'], expected['share'][:, j]), symbol
+            assert np.array_equal(portfolio['total_value'], np.round(expected['total_value'], 4))
+
+            accuracy = [record for record in records if record.getMessage().startswith('Accuracy for')]
+            assert [record.args[0] for record in accuracy] == list(symbols)
+        finally:
+            logger.removeHandler(handler)
+            database._backend = stored
+            database._cache.clear()
+
+    logger.info('Backtest matches a model rebuilt for each date on %d dates and %d symbols, '
+                '%d forests grown and %d fitted', len(dates), len(symbols), n_grown, n_refitted)
+
+
+def test():
+    _test_simulate()
+    _test_backtest()
+
+
+if __name__ == '__main__':
+    # python backtest.py [test]
+    logging.basicConfig(level=logging.INFO)
+
+    if sys.argv[1:] == ['test']:
+        test()
+    else:
+        os.makedirs(_data_folder, exist_ok=True)
+        backtest().to_csv(_portfolio_file, float_format='%.4f', index=False)
@@ -10,6 +10,35 @@ api_keys = {
     'stock_news'     : 'your-api-key',
 }
 
+# Rate limit of each api provider: at most 'calls' requests every 'period' seconds
+api_rate_limit = {
+    'alpha_vantage'  : {'calls': 5, 'period': 60},
+    'stock_news'     : {'calls': 6, 'period': 60},
+}
+
+ingestion = {
+    'max_workers'   : 8,       # threads fetching data concurrently
+    'max_retries'   : 5,       # retries when the provider throttles a call
+    'backoff_base'  : 2.0,     # seconds, doubled on each retry
+    'backoff_max'   : 120.0,   # seconds
+    'bulk_load_rows': 5000,    # price records from which the bulk loader is used
+}
+
+# Shared http session used by the data collectors
+http_session = {
+    'connect_timeout' : 5.0,    # seconds
+    'read_timeout'    : 30.0,   # seconds
+    'pool_connections': 4,      # number of hosts to keep a connection pool for
+    'pool_maxsize'    : 8,      # connections kept alive per host
+}
+
+# Raw api responses are archived under data_path. In replay mode, api calls
+# are served from the archive without network access
+response_archive = {
+    'enabled': True,
+    'replay' : False,
+}
+
 cache_url = {
     'host': '127.0.0.1',
     'port': 8000,
@@ -22,6 +51,23 @@ db_access = {
     'password': 'admin',
 }
 
+# Connections to each database are borrowed from a process-wide pool
+db_pool = {
+    'pool_size'       : 8,       # at most 32
+    'checkout_timeout': 30.0,    # seconds to wait for a free connection
+}
+
+# In-process cache of query results, dropped when data is inserted
+query_cache = {
+    'enabled': True,
+}
+
+# Storage engine of the database: 'mysql' server, or embedded 'duckdb' file
+db_backend = {
+    'engine': 'mysql',
+    'path'  : './data/{db}.duckdb',     # file of each database, for duckdb only
+}
+
 db_init = {
     'db'     : 'StockDB',
     'symbols': ('GOOG', 'AMZN', 'AAPL', 'FB', 'MSFT', 'ADBE', 'UBER', 'TSLA', 'NFLX', 'BABA'),
@@ -40,6 +86,56 @@ description = {
     'BABA': 'Alibaba Group Holding Ltd.',
 }
 
+# Per-symbol feature jobs run in a pool of processes
+feature_build = {
+    'max_workers': 0,       # 0 for the number of cores, 1 to build in this process
+    'ta_panel'   : False,   # build the ta features of all symbols in one batched pass, with
+                            # the numpy indicators (equal to talib within float tolerance)
+}
+
+# Indicators computed by 'talib', or by 'numpy' if talib cannot be built
+indicator = {
+    'backend': 'talib',
+}
+
+# Parquet store of the features, partitioned by symbol
+feature_store = {
+    'compression': 'zstd',
+    'max_parts'  : 32,      # parts of a symbol merged into one once reached
+}
+
+# Models of the symbols trained in a pool of processes, sharing the cores
+model_build = {
+    'max_workers': 0,       # 0 for the number of cores, 1 to train in this process
+}
+
+# Walk-forward backtest of the strategy over the stored features. 10 symbols over
+# 727 dates take 86 seconds on one core with the 500 trees of Model.param, 17
+# seconds with n_estimators 100
+backtest = {
+    'retrain_every': 20,    # number of trading days between retraining
+    'n_estimators' : 0,     # 0 for the trees of Model.param, fewer for a faster but different model
+    'max_workers'  : 0,     # 0 for the number of cores, 1 to train in this process
+}
+
+# Fitted forests evaluated on flat node arrays instead of predict_proba
+forest_inference = {
+    'enabled'     : True,
+    'max_elements': 1 << 18,    # rows x trees traversed at once, bounds the memory
+}
+
+# Fitted models kept by symbol and hash of the training data
+model_registry = {
+    'enabled'         : True,
+    'trees_per_update': 50,     # trees added by warm start when rows are appended
+    'max_estimators'  : 1000,   # refit from scratch instead of growing beyond this
+}
+
+# Feature matrices of the symbols kept in memory for modeling
+feature_loader = {
+    'max_symbols': 64,      # least recently used matrices are dropped beyond this
+}
+
 data_path = {
     'root_path': './data/',
 }
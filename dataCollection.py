@@ -1,24 +1,127 @@
 # -*- coding: utf-8 -*-
 
+import bisect
 import logging
+import threading
 import time
+from collections import namedtuple
+from concurrent.futures import as_completed
 from datetime import datetime
+from operator import itemgetter
 from typing import Sequence, List, Tuple, Dict
 
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
 
+from archive import ResponseArchive
 from database import Database
-from config import api_keys, db_init
-from util import standardize_datetime, validate_date_fmt
+from config import api_keys, db_init, http_session, ingestion, response_archive
+from scheduler import Scheduler, ThrottledError
+from util import standardize_datetime_array, validate_date_fmt
 
 
 logger = logging.getLogger(__name__)
 
+_session, _session_lock = None, threading.Lock()
+_archive = ResponseArchive()
+
 
 def _build_url(base_url: str, params: dict) -> str:
     return base_url + '&'.join(['{0}={1}'.format(key, params[key]) for key in params])
 
 
+def get_session() -> requests.Session:
+    '''Http session shared by all collectors, which keeps connections alive
+       and pooled per host, and negotiates compressed transfer
+    '''
+
+    global _session
+
+    with _session_lock:
+        if _session is None:
+            adapter = HTTPAdapter(pool_connections=http_session['pool_connections'],
+                                  pool_maxsize=http_session['pool_maxsize'])
+
+            _session = requests.Session()
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+            _session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+
+    return _session
+
+
+def _http_get(url: str) -> requests.Response:
+    timeout = (http_session['connect_timeout'], http_session['read_timeout'])
+    return get_session().get(url, timeout=timeout)
+
+
+def _is_throttled(r: requests.Response, data: dict) -> bool:
+    '''Whether the api call is rejected due to rate limit. Alpha Vantage 
+       responds with status 200 and a note instead of the data
+
+       @param: data: decoded response, None if not a successful one
+    '''
+
+    if r.status_code == 429:
+        return True
+
+    if data is not None and 'alphavantage' in r.url:
+        message = data.get('Note', '') or data.get('Information', '')
+        return 'call frequency' in message or 'rate limit' in message
+
+    return False
+
+
+def _fetch_json(provider: str, function: str, symbol: str, url: str, params: dict,
+                archive: bool = False) -> dict:
+    '''Make the api call, and archive the decoded response for data collection. In 
+       replay mode, the latest archived response of the same call is returned instead,
+       whichever outputsize it was requested with, as the plan depends on the stored data
+
+       @param: provider: name of the api provider, e.g. alpha_vantage
+       @param: function: api function/endpoint called
+       @param: symbol: stock symbol, or 'Market' for general news
+       @param: url: base url to which the parameters are appended
+       @param: params: parameters of the api call
+       @param: archive: whether the call is archived and replayed, only for collect_data.
+                        Other callers, e.g. the price polls of the web app, always make
+                        the api call
+       @return: decoded JSON object, empty if the call failed
+    '''
+
+    if archive and response_archive['replay']:
+        data = _archive.lookup(provider, function, symbol, params, ignored=('outputsize',))
+        if data is None:
+            logger.warning('No archived response for %s %s %s', provider, function, symbol)
+
+        return data or {}
+
+    r = _http_get(_build_url(url, params))
+    data = r.json() if r.status_code == 200 else None
+
+    if _is_throttled(r, data): raise ThrottledError('{0} {1}'.format(function, symbol))
+
+    if data is None:
+        return {}
+
+    if archive and response_archive['enabled']:
+        _archive.store(provider, function, symbol, params, data)
+
+    return data
+
+
+# Number of latest data points returned with outputsize 'compact'
+_compact_size = 100
+
+# Number of intraday data points in one trading day, including extended hours
+_intraday_session = ('04:00:00', '20:00:00')
+_intraday_bars = {'1min': 960, '5min': 192, '15min': 64, '30min': 32, '60min': 16}
+
+# Which outputsize to request and the last stored record of a time series
+FetchPlan = namedtuple('FetchPlan', ['outputsize', 'after'])
+
+
 class StockPrice(object):
     '''Collect time series data (price, volume, etc.) for specified symbol.
        See https://www.alphavantage.co/documentation/ for API details
@@ -26,21 +129,24 @@ class StockPrice(object):
 
     _base_url = 'https://www.alphavantage.co/query?'
 
-    def __init__(self, symbol: str, outputsize: str = 'compact'):
+    def __init__(self, symbol: str, outputsize: str = 'compact', archive: bool = False):
         self.symbol = symbol
         self.outputsize = outputsize   # 'compact' or 'full'
+        self.archive = archive         # archive/replay the api calls, see _fetch_json
         self.datatype = 'json'
 
         self.intraday_ts = {}
         self.daily_ts = {}
 
 
-    def _get_time_series(self, function: str, interval: str = None) -> dict:
+    def _get_time_series(self, function: str, interval: str = None, 
+                         outputsize: str = None) -> dict:
         '''Collect time series data using the API call
 
            @param: function: the time series of choice
            @param: interval: time interval between two consecutive data points
                              Only for intraday time series
+           @param: outputsize: 'compact' or 'full'. If None, use the one of this instance
            @return: decoded JSON object returned by API call
         '''
 
@@ -48,80 +154,94 @@ class StockPrice(object):
             'apikey'    : api_keys['alpha_vantage'],
             'function'  : function,
             'symbol'    : self.symbol,
-            'outputsize': self.outputsize,
+            'outputsize': outputsize or self.outputsize,
             'datatype'  : self.datatype,
         }
 
-        api_link = _build_url(StockPrice._base_url, params)
-        if interval: api_link += '&interval={interval}'.format(interval=interval)
+        if interval: params['interval'] = interval
 
-        r = requests.get(api_link)
-        
-        return r.json() if r.status_code == 200 else {}
+        return _fetch_json('alpha_vantage', function, self.symbol, StockPrice._base_url, params,
+                           archive=self.archive)
     
 
-    def get_intraday(self, interval: str):
+    def get_intraday(self, interval: str, outputsize: str = None):
         '''Collect intraday time series data'''
 
-        assert interval in ('1min', '5min', '15min', '30min', '60min'), 'Unsupported interval'
+        assert interval in _intraday_bars, 'Unsupported interval'
         function = 'TIME_SERIES_INTRADAY'
-        self.intraday_ts = self._get_time_series(function, interval)
+        self.intraday_ts = self._get_time_series(function, interval, outputsize)
 
 
-    def get_daily_adjusted(self):
+    def get_daily_adjusted(self, outputsize: str = None):
         '''Collect daily time series data'''
 
         function = 'TIME_SERIES_DAILY_ADJUSTED'
-        self.daily_ts = self._get_time_series(function)
+        self.daily_ts = self._get_time_series(function, outputsize=outputsize)
 
 
-    def _prc_data(self, data: dict, trim_to_date: str = '1900-01-01') -> Sequence[tuple]:
+    def _prc_data(self, data: dict, trim_to_date: str = '1900-01-01', 
+                  after: str = '') -> Sequence[tuple]:
         '''Process data for stock price/volume before inserting into database.
            Results are trimmed by date and sorted by datetime.
            Subjected to change with the table schema
 
            @param: data: collected time series data
            @param: trim_to_date: discard records earlier than the specified date, yyyy-mm-dd
+           @param: after: discard records not later than this date/datetime, e.g. the
+                          last one already stored
            @return: List of tuples with order consistent with the table schema
         '''
 
-        value_list = []
+        if 'Meta Data' not in data:
+            return []
 
-        if 'Meta Data' in data:
-            interval = data['Meta Data'].get('4. Interval', 'Daily')
-            key = 'Time Series ({interval})'.format(interval=interval)
+        interval = data['Meta Data'].get('4. Interval', 'Daily')
+        key = 'Time Series ({interval})'.format(interval=interval)
+        series = data[key]
 
-            # assume the default timezone is US/Eastern
-            for timestamp in sorted(data[key], reverse=True):
-                if interval == 'Daily':
-                    date_time = standardize_datetime(timestamp, '%Y-%m-%d', include_time=False)
-                else:
-                    date_time = standardize_datetime(timestamp, '%Y-%m-%d %H:%M:%S')
+        if len(series) == 0:
+            return []
 
-                if date_time >= trim_to_date:
-                    vals = data[key][timestamp]     # keys in vals include index
-                    temp_res = [date_time, 'US/Eastern'] + [vals[k] for k in sorted(vals)]
-                    value_list.append(tuple(temp_res))
-                else: 
-                    break
+        # assume the default timezone is US/Eastern
+        timestamps = sorted(series)   # from oldest to latest
 
-        value_list.reverse() # from oldest to latest
+        if interval == 'Daily':
+            date_time = standardize_datetime_array(timestamps, '%Y-%m-%d', include_time=False)
+        else:
+            date_time = standardize_datetime_array(timestamps, '%Y-%m-%d %H:%M:%S')
 
-        return value_list
+        # Keep the latest records, not earlier than trim_to_date and later than after
+        first = max(bisect.bisect_left(date_time, trim_to_date), bisect.bisect_right(date_time, after))
+
+        # keys in vals include index
+        get_vals = itemgetter(*sorted(series[timestamps[-1]]))
+
+        return [(date_time[i], 'US/Eastern') + get_vals(series[timestamps[i]])
+                for i in range(first, len(timestamps))]
 
 
-    def prc_data(self, trim_to_date: str = '1900-01-01', db: str = ''):
+    def prc_data(self, trim_to_date: str = '1900-01-01', db: str = '',
+                 intraday_after: str = '', daily_after: str = '', bulk: bool = None):
+        '''Process collected data and insert it into the database if provided
+
+           @param: bulk: insert through the bulk loader of the database. If None, 
+                         use it for series of at least ingestion['bulk_load_rows'] records
+        '''
         assert validate_date_fmt(trim_to_date, '%Y-%m-%d'), 'Date format must be yyyy-mm-dd'
         
-        self.intraday_ts = self._prc_data(self.intraday_ts, trim_to_date)
-        self.daily_ts = self._prc_data(self.daily_ts, trim_to_date)
+        self.intraday_ts = self._prc_data(self.intraday_ts, trim_to_date, intraday_after)
+        self.daily_ts = self._prc_data(self.daily_ts, trim_to_date, daily_after)
 
         if db:
-            if len(self.intraday_ts) > 0:
-                Database.insert_data_intraday(db, self.symbol, self.intraday_ts)
+            for data, insert, load in ((self.intraday_ts, Database.insert_data_intraday, Database.load_data_intraday),
+                                       (self.daily_ts, Database.insert_data_daily, Database.load_data_daily)):
+                if len(data) == 0:
+                    continue
 
-            if len(self.daily_ts) > 0:
-                Database.insert_data_daily(db, self.symbol, self.daily_ts)
+                if bulk or bulk is None and len(data) >= ingestion['bulk_load_rows']:
+                    load(db, self.symbol, data)
+                else:
+                    insert(db, self.symbol, data)
 
 
 class StockNews(object):
@@ -130,12 +250,14 @@ class StockNews(object):
     _base_url = 'https://stocknewsapi.com/api/v1'
 
     @classmethod
-    def get_ticker_news(cls, symbol: str, page: int = 0, date_range: str = None) -> Dict[str, dict]:
+    def get_ticker_news(cls, symbol: str, page: int = 0, date_range: str = None,
+                        archive: bool = False) -> Dict[str, dict]:
         '''Collect news for the specified symbol
            
            @param: symbol: stock symbol
            @param: page: use page parameter (e.g. 2, 3, ...) to obtain more than 50 results
            @param: date_range: retrieve news on specific dates, format: mmddyyyy and today.
+           @param: archive: whether the call is archived and replayed, see _fetch_json
 
            page and date_range can only be used with premium plan
         '''
@@ -150,18 +272,19 @@ class StockNews(object):
         if page: params['page'] = page
         if date_range: params['date_range'] = date_range
 
-        api_link = _build_url(StockNews._base_url + '?', params)
-        r = requests.get(api_link)
+        url = StockNews._base_url + '?'
         
-        return {symbol: r.json() if r.status_code == 200 else {}}
+        return {symbol: _fetch_json('stock_news', 'tickers', symbol, url, params, archive=archive)}
 
 
     @classmethod
-    def get_general_market_news(cls, page: int = 0, date_range: str = None) -> Dict[str, dict]:
+    def get_general_market_news(cls, page: int = 0, date_range: str = None,
+                                archive: bool = False) -> Dict[str, dict]:
         '''Collect general news for market. Only available with premium plan
            
            @param: page: use page parameter (e.g. 2, 3, ...) to obtain more than 50 results
            @param: date_range: retrieve news on specific dates, format: mmddyyyy and today.
+           @param: archive: whether the call is archived and replayed, see _fetch_json
         '''
 
         params = {
@@ -174,10 +297,9 @@ class StockNews(object):
         if page: params['page'] = page
         if date_range: params['date_range'] = date_range
 
-        api_link = _build_url(cls._base_url + '/category?', params)
-        r = requests.get(api_link)
+        url = cls._base_url + '/category?'
         
-        return {'Market': r.json() if r.status_code == 200 else {}}
+        return {'Market': _fetch_json('stock_news', 'category', 'Market', url, params, archive=archive)}
 
 
     @classmethod
@@ -194,21 +316,20 @@ class StockNews(object):
         assert validate_date_fmt(trim_to_date, '%Y-%m-%d'), 'Date format must be yyyy-mm-dd'
 
         [(symbol, data)] = result.items()
-        value_list = []
 
         # Convert datatime to this timezone
         timezone = 'US/Eastern'
 
-        for item in data.get('data', []):
-            keys = ('title', 'news_url', 'image_url', 'text', 'sentiment', 'source_name')
-            date_time = standardize_datetime(item['date'], '%a, %d %b %Y %H:%M:%S %z', 
-                                             to_timezone=timezone)
-            
-            if date_time >= trim_to_date:
-                temp_res = [symbol, date_time, timezone] + [item[k] for k in keys]
-                value_list.append(tuple(temp_res))
+        items = data.get('data', [])
+        keys = ('title', 'news_url', 'image_url', 'text', 'sentiment', 'source_name')
+        get_vals = itemgetter(*keys)
 
-        value_list = sorted(value_list, key=lambda item: item[1])  # sort by date_time
+        date_time = standardize_datetime_array([item['date'] for item in items], 
+                                               '%a, %d %b %Y %H:%M:%S %z', to_timezone=timezone)
+
+        value_list = [(symbol, date_time[i], timezone) + get_vals(items[i])
+                      for i in sorted(range(len(items)), key=date_time.__getitem__)  # sort by date_time
+                      if date_time[i] >= trim_to_date]
 
         if db and len(value_list) > 0:
             Database.insert_data_news(db, value_list)
@@ -216,37 +337,162 @@ class StockNews(object):
         return value_list
 
 
+def _count_trade_days(since: str, until: str) -> int:
+    '''Number of weekdays after `since` up to and including `until`, yyyy-mm-dd'''
+
+    return max(0, int(np.busday_count(np.datetime64(since) + 1, np.datetime64(until) + 1)))
+
+
+def _choose_outputsize(n_missing: int) -> str:
+    return 'compact' if n_missing <= _compact_size else 'full'
+
+
+def plan_fetch(db: str, symbol: str, today: str, interval: str = '15min') -> Dict[str, FetchPlan]:
+    '''Plan the price data to collect for the symbol, based on the last record stored
+       in the daily/intraday table. A series is skipped if it is already up to date, 
+       and only fetched in full if more data points are missing than a compact request
+       returns. Holidays are counted as trade days, so the plan never under-fetches
+
+       @param: db: name of the database
+       @param: symbol: stock symbol
+       @param: today: date of collection, yyyy-mm-dd
+       @param: interval: time interval of the intraday series
+       @return: FetchPlan for 'daily' and 'intraday' series, None if nothing to fetch
+    '''
+
+    plan = {}
+
+    last_day = Database.get_last_trade_day(db, symbol)
+
+    if not last_day:
+        plan['daily'] = FetchPlan('full', '')
+    else:
+        n_missing = _count_trade_days(last_day, today)
+        plan['daily'] = FetchPlan(_choose_outputsize(n_missing), last_day) if n_missing > 0 else None
+
+    last_time = Database.get_last_intraday_time(db, symbol)
+
+    if not last_time:
+        plan['intraday'] = FetchPlan('full', '')
+    else:
+        last_day, last_clock = last_time.split(' ')
+        session_open, session_close = (datetime.strptime(t, '%H:%M:%S') for t in _intraday_session)
+        
+        # Data points left in the session of the last stored record, and in later sessions
+        remaining = session_close - max(session_open, datetime.strptime(last_clock, '%H:%M:%S'))
+        n_missing = max(0, int(remaining.total_seconds() // 60) // int(interval[:-3]))
+        n_missing += _count_trade_days(last_day, today) * _intraday_bars[interval]
+
+        if n_missing > 0:
+            plan['intraday'] = FetchPlan(_choose_outputsize(n_missing), last_time)
+        else:
+            plan['intraday'] = None
+
+    logger.info('Fetch plan for %s: %s', symbol, plan)
+
+    return plan
+
+
+def _collect_news(scheduler: Scheduler, db: str, symbol: str, today: str) -> int:
+    if symbol == 'Market':
+        news = scheduler.call('stock_news', StockNews.get_general_market_news, archive=True)
+    else:
+        news = scheduler.call('stock_news', StockNews.get_ticker_news, symbol=symbol, archive=True)
+
+    news = StockNews.prc_data(news, trim_to_date=today, db=db)
+    logger.info('Insert %d %s news into the news table', len(news), symbol)
+
+    return len(news)
+
+
+def _collect_price(scheduler: Scheduler, db: str, symbol: str, today: str) -> int:
+    interval = '15min'
+    plan = plan_fetch(db, symbol, today, interval)
+
+    sp = StockPrice(symbol, archive=True)
+    if plan['intraday']:
+        scheduler.call('alpha_vantage', sp.get_intraday, interval, plan['intraday'].outputsize)
+    if plan['daily']:
+        scheduler.call('alpha_vantage', sp.get_daily_adjusted, plan['daily'].outputsize)
+
+    # Insert exactly the records later than the ones already stored
+    intraday_after = plan['intraday'].after if plan['intraday'] else ''
+    daily_after = plan['daily'].after if plan['daily'] else ''
+    sp.prc_data(db=db, intraday_after=intraday_after, daily_after=daily_after)
+
+    logger.info('Insert %d rows into %s.%s_Intraday', len(sp.intraday_ts), db, symbol)
+    logger.info('Insert %d rows into %s.%s_Daily', len(sp.daily_ts), db, symbol)
+
+    return len(sp.intraday_ts) + len(sp.daily_ts)
+
+
 def collect_data():
+    '''Collect news and price data for all symbols. Api calls are made concurrently,
+       as fast as the rate limit of each provider allows
+    '''
     logger.info('Start data collection')
 
     db, symbols = db_init['db'], db_init['symbols']
     today = datetime.today().strftime('%Y-%m-%d')
-    
-    gen_news = StockNews.get_general_market_news()
-    gen_news = StockNews.prc_data(gen_news, trim_to_date=today, db=db)
+    start_time = time.monotonic()
 
-    logger.info('Insert %d market news into the news table', len(gen_news))
-    time.sleep(10)
-    
-    for symbol in symbols:
-        sym_news = StockNews.get_ticker_news(symbol=symbol)
-        sym_news = StockNews.prc_data(sym_news, trim_to_date=today, db=db)
-        
-        logger.info('Insert %d %s news into the news table', len(sym_news), symbol)
-        if symbol != symbols[-1]: time.sleep(10)
-    
-    for symbol in symbols:
-        outputsize, interval = 'compact', '15min'
-        sp = StockPrice(symbol, outputsize)
-        sp.get_intraday(interval)
-        sp.get_daily_adjusted()
-        sp.prc_data(trim_to_date=today, db=db)
-        
-        logger.info('Insert %d rows into %s.%s_Intraday', len(sp.intraday_ts), db, symbol)
-        logger.info('Insert %d rows into %s.%s_Daily', len(sp.daily_ts), db, symbol)
-        if symbol != symbols[-1]: time.sleep(30)
+    # No need to respect the rate limit when replaying archived responses
+    rate_limit = {} if response_archive['replay'] else None
+
+    with Scheduler(rate_limit) as scheduler:
+        jobs = {scheduler.submit(_collect_news, scheduler, db, 'Market', today): ('news', 'Market')}
+
+        for symbol in symbols:
+            jobs[scheduler.submit(_collect_news, scheduler, db, symbol, today)] = ('news', symbol)
+            jobs[scheduler.submit(_collect_price, scheduler, db, symbol, today)] = ('price', symbol)
+
+        for job in as_completed(jobs):
+            try:
+                job.result()
+            except Exception:
+                logger.exception('Failed to collect %s data for %s', *jobs[job])
+
+    logger.info('Complete data collection in %.1f seconds', time.monotonic() - start_time)
+
+
+def replay_archive(db: str = '', symbols: Sequence[str] = ()):
+    '''Rebuild the database from all archived responses in the order they were
+       fetched, without network access. As in collect_data, news are trimmed to 
+       the date of fetching and only prices later than the stored ones are inserted
+
+       @param: db: name of the database. If empty, use the default one
+       @param: symbols: sequence of symbols to replay. If empty, use all archived ones
+    '''
+    logger.info('Start replaying archived responses')
+
+    db = db or db_init['db']
+    start_time, count = time.monotonic(), 0
+
+    for entry in _archive.entries():
+        symbol = entry['symbol']
+        if symbols and symbol not in symbols and symbol != 'Market':
+            continue
+
+        data = _archive.load(entry['digest'])
+
+        if entry['provider'] == 'stock_news':
+            news = StockNews.prc_data({symbol: data}, trim_to_date=entry['fetch_time'][:10], db=db)
+            count += len(news)
+
+        elif entry['function'] == 'TIME_SERIES_INTRADAY':
+            sp = StockPrice(symbol)
+            sp.intraday_ts = data
+            sp.prc_data(db=db, intraday_after=Database.get_last_intraday_time(db, symbol) or '')
+            count += len(sp.intraday_ts)
+
+        else:
+            sp = StockPrice(symbol)
+            sp.daily_ts = data
+            sp.prc_data(db=db, daily_after=Database.get_last_trade_day(db, symbol) or '')
+            count += len(sp.daily_ts)
 
-    logger.info('Complete data collection')
+    logger.info('Complete replaying archived responses: %d records in %.1f seconds', 
+                count, time.monotonic() - start_time)
 
 
 if __name__ == '__main__':
@@ -1,15 +1,53 @@
 # -*- coding: utf-8 -*-
 
+import bisect
+import csv
 import logging
-from typing import Sequence, List, Tuple, Dict
+import os
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Sequence, List, Tuple, Dict
 
 import mysql.connector
+import numpy as np
+import pandas as pd
+from mysql.connector import pooling
 
-from config import db_access, db_init
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+from config import data_path, db_access, db_backend, db_init, db_pool, query_cache
 
 
 logger = logging.getLogger(__name__)
 
+# Number of records sent in one multi-row insert statement
+_insert_batch_size = 1000
+
+# Number of rows fetched at a time when streaming a query result
+_fetch_chunk_size = 10000
+
+# Records are staged in csv files of this folder before being bulk loaded
+_stage_folder = data_path['root_path'] + 'stage/'
+
+# Columns loaded by the bulk loader, the first one is the natural key
+intraday_columns = ('date_time', 'timezone', 'open', 'high', 'low', 'close', 'volume')
+daily_load_columns = ('date_string', 'timezone', 'open', 'high', 'low', 'close', 
+                      'adjusted_close', 'volume', 'dividend', 'split_coeff')
+
+# Columns of the data frames returned by bulk retrieval
+daily_columns = ('date', 'open', 'high', 'low', 'close', 'adj_close', 'volume')
+news_columns = ('date_time', 'title', 'content', 'sentiment')
+
+# Column types of daily data read into numpy arrays
+daily_dtypes = (('date', 'U10'), ('open', 'float64'), ('high', 'float64'), ('low', 'float64'),
+                ('close', 'float64'), ('adj_close', 'float64'), ('volume', 'int64'))
+
 
 #############################################################
 # SQL Statements
@@ -22,27 +60,30 @@ create_table_intraday = \
 '''
 CREATE TABLE IF NOT EXISTS {symbol}_Intraday (
     id int NOT NULL AUTO_INCREMENT,
-    date_time varchar(255) NOT NULL, /* yyyy-mm-dd hh:mm:ss */
+    date_time datetime NOT NULL,
     timezone varchar(255) NOT NULL,
-    open varchar(255) NOT NULL,
-    high varchar(255) NOT NULL,
-    low varchar(255) NOT NULL,
-    close varchar(255) NOT NULL,
-    volume varchar(255) NOT NULL,
-    PRIMARY KEY (id)
+    open double NOT NULL,
+    high double NOT NULL,
+    low double NOT NULL,
+    close double NOT NULL,
+    volume bigint NOT NULL,
+    PRIMARY KEY (id),
+    UNIQUE KEY uk_date_time (date_time)
 );
 '''
 
 insert_into_intraday = \
 '''
 INSERT INTO {symbol}_Intraday (date_time, timezone, open, high, low, close, volume) 
-VALUES (%s, %s, %s, %s, %s, %s, %s);
+VALUES (%s, %s, %s, %s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE timezone = VALUES(timezone), open = VALUES(open), high = VALUES(high),
+    low = VALUES(low), close = VALUES(close), volume = VALUES(volume);
 '''
 
 select_from_intraday = \
 '''
-SELECT date_time, open, high, low, close, volume FROM {symbol}_Intraday
-WHERE date_time >= '{start}' ORDER BY date_time;
+SELECT DATE_FORMAT(date_time, '%Y-%m-%d %H:%i:%s'), open, high, low, close, volume 
+FROM {symbol}_Intraday WHERE date_time >= '{start}' ORDER BY date_time;
 '''
 
 # ===========================================================
@@ -50,39 +91,43 @@ create_table_daily = \
 '''
 CREATE TABLE IF NOT EXISTS {symbol}_Daily (
     id int NOT NULL AUTO_INCREMENT,
-    date_string varchar(255) NOT NULL, /* yyyy-mm-dd */
+    date_string date NOT NULL,
     timezone varchar(255) NOT NULL,    /* e.g. UTC-05:00 */
-    open varchar(255) NOT NULL,
-    high varchar(255) NOT NULL,
-    low varchar(255) NOT NULL,
-    close varchar(255) NOT NULL,
-    adjusted_close varchar(255) NOT NULL,
-    volume varchar(255) NOT NULL,
-    dividend varchar(255),
-    split_coeff varchar(255),
-    PRIMARY KEY (id)
+    open double NOT NULL,
+    high double NOT NULL,
+    low double NOT NULL,
+    close double NOT NULL,
+    adjusted_close double NOT NULL,
+    volume bigint NOT NULL,
+    dividend double,
+    split_coeff double,
+    PRIMARY KEY (id),
+    UNIQUE KEY uk_date_string (date_string)
 );
 '''
 
 insert_into_daily = \
 '''
 INSERT INTO {symbol}_Daily (date_string, timezone, open, high, low, close, adjusted_close, volume, dividend, split_coeff) 
-VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
+VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE timezone = VALUES(timezone), open = VALUES(open), high = VALUES(high),
+    low = VALUES(low), close = VALUES(close), adjusted_close = VALUES(adjusted_close), 
+    volume = VALUES(volume), dividend = VALUES(dividend), split_coeff = VALUES(split_coeff);
 '''
 
 select_from_daily = \
 '''
-SELECT date_string, open, high, low, close, adjusted_close, volume FROM {symbol}_Daily
-WHERE date_string >= '{start}' ORDER BY date_string;
+SELECT DATE_FORMAT(date_string, '%Y-%m-%d'), open, high, low, close, adjusted_close, volume 
+FROM {symbol}_Daily WHERE date_string >= '{start}' ORDER BY date_string;
 '''
 
 # ===========================================================
 create_table_stock_news = \
 '''
-CREATE TABLE IF NOT EXISTS Stock_News (
+CREATE TABLE IF NOT EXISTS {table} (
     id int NOT NULL AUTO_INCREMENT,
     symbol varchar(15) NOT NULL,     /* stock symbol or 'Market' */
-    date_time varchar(255) NOT NULL,
+    date_time datetime NOT NULL,
     timezone varchar(255) NOT NULL,
     title varchar(1023) NOT NULL,
     news_url varchar(1023),
@@ -90,32 +135,760 @@ CREATE TABLE IF NOT EXISTS Stock_News (
     content text(65535),
     sentiment varchar(255),
     source_name varchar(255),
-    PRIMARY KEY (id)
+    title_hash binary(16) AS (UNHEX(MD5(title))) STORED,
+    PRIMARY KEY (id),
+    UNIQUE KEY uk_news (symbol, date_time, title_hash)  /* also the index on (symbol, date_time) */
 );
 '''
 
 insert_into_stock_news = \
 '''
 INSERT INTO Stock_News (symbol, date_time, timezone, title, news_url, image_url, content, sentiment, source_name) 
-VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s);
+VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE timezone = VALUES(timezone), news_url = VALUES(news_url), 
+    image_url = VALUES(image_url), content = VALUES(content), sentiment = VALUES(sentiment),
+    source_name = VALUES(source_name);
 '''
 
 select_from_stock_news = \
 '''
-SELECT date_time, title, content, sentiment FROM Stock_News 
+SELECT DATE_FORMAT(date_time, '%Y-%m-%d %H:%i:%s'), title, content, sentiment FROM Stock_News 
 WHERE symbol = '{symbol}' AND date_time >= '{start}' ORDER BY date_time;
 '''
 
+# ===========================================================
+# Natural keys for tables created without them. Duplicated rows are removed
+# first, keeping the earliest inserted one
+add_key_intraday = \
+'''
+DELETE t1 FROM {symbol}_Intraday t1 JOIN {symbol}_Intraday t2 
+ON t1.date_time = t2.date_time AND t1.id > t2.id;
+ALTER TABLE {symbol}_Intraday ADD UNIQUE KEY uk_date_time (date_time);
+'''
+
+add_key_daily = \
+'''
+DELETE t1 FROM {symbol}_Daily t1 JOIN {symbol}_Daily t2 
+ON t1.date_string = t2.date_string AND t1.id > t2.id;
+ALTER TABLE {symbol}_Daily ADD UNIQUE KEY uk_date_string (date_string);
+'''
+
+add_key_stock_news = \
+'''
+ALTER TABLE Stock_News ADD COLUMN title_hash binary(16) AS (UNHEX(MD5(title))) STORED;
+DELETE t1 FROM Stock_News t1 JOIN Stock_News t2 ON t1.symbol = t2.symbol 
+AND t1.date_time = t2.date_time AND t1.title_hash = t2.title_hash AND t1.id > t2.id;
+ALTER TABLE Stock_News ADD UNIQUE KEY uk_news (symbol, date_time, title_hash);
+'''
+
+# ===========================================================
+# Bulk retrieval for multiple symbols in one round-trip
+select_from_daily_union = \
+'''
+SELECT '{symbol}', DATE_FORMAT(date_string, '%Y-%m-%d'), open, high, low, close, adjusted_close, volume 
+FROM {symbol}_Daily WHERE date_string >= '{start}'
+'''
+
+select_from_stock_news_bulk = \
+'''
+SELECT symbol, DATE_FORMAT(date_time, '%Y-%m-%d %H:%i:%s'), title, content, sentiment FROM Stock_News 
+WHERE symbol IN ({symbols}) AND date_time >= '{start}' ORDER BY symbol, date_time;
+'''
+
+# ===========================================================
+# Online migration of tables with untyped (varchar) columns. Rows are copied in
+# chunks of id into a typed shadow table, which then replaces the original one
+select_column_type = \
+'''
+SELECT DATA_TYPE FROM information_schema.COLUMNS 
+WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = '{table}' AND COLUMN_NAME = '{column}'
+'''
+
+select_max_id = 'SELECT COALESCE(MAX(id), 0) FROM {table}'
+
+copy_chunk_intraday = \
+'''
+INSERT IGNORE INTO {to_table} (date_time, timezone, open, high, low, close, volume)
+SELECT date_time, timezone, open, high, low, close, volume FROM {from_table} 
+WHERE id > {id_from} AND id <= {id_to} ORDER BY id
+'''
+
+copy_chunk_daily = \
+'''
+INSERT IGNORE INTO {to_table} (date_string, timezone, open, high, low, close, adjusted_close, volume, dividend, split_coeff)
+SELECT date_string, timezone, open, high, low, close, adjusted_close, volume, NULLIF(dividend, ''), NULLIF(split_coeff, '')
+FROM {from_table} WHERE id > {id_from} AND id <= {id_to} ORDER BY id
+'''
+
+copy_chunk_stock_news = \
+'''
+INSERT IGNORE INTO {to_table} (symbol, date_time, timezone, title, news_url, image_url, content, sentiment, source_name)
+SELECT symbol, date_time, timezone, title, news_url, image_url, content, sentiment, source_name
+FROM {from_table} WHERE id > {id_from} AND id <= {id_to} ORDER BY id
+'''
+
+# Rows inserted since the last chunk are copied with writes blocked, and both tables
+# swapped before the lock is released (RENAME TABLE under LOCK TABLES, MySQL 8.0.13+)
+lock_tables = 'LOCK TABLES {table} WRITE, tmp_{table} WRITE'
+
+unlock_tables = 'UNLOCK TABLES'
+
+swap_tables = 'RENAME TABLE {table} TO old_{table}, tmp_{table} TO {table}'
+
 # ===========================================================
 select_last_trade_day = \
 '''
-SELECT MAX(date_string) FROM {symbol}_Daily
+SELECT DATE_FORMAT(MAX(date_string), '%Y-%m-%d') FROM {symbol}_Daily
+'''
+
+select_last_intraday_time = \
+'''
+SELECT DATE_FORMAT(MAX(date_time), '%Y-%m-%d %H:%i:%s') FROM {symbol}_Intraday
+'''
+
+# ===========================================================
+# Bulk loading: records are loaded into a staging table without any index, then 
+# merged into the table in one statement ordered by the key
+create_stage_table = 'CREATE TEMPORARY TABLE {stage} SELECT {columns} FROM {table} LIMIT 0'
+
+load_stage_table = \
+'''
+LOAD DATA LOCAL INFILE '{file}' INTO TABLE {stage} 
+FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"' LINES TERMINATED BY '\\n' ({columns})
+'''
+
+merge_stage_table = \
+'''
+INSERT INTO {table} ({columns}) SELECT {columns} FROM {stage} ORDER BY {key}
+ON DUPLICATE KEY UPDATE {update}
+'''
+
+update_column = '{0} = VALUES({0})'
+
+drop_stage_table = 'DROP TEMPORARY TABLE IF EXISTS {stage}'
+
+
+
+#############################################################
+# SQL Statements of the embedded backend (DuckDB). Records to insert are read 
+# from the registered data frame _batch with columns c0, c1, ... and the row
+# number _row. Records with the same key are inserted once, keeping the last one
+
+# ===========================================================
+duckdb_create_table_intraday = \
+'''
+CREATE TABLE IF NOT EXISTS {symbol}_Intraday (
+    date_time timestamp NOT NULL PRIMARY KEY,
+    timezone varchar NOT NULL,
+    open double NOT NULL,
+    high double NOT NULL,
+    low double NOT NULL,
+    close double NOT NULL,
+    volume bigint NOT NULL
+);
+'''
+
+duckdb_insert_into_intraday = \
+'''
+INSERT INTO {symbol}_Intraday (date_time, timezone, open, high, low, close, volume) 
+SELECT DISTINCT ON (c0) c0, c1, c2, c3, c4, c5, c6 FROM _batch ORDER BY c0, _row DESC
+ON CONFLICT (date_time) DO UPDATE SET timezone = EXCLUDED.timezone, open = EXCLUDED.open, 
+    high = EXCLUDED.high, low = EXCLUDED.low, close = EXCLUDED.close, volume = EXCLUDED.volume;
+'''
+
+duckdb_select_from_intraday = \
+'''
+SELECT strftime(date_time, '%Y-%m-%d %H:%M:%S'), open, high, low, close, volume 
+FROM {symbol}_Intraday WHERE date_time >= '{start}' ORDER BY date_time;
+'''
+
+# ===========================================================
+duckdb_create_table_daily = \
+'''
+CREATE TABLE IF NOT EXISTS {symbol}_Daily (
+    date_string date NOT NULL PRIMARY KEY,
+    timezone varchar NOT NULL,
+    open double NOT NULL,
+    high double NOT NULL,
+    low double NOT NULL,
+    close double NOT NULL,
+    adjusted_close double NOT NULL,
+    volume bigint NOT NULL,
+    dividend double,
+    split_coeff double
+);
+'''
+
+duckdb_insert_into_daily = \
+'''
+INSERT INTO {symbol}_Daily (date_string, timezone, open, high, low, close, adjusted_close, volume, dividend, split_coeff) 
+SELECT DISTINCT ON (c0) c0, c1, c2, c3, c4, c5, c6, c7, c8, c9 FROM _batch ORDER BY c0, _row DESC
+ON CONFLICT (date_string) DO UPDATE SET timezone = EXCLUDED.timezone, open = EXCLUDED.open, 
+    high = EXCLUDED.high, low = EXCLUDED.low, close = EXCLUDED.close, 
+    adjusted_close = EXCLUDED.adjusted_close, volume = EXCLUDED.volume, 
+    dividend = EXCLUDED.dividend, split_coeff = EXCLUDED.split_coeff;
+'''
+
+duckdb_select_from_daily = \
+'''
+SELECT strftime(date_string, '%Y-%m-%d'), open, high, low, close, adjusted_close, volume 
+FROM {symbol}_Daily WHERE date_string >= '{start}' ORDER BY date_string;
+'''
+
+# ===========================================================
+duckdb_create_table_stock_news = \
+'''
+CREATE TABLE IF NOT EXISTS {table} (
+    symbol varchar NOT NULL,     /* stock symbol or 'Market' */
+    date_time timestamp NOT NULL,
+    timezone varchar NOT NULL,
+    title varchar NOT NULL,
+    news_url varchar,
+    image_url varchar,
+    content varchar,
+    sentiment varchar,
+    source_name varchar,
+    PRIMARY KEY (symbol, date_time, title)
+);
+'''
+
+duckdb_insert_into_stock_news = \
+'''
+INSERT INTO Stock_News (symbol, date_time, timezone, title, news_url, image_url, content, sentiment, source_name) 
+SELECT DISTINCT ON (c0, c1, c3) c0, c1, c2, c3, c4, c5, c6, c7, c8 FROM _batch ORDER BY c0, c1, c3, _row DESC
+ON CONFLICT (symbol, date_time, title) DO UPDATE SET timezone = EXCLUDED.timezone, 
+    news_url = EXCLUDED.news_url, image_url = EXCLUDED.image_url, content = EXCLUDED.content, 
+    sentiment = EXCLUDED.sentiment, source_name = EXCLUDED.source_name;
+'''
+
+duckdb_select_from_stock_news = \
+'''
+SELECT strftime(date_time, '%Y-%m-%d %H:%M:%S'), title, content, sentiment FROM Stock_News 
+WHERE symbol = '{symbol}' AND date_time >= '{start}' ORDER BY date_time;
+'''
+
+# ===========================================================
+duckdb_select_from_daily_union = \
+'''
+SELECT '{symbol}', strftime(date_string, '%Y-%m-%d'), open, high, low, close, adjusted_close, volume 
+FROM {symbol}_Daily WHERE date_string >= '{start}'
+'''
+
+duckdb_select_from_stock_news_bulk = \
+'''
+SELECT symbol, strftime(date_time, '%Y-%m-%d %H:%M:%S'), title, content, sentiment FROM Stock_News 
+WHERE symbol IN ({symbols}) AND date_time >= '{start}' ORDER BY symbol, date_time;
+'''
+
+# ===========================================================
+duckdb_select_last_trade_day = \
+'''
+SELECT strftime(MAX(date_string), '%Y-%m-%d') FROM {symbol}_Daily
+'''
+
+duckdb_select_last_intraday_time = \
+'''
+SELECT strftime(MAX(date_time), '%Y-%m-%d %H:%M:%S') FROM {symbol}_Intraday
+'''
+
+# ===========================================================
+duckdb_create_stage_table = 'CREATE TEMPORARY TABLE {stage} AS SELECT {columns} FROM {table} LIMIT 0'
+
+duckdb_load_stage_table = "COPY {stage} ({columns}) FROM '{file}' (FORMAT csv, HEADER false)"
+
+duckdb_merge_stage_table = \
+'''
+INSERT INTO {table} ({columns}) SELECT {columns} FROM {stage} ORDER BY {key}
+ON CONFLICT ({key}) DO UPDATE SET {update}
 '''
 
+duckdb_update_column = '{0} = EXCLUDED.{0}'
+
+duckdb_drop_stage_table = 'DROP TABLE IF EXISTS {stage}'
+
+# Statements used by Database, by name, for each backend
+_statement_names = (
+    'create_table_intraday', 'insert_into_intraday', 'select_from_intraday',
+    'create_table_daily', 'insert_into_daily', 'select_from_daily',
+    'create_table_stock_news', 'insert_into_stock_news', 'select_from_stock_news',
+    'select_from_daily_union', 'select_from_stock_news_bulk',
+    'select_last_trade_day', 'select_last_intraday_time',
+    'create_stage_table', 'load_stage_table', 'merge_stage_table', 'update_column', 'drop_stage_table',
+)
+
+mysql_sql = {name: globals()[name] for name in _statement_names}
+duckdb_sql = {name: globals()['duckdb_' + name] for name in _statement_names}
+
 
 #############################################################
+class ConnectionPool(object):
+    '''Process-wide pools of connections, one pool per database used as the
+       default schema of its connections
+    '''
+
+    def __init__(self, pool_size: int = 0, checkout_timeout: float = 0):
+        self.pool_size = pool_size or db_pool['pool_size']
+        self.checkout_timeout = checkout_timeout or db_pool['checkout_timeout']
+
+        self._pid = os.getpid()
+        self._pools = {}
+        self._lock = threading.Lock()
+        self._reset_stats()
+
+
+    def _reset_stats(self):
+        self._stats = {
+            'checkouts'        : 0,     # connections borrowed
+            'in_use'           : 0,     # connections currently borrowed
+            'max_in_use'       : 0,
+            'saturated'        : 0,     # checkouts that had to wait for a free connection
+            'timeouts'         : 0,     # checkouts given up after checkout_timeout
+            'reconnects'       : 0,     # broken connections found by the health check
+            'checkout_time'    : 0.0,   # seconds spent in checkouts
+            'max_checkout_time': 0.0,
+        }
+
+
+    def _get_pool(self, db: str) -> pooling.MySQLConnectionPool:
+        with self._lock:
+            # Connections cannot be shared with a forked process
+            if self._pid != os.getpid():
+                self._pid, self._pools = os.getpid(), {}
+                self._reset_stats()
+
+            if db not in self._pools:
+                self._pools[db] = pooling.MySQLConnectionPool(
+                    pool_name='{0}_{1}'.format(db, self._pid), pool_size=self.pool_size,
+                    pool_reset_session=True, database=db,
+                    allow_local_infile_in_path=os.path.abspath(_stage_folder), **db_access)
+
+            return self._pools[db]
+
+
+    @contextmanager
+    def connection(self, db: str):
+        '''Borrow a healthy connection to the database, returned to the pool on exit'''
+
+        pool = self._get_pool(db)
+        start, saturated = time.monotonic(), False
+
+        while True:
+            try:
+                connect = pool.get_connection()
+                break
+            except mysql.connector.errors.PoolError:
+                saturated = True
+
+                if time.monotonic() - start > self.checkout_timeout:
+                    with self._lock: self._stats['timeouts'] += 1
+                    raise
+
+                time.sleep(0.01)
+
+        try:
+            # Health check, e.g. connection dropped by the server after wait_timeout
+            if not connect.is_connected():
+                with self._lock: self._stats['reconnects'] += 1
+                connect.reconnect(attempts=3, delay=1)
+
+            checkout_time = time.monotonic() - start
+
+            with self._lock:
+                stats = self._stats
+                stats['checkouts'] += 1
+                stats['in_use'] += 1
+                stats['max_in_use'] = max(stats['max_in_use'], stats['in_use'])
+                stats['saturated'] += saturated
+                stats['checkout_time'] += checkout_time
+                stats['max_checkout_time'] = max(stats['max_checkout_time'], checkout_time)
+
+        except Exception:
+            connect.close()
+            raise
+
+        try:
+            yield connect
+        finally:
+            connect.close()
+            with self._lock: self._stats['in_use'] -= 1
+
+
+    def stats(self) -> Dict[str, float]:
+        '''Counters of checkout latency and pool saturation'''
+
+        with self._lock:
+            stats = dict(self._stats)
+
+        stats['pool_size'] = self.pool_size
+        stats['avg_checkout_time'] = stats['checkout_time'] / max(1, stats['checkouts'])
+        stats['saturation_ratio'] = stats['saturated'] / max(1, stats['checkouts'])
+
+        return stats
+
+
+class QueryCache(object):
+    '''In-process cache of query results by (db, table, start). Results of a table
+       are dropped as soon as data is inserted into it. A query with a later start 
+       than a cached one is answered by filtering the cached result
+    '''
+
+    def __init__(self, enabled: bool = None):
+        self.enabled = query_cache['enabled'] if enabled is None else enabled
+
+        self._pid = os.getpid()
+        self._entries = {}      # (db, table) -> {(kind, start): result}
+        self._versions = {}     # (db, table) -> number of invalidations
+        self._lock = threading.Lock()
+        self._reset_stats()
+
+
+    def _reset_stats(self):
+        self._stats = {
+            'hits'         : 0,     # results found in cache
+            'subset_hits'  : 0,     # hits filtered from a result with an earlier start
+            'misses'       : 0,     # results queried from the database
+            'invalidations': 0,     # tables whose results were dropped
+        }
+
+
+    def _check_pid(self):
+        # Results may be stale in a forked process
+        if self._pid != os.getpid():
+            self._pid, self._entries, self._versions = os.getpid(), {}, {}
+            self._reset_stats()
+
+
+    def get(self, db: str, table: str, kind: str, start: str, query: Callable, 
+            subset: Callable = None):
+        '''Cached result of the query, run the query on a miss
+        
+           @param: table: table read by the query, as used for invalidation
+           @param: kind: kind of query on the table, e.g. daily or last
+           @param: start: start date of the query
+           @param: query: function running the query
+           @param: subset: function taking a result and a later start date and 
+                           returning the result for this date. None if not possible
+        '''
+
+        if not self.enabled:
+            return query()
+
+        with self._lock:
+            self._check_pid()
+
+            entries = self._entries.get((db, table), {})
+            version = self._versions.get((db, table), 0)
+
+            if (kind, start) in entries:
+                self._stats['hits'] += 1
+                return entries[(kind, start)]
+
+            # The result with the latest start still covering the query
+            covering = [key for key in entries if key[0] == kind and key[1] <= start]
+
+            if subset and covering:
+                self._stats['hits'] += 1
+                self._stats['subset_hits'] += 1
+                return subset(entries[max(covering)], start)
+
+            self._stats['misses'] += 1
+
+        result = query()
+
+        with self._lock:
+            # Not cached if data was inserted while querying
+            if self._versions.get((db, table), 0) == version:
+                self._entries.setdefault((db, table), {})[(kind, start)] = result
+
+        return result
+
+
+    def invalidate(self, db: str, table: str) -> None:
+        with self._lock:
+            self._check_pid()
+            self._versions[(db, table)] = self._versions.get((db, table), 0) + 1
+
+            if self._entries.pop((db, table), None) is not None:
+                self._stats['invalidations'] += 1
+
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries, self._versions = {}, {}
+
+
+    def stats(self) -> Dict[str, float]:
+        '''Counters of hits and misses'''
+
+        with self._lock:
+            stats = dict(self._stats)
+
+        stats['hit_ratio'] = stats['hits'] / max(1, stats['hits'] + stats['misses'])
+
+        return stats
+
+
+def _subset_arrays(arrays: Dict[str, np.ndarray], start: str) -> Dict[str, np.ndarray]:
+    '''Rows of daily arrays not earlier than the start date'''
+
+    first = np.searchsorted(arrays['date'], start)
+    return {name: array[first:] for name, array in arrays.items()}
+
+
+def _subset_rows(rows: Sequence[tuple], start: str) -> Sequence[tuple]:
+    '''Rows ordered by the leading date/datetime not earlier than the start date'''
+
+    first = bisect.bisect_left([row[0] for row in rows], start)
+    return rows[first:]
+
+
+def _write_stage_file(data: Sequence[tuple]) -> str:
+    '''Write the records into a new csv file of the staging folder
+    
+       @return: absolute path of the file
+    '''
+
+    os.makedirs(_stage_folder, exist_ok=True)
+    fd, file = tempfile.mkstemp(suffix='.csv', dir=_stage_folder)
+
+    with os.fdopen(fd, 'w', newline='') as f:
+        csv.writer(f, lineterminator='\n').writerows(data)
+
+    return os.path.abspath(file).replace(os.sep, '/')
+
+
+class MySQLBackend(object):
+    '''MySQL server, accessed through the process-wide connection pool'''
+
+    engine = 'mysql'
+    sql = mysql_sql
+
+    def __init__(self):
+        self.pool = ConnectionPool()
+
+
+    def connection(self, db: str):
+        return self.pool.connection(db)
+
+
+    def init_db(self, db: str, statements: Sequence[str]) -> None:
+        # The database may not exist yet, so its pool cannot be used
+        connect = mysql.connector.connect(**db_access)
+        cursor = connect.cursor()
+
+        cursor.execute(create_db.format(db=db))
+        cursor.execute('USE ' + db)
+
+        for sql in statements:
+            cursor.execute(sql)
+
+        cursor.close()
+        connect.close()
+
+
+    def execute(self, db: str, statements: Sequence[str]) -> None:
+        '''Execute the statements, each may contain several sql separated by ';' '''
+
+        with self.pool.connection(db) as connect:
+            cursor = connect.cursor()
+
+            for statement in statements:
+                for sql in filter(str.strip, statement.split(';')):
+                    cursor.execute(sql)
+                connect.commit()
+
+            cursor.close()
+
+
+    def insert(self, db: str, sql: str, data: Sequence[tuple]) -> None:
+        '''Records are sent in batches of multi-row statements and committed in one transaction'''
+
+        with self.pool.connection(db) as connect:
+            cursor = connect.cursor()
+
+            for i in range(0, len(data), _insert_batch_size):
+                cursor.executemany(sql, data[i : i + _insert_batch_size])
+
+            connect.commit()
+            cursor.close()
+
+
+    def get_data(self, db: str, sql: str) -> Sequence[tuple]:
+        with self.pool.connection(db) as connect:
+            cursor = connect.cursor()
+            cursor.execute(sql)
+            data = cursor.fetchall()
+            cursor.close()
+
+        return data
+
+
+    def get_arrays(self, db: str, sql: str, dtypes: Sequence[Tuple[str, str]], 
+                   chunk_size: int = _fetch_chunk_size) -> Dict[str, np.ndarray]:
+        '''Stream the result with an unbuffered cursor, in chunks of rows copied
+           straight into typed column buffers
+        '''
+
+        capacity, n = chunk_size, 0
+        buffers = [np.empty(capacity, dtype=dtype) for _, dtype in dtypes]
+
+        with self.pool.connection(db) as connect:
+            cursor = connect.cursor(buffered=False)
+            cursor.execute(sql)
+
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if len(rows) == 0:
+                    break
+
+                if n + len(rows) > capacity:
+                    capacity = max(2 * capacity, n + len(rows))
+                    buffers = [np.resize(buffer, capacity) for buffer in buffers]
+
+                for buffer, column in zip(buffers, zip(*rows)):
+                    buffer[n : n + len(rows)] = column
+
+                n += len(rows)
+
+            cursor.close()
+
+        return {name: buffer[:n].copy() for (name, _), buffer in zip(dtypes, buffers)}
+
+
+    def stats(self) -> Dict[str, float]:
+        return self.pool.stats()
+
+
+class DuckDBBackend(object):
+    '''Embedded analytic database in a single file per database, queried
+       in-process. Writes are serialized within the process
+    '''
+
+    engine = 'duckdb'
+    sql = duckdb_sql
+
+    def __init__(self, path: str = ''):
+        if duckdb is None:
+            raise ImportError('duckdb is required by the embedded database backend')
+
+        self.path = path or db_backend['path']
+
+        self._pid = os.getpid()
+        self._connections = {}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+
+    @contextmanager
+    def connection(self, db: str):
+        '''Cursor of the database for use by the calling thread only'''
+
+        with self._lock:
+            # Connections cannot be shared with a forked process
+            if self._pid != os.getpid():
+                self._pid, self._connections = os.getpid(), {}
+
+            if db not in self._connections:
+                path = self.path.format(db=db)
+                if os.path.dirname(path):
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+                self._connections[db] = duckdb.connect(path)
+
+            cursor = self._connections[db].cursor()
+
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+
+
+    def init_db(self, db: str, statements: Sequence[str]) -> None:
+        self.execute(db, statements)
+
+
+    def execute(self, db: str, statements: Sequence[str]) -> None:
+        with self._write_lock, self.connection(db) as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+
+
+    def insert(self, db: str, sql: str, data: Sequence[tuple]) -> None:
+        '''Records are inserted with one statement reading from a data frame'''
+
+        batch = pd.DataFrame(list(data), columns=['c{0}'.format(i) for i in range(len(data[0]))])
+        batch['_row'] = np.arange(len(batch))
+
+        with self._write_lock, self.connection(db) as cursor:
+            cursor.register('_batch', batch)
+
+            try:
+                cursor.execute(sql)
+            finally:
+                cursor.unregister('_batch')
+
+
+    def get_data(self, db: str, sql: str) -> Sequence[tuple]:
+        with self.connection(db) as cursor:
+            return cursor.execute(sql).fetchall()
+
+
+    def get_arrays(self, db: str, sql: str, dtypes: Sequence[Tuple[str, str]], 
+                   chunk_size: int = _fetch_chunk_size) -> Dict[str, np.ndarray]:
+        '''The result is fetched column by column, NULL values of float columns become NaN'''
+
+        with self.connection(db) as cursor:
+            columns = cursor.execute(sql).fetchnumpy().values()
+
+        arrays = {}
+
+        for (name, dtype), column in zip(dtypes, columns):
+            if np.dtype(dtype).kind == 'f':
+                column = np.ma.filled(np.ma.asarray(column).astype(dtype), np.nan)
+
+            arrays[name] = np.asarray(column).astype(dtype, copy=False)
+
+        return arrays
+
+
+    def stats(self) -> Dict[str, float]:
+        return {}
+
+
+def _create_backend(engine: str):
+    if engine == 'mysql':
+        return MySQLBackend()
+
+    if engine == 'duckdb':
+        return DuckDBBackend()
+
+    raise ValueError('Unsupported database engine: {0}'.format(engine))
+
+
+_backend = _create_backend(db_backend['engine'])
+
+_cache = QueryCache()
+
+
 class Database(object):
-    '''Database management'''
+    '''Database management. Statements are run by the backend selected in
+       config.db_backend
+    '''
+
+    @classmethod
+    def use_backend(cls, engine: str) -> None:
+        '''Switch to the backend of the engine, 'mysql' or 'duckdb' '''
+
+        global _backend
+        _backend = _create_backend(engine)
+        _cache.clear()
+
+
+    @classmethod
+    def engine(cls) -> str:
+        '''Engine of the backend in use, 'mysql' or 'duckdb' '''
+        return _backend.engine
+
 
     @classmethod
     def init_db(cls, db: str, symbol: str, *other_symbols) -> None:
@@ -126,55 +899,217 @@ class Database(object):
            @param: other_symbols: additional symbols to add
         '''
 
-        connect = mysql.connector.connect(**db_access)
-        cursor = connect.cursor()
+        sql = _backend.sql
+        statements = [sql['create_table_stock_news'].format(table='Stock_News')]
 
-        cursor.execute(create_db.format(db=db))
-        cursor.execute('USE ' + db)
+        for ticker in (symbol,) + other_symbols:
+            statements.append(sql['create_table_intraday'].format(symbol=ticker))
+            statements.append(sql['create_table_daily'].format(symbol=ticker))
+
+        _backend.init_db(db, statements)
 
-        cursor.execute(create_table_stock_news)
 
+    @classmethod
+    def add_natural_keys(cls, db: str, symbol: str, *other_symbols) -> None:
+        '''Remove duplicated rows and add the natural unique keys to tables
+           created before the keys were introduced. Only run once
+           
+           @param: db: name of the database
+           @param: symbol: update intraday/daily table for the symbol
+           @param: other_symbols: additional symbols to update
+        '''
+
+        if _backend.engine != 'mysql':
+            logger.info('Tables of %s are always created with natural keys', _backend.engine)
+            return
+
+        statements = [add_key_stock_news]
         for ticker in (symbol,) + other_symbols:
-            cursor.execute(create_table_intraday.format(symbol=ticker))
-            cursor.execute(create_table_daily.format(symbol=ticker))
+            statements += [add_key_intraday.format(symbol=ticker), add_key_daily.format(symbol=ticker)]
 
-        cursor.close()
-        connect.close()
+        _backend.execute(db, statements)
+
+
+    @classmethod
+    def _migrate_table(cls, connect, table: str, date_column: str, create_sql: str,
+                       copy_sql: str, chunk_size: int) -> None:
+        '''Copy the table into a typed shadow table in chunks of rows, each committed
+           on its own so that no lock is held for long, and catch up with rows 
+           inserted meanwhile. The last rows are copied with writes to the table
+           blocked, then both tables are swapped in one atomic rename before
+           writes resume, so that no inserted row is left in old_<table>. Rows
+           updated in place after their chunk was copied keep the copied values
+        '''
+
+        cursor = connect.cursor()
+
+        cursor.execute(select_column_type.format(table=table, column=date_column))
+        column_type = cursor.fetchall()
+
+        if len(column_type) == 0 or column_type[0][0] != 'varchar':
+            logger.info('Table %s is already typed', table)
+            cursor.close()
+            return
+
+        cursor.execute(create_sql)
+        copied, start_time = 0, time.monotonic()
+
+        def copy_up_to_max_id(copied: int) -> int:
+            cursor.execute(select_max_id.format(table=table))
+            max_id = cursor.fetchall()[0][0]
+
+            while copied < max_id:
+                id_to = min(copied + chunk_size, max_id)
+                cursor.execute(copy_sql.format(to_table='tmp_' + table, from_table=table,
+                                               id_from=copied, id_to=id_to))
+                connect.commit()
+                copied = id_to
+
+            return copied
+
+        # Without lock until caught up, so that the locked copy is short
+        while True:
+            last_copied, copied = copied, copy_up_to_max_id(copied)
+            if copied == last_copied:
+                break
+
+        cursor.execute(lock_tables.format(table=table))
+        try:
+            lock_time = time.monotonic()
+            copied = copy_up_to_max_id(copied)
+
+            cursor.execute(swap_tables.format(table=table))
+        finally:
+            cursor.execute(unlock_tables)
+            cursor.close()
+
+        logger.info('Migrate %s (%d rows) in %.1f seconds, writes blocked for %.3f seconds, '
+                    'original table kept as old_%s', table, copied, time.monotonic() - start_time,
+                    time.monotonic() - lock_time, table)
+
+
+    @classmethod
+    def migrate_schema(cls, db: str, symbol: str, *other_symbols, chunk_size: int = 10000) -> None:
+        '''Convert tables created with varchar columns to the typed schema. Tables 
+           stay readable during the migration and rows inserted meanwhile are
+           copied, writes being blocked only to copy the last ones and swap the
+           tables. Rows updated in place during the copy are not carried over,
+           e.g. bars upserted by collection, which should be collected again
+
+           @param: db: name of the database
+           @param: symbol: migrate intraday/daily table for the symbol
+           @param: other_symbols: additional symbols to migrate
+           @param: chunk_size: number of rows copied in one transaction
+        '''
+
+        if _backend.engine != 'mysql':
+            logger.info('Tables of %s are always created with the typed schema', _backend.engine)
+            return
+
+        with _backend.connection(db) as connect:
+            cls._migrate_table(connect, 'Stock_News', 'date_time', 
+                               create_table_stock_news.format(table='tmp_Stock_News'),
+                               copy_chunk_stock_news, chunk_size)
+
+            for ticker in (symbol,) + other_symbols:
+                cls._migrate_table(connect, ticker + '_Intraday', 'date_time',
+                                   create_table_intraday.format(symbol='tmp_' + ticker),
+                                   copy_chunk_intraday, chunk_size)
+                cls._migrate_table(connect, ticker + '_Daily', 'date_string',
+                                   create_table_daily.format(symbol='tmp_' + ticker),
+                                   copy_chunk_daily, chunk_size)
 
 
     @classmethod
     def _insert_data(cls, db: str, sql: str, data: Sequence[tuple]) -> None:
-        '''Insert data into table using the sql statement
+        '''Insert data into table using the sql statement, in one transaction
            
            @param: db: name of the database to use
            @param: str: insertion sql to be executed
            @param: data: sequence of records to be inserted
         '''
 
-        connect = mysql.connector.connect(**db_access)
-        cursor = connect.cursor()
-        cursor.execute('USE ' + db)
+        if len(data) == 0:
+            return
 
-        cursor.executemany(sql, data)
+        _backend.insert(db, sql, data)
+
+
+    @classmethod
+    def _load_data(cls, db: str, table: str, columns: Sequence[str], data: Sequence[tuple]) -> None:
+        '''Insert data into table with the bulk loader of the backend, for large
+           backfills. Records are staged in a csv file and loaded into a staging 
+           table without any index, which is then merged into the table in one 
+           statement ordered by the key. As with _insert_data, a record replaces
+           the stored one with the same key
+
+           @param: db: name of the database to use
+           @param: table: name of the table
+           @param: columns: columns of the records, the first one is the natural key
+           @param: data: sequence of records to be inserted
+        '''
+
+        if len(data) == 0:
+            return
+
+        # Keep the last record of each key
+        data = list({record[0]: record for record in data}.values())
+        sql, start_time = _backend.sql, time.monotonic()
+
+        params = {
+            'table'  : table,
+            'stage'  : '_Stage_' + table,
+            'key'    : columns[0],
+            'columns': ', '.join(columns),
+            'update' : ', '.join(sql['update_column'].format(column) for column in columns[1:]),
+        }
+
+        file = _write_stage_file(data)
+
+        try:
+            _backend.execute(db, [sql['drop_stage_table'].format(**params),
+                                  sql['create_stage_table'].format(**params),
+                                  sql['load_stage_table'].format(file=file, **params),
+                                  sql['merge_stage_table'].format(**params),
+                                  sql['drop_stage_table'].format(**params)])
+        finally:
+            os.remove(file)
+
+        _cache.invalidate(db, table)
+        elapsed = time.monotonic() - start_time
+        logger.info('Bulk load %d rows into %s.%s in %.2f seconds (%.0f rows/s)', 
+                    len(data), db, table, elapsed, len(data) / max(elapsed, 1e-6))
+
+
+    @classmethod
+    def load_data_intraday(cls, db: str, symbol: str, data: Sequence[tuple]) -> None:
+        cls._load_data(db, symbol + '_Intraday', intraday_columns, data)
 
-        connect.commit()
-        cursor.close()
-        connect.close()
+
+    @classmethod
+    def load_data_daily(cls, db: str, symbol: str, data: Sequence[tuple]) -> None:
+        cls._load_data(db, symbol + '_Daily', daily_load_columns, data)
 
 
     @classmethod
     def insert_data_intraday(cls, db: str, symbol: str, data: Sequence[tuple]) -> None:
-        cls._insert_data(db, insert_into_intraday.format(symbol=symbol), data)
+        cls._insert_data(db, _backend.sql['insert_into_intraday'].format(symbol=symbol), data)
+        _cache.invalidate(db, symbol + '_Intraday')
 
 
     @classmethod
     def insert_data_daily(cls, db: str, symbol: str, data: Sequence[tuple]) -> None:
-        cls._insert_data(db, insert_into_daily.format(symbol=symbol), data)
+        cls._insert_data(db, _backend.sql['insert_into_daily'].format(symbol=symbol), data)
+        _cache.invalidate(db, symbol + '_Daily')
 
 
     @classmethod
     def insert_data_news(cls, db: str, data: Sequence[tuple]) -> None:
-        cls._insert_data(db, insert_into_stock_news, data)
+        cls._insert_data(db, _backend.sql['insert_into_stock_news'], data)
+
+        # News of each symbol are cached separately
+        for symbol in set(record[0] for record in data):
+            _cache.invalidate(db, 'Stock_News.' + symbol)
 
 
     @classmethod
@@ -186,58 +1121,157 @@ class Database(object):
            @return: List of tuples
         '''
 
-        connect = mysql.connector.connect(**db_access)
-        cursor = connect.cursor()
-        cursor.execute('USE ' + db)
+        return _backend.get_data(db, sql)
 
-        cursor.execute(sql)
-        data = cursor.fetchall()
 
-        cursor.close()
-        connect.close()
+    @classmethod
+    def pool_stats(cls) -> Dict[str, float]:
+        return _backend.stats()
 
-        return data
+
+    @classmethod
+    def cache_stats(cls) -> Dict[str, float]:
+        return _cache.stats()
+
+
+    @classmethod
+    def _get_arrays(cls, db: str, sql: str, dtypes: Sequence[Tuple[str, str]], 
+                    chunk_size: int = _fetch_chunk_size) -> Dict[str, np.ndarray]:
+        '''Get the result of the sql statement as typed column arrays
+           
+           @param: db: name of the database to use
+           @param: sql: selection sql to be executed
+           @param: dtypes: name and numpy dtype of each selected column
+           @param: chunk_size: number of rows fetched at a time
+           @return: numpy array for each column
+        '''
+
+        return _backend.get_arrays(db, sql, dtypes, chunk_size)
+
+
+    @classmethod
+    def get_data_daily_arrays(cls, db: str, symbol: str, 
+                              start: str = '1900-01-01') -> Dict[str, np.ndarray]:
+        '''Get daily data as typed numpy arrays, named as in daily_dtypes. Results
+           are cached until data is inserted into the table
+        '''
+
+        def query():
+            sql = _backend.sql['select_from_daily'].format(symbol=symbol, start=start)
+            return cls._get_arrays(db, sql, daily_dtypes)
+
+        arrays = _cache.get(db, symbol + '_Daily', 'daily', start, query, _subset_arrays)
+
+        # Cached arrays are never modified
+        return {name: array.copy() for name, array in arrays.items()}
 
 
     @classmethod
     def get_data_intraday(cls, db: str, symbol: str, start: str = '1900-01-01'):
-        return cls._get_data(db, select_from_intraday.format(symbol=symbol, start=start))
+        return cls._get_data(db, _backend.sql['select_from_intraday'].format(symbol=symbol, start=start))
 
 
     @classmethod
     def get_data_daily(cls, db: str, symbol: str, start: str = '1900-01-01'):
-        return cls._get_data(db, select_from_daily.format(symbol=symbol, start=start))
+        arrays = cls.get_data_daily_arrays(db, symbol, start=start)
+        return list(zip(*(arrays[name].tolist() for name, _ in daily_dtypes)))
 
 
     @classmethod
     def get_data_news(cls, db: str, symbol: str, start: str = '1900-01-01'):
-        return cls._get_data(db, select_from_stock_news.format(symbol=symbol, start=start))
+        def query():
+            return cls._get_data(db, _backend.sql['select_from_stock_news'].format(symbol=symbol, start=start))
+
+        return list(_cache.get(db, 'Stock_News.' + symbol, 'news', start, query, _subset_rows))
 
 
     @classmethod
     def get_last_trade_day(cls, db: str, symbol: str) -> str:
-        return cls._get_data(db, select_last_trade_day.format(symbol=symbol))[0][0]
+        def query():
+            return cls._get_data(db, _backend.sql['select_last_trade_day'].format(symbol=symbol))[0][0]
+
+        return _cache.get(db, symbol + '_Daily', 'last', '', query)
+
+
+    @classmethod
+    def get_last_intraday_time(cls, db: str, symbol: str) -> str:
+        return cls._get_data(db, _backend.sql['select_last_intraday_time'].format(symbol=symbol))[0][0]
+
+
+    @classmethod
+    def _split_by_symbol(cls, data: Sequence[tuple], symbols: Sequence[str],
+                         columns: Sequence[str]) -> Dict[str, pd.DataFrame]:
+        '''Split rows led by the symbol into one data frame per symbol'''
+
+        df = pd.DataFrame(data, columns=['symbol'] + list(columns))
+        groups = {symbol: frame for symbol, frame in df.groupby('symbol', sort=False)}
+        empty = df.iloc[:0]
+
+        return {symbol: groups.get(symbol, empty).drop(columns='symbol').reset_index(drop=True)
+                for symbol in symbols}
+
+
+    @classmethod
+    def get_data_daily_bulk(cls, db: str, symbols: Sequence[str], 
+                            start: str = '1900-01-01') -> Dict[str, pd.DataFrame]:
+        '''Get daily data of all symbols in one query
+
+           @return: data frame with daily_columns for each symbol, ordered by date
+        '''
+
+        # Each symbol once, as a repeated one would repeat its rows in the union
+        symbols = tuple(dict.fromkeys(symbols))
+
+        select = _backend.sql['select_from_daily_union']
+        sql = ' UNION ALL '.join('(' + select.format(symbol=symbol, start=start) + ')' for symbol in symbols)
+        data = cls._get_arrays(db, sql + ' ORDER BY 1, 2;', (('symbol', 'U15'),) + daily_dtypes)
+
+        # Rows are ordered by symbol in the collation of the server, which may differ
+        # from the code point order: group them again, keeping the order of dates
+        order = np.argsort(data['symbol'], kind='stable')
+        names, first, counts = np.unique(data['symbol'][order], return_index=True, return_counts=True)
+        rows = {name: order[i:i + n] for name, i, n in zip(names, first, counts)}
+        empty = np.empty(0, dtype='intp')
+
+        return {symbol: pd.DataFrame({name: data[name][rows.get(symbol, empty)] 
+                                      for name in daily_columns})
+                for symbol in symbols}
+
+
+    @classmethod
+    def get_data_news_bulk(cls, db: str, symbols: Sequence[str],
+                           start: str = '1900-01-01') -> Dict[str, pd.DataFrame]:
+        '''Get news of all symbols (or 'Market') in one query
+
+           @return: data frame with news_columns for each symbol, ordered by date_time
+        '''
+
+        symbols_in = ', '.join("'{0}'".format(symbol) for symbol in symbols)
+        data = cls._get_data(db, _backend.sql['select_from_stock_news_bulk'].format(symbols=symbols_in, start=start))
+
+        return cls._split_by_symbol(data, symbols, news_columns)
 
 
 def retrieve_price_news(db: str = '', symbols: Sequence[str] = (), 
                         start: str = '1900-01-01') -> tuple:
-    '''Get market news, and daily price/volume and news for all symbols
+    '''Get market news, and daily price/volume and news for all symbols, with
+       one query for the daily data and one for the news
        
        @param: start: retrieve data since this date
        @param: symbols: sequence of symbols to retrieve data. If empty, use all symbols
+       @return: data frame of market news, and data frames of daily data and news
+                for each symbol
     '''
 
     if not db: db = db_init['db']
     if not symbols: symbols = db_init['symbols']
 
-    market_news = Database.get_data_news(db, 'Market', start=start)
-    data = {symbol: {} for symbol in symbols}
+    daily = Database.get_data_daily_bulk(db, symbols, start=start)
+    news = Database.get_data_news_bulk(db, ('Market',) + tuple(symbols), start=start)
 
-    for symbol in symbols:
-        data[symbol]['daily'] = Database.get_data_daily(db, symbol, start=start)
-        data[symbol]['news'] = Database.get_data_news(db, symbol, start=start)
+    data = {symbol: {'daily': daily[symbol], 'news': news[symbol]} for symbol in symbols}
 
-    return market_news, data
+    return news['Market'], data
 
 
 def main():
@@ -245,7 +1279,47 @@ def main():
     Database.init_db(db_init['db'], *db_init['symbols'])
 
 
-def test():
+def migrate():
+    Database.migrate_schema(db_init['db'], *db_init['symbols'])
+
+
+def benchmark_bulk_load(engine: str = '', n_rows: int = 50000) -> float:
+    '''Time the insertion of intraday bars through _insert_data and through the 
+       bulk loader, each into a new table of the test database
+
+       @return: speedup of the bulk loader
+    '''
+
+    if engine: Database.use_backend(engine)
+
+    db, suffix = 'TestDB', str(int(time.time()))
+    Database.init_db(db, 'INS' + suffix, 'LOAD' + suffix)
+
+    date_time = np.datetime64('2000-01-03T09:30') + np.arange(n_rows) * np.timedelta64(15, 'm')
+    data = [(str(t).replace('T', ' ') + ':00', 'US/Eastern', '126.2200', '126.3400', '126.0300', 
+             '126.0300', str(i)) for i, t in enumerate(date_time)]
+
+    start_time = time.monotonic()
+    Database.insert_data_intraday(db, 'INS' + suffix, data)
+    insert_time = time.monotonic() - start_time
+
+    start_time = time.monotonic()
+    Database.load_data_intraday(db, 'LOAD' + suffix, data)
+    load_time = time.monotonic() - start_time
+
+    assert Database.get_data_intraday(db, 'INS' + suffix) == Database.get_data_intraday(db, 'LOAD' + suffix)
+
+    logger.info('%s: insert %d rows in %.2f seconds, bulk load in %.2f seconds, %.1fx faster',
+                _backend.engine, n_rows, insert_time, load_time, insert_time / load_time)
+
+    return insert_time / load_time
+
+
+def test(engine: str = ''):
+    '''Round trip of insertion and retrieval on the backend of the engine'''
+
+    if engine: Database.use_backend(engine)
+
     db = 'TestDB'
     symbols = ('GOOG', 'AMZN', 'AAPL', 'FB', 'MSFT')
     Database.init_db(db, *symbols)
@@ -268,6 +1342,44 @@ def test():
     ]
     Database.insert_data_news(db, data_stock_news)
 
+    # Records inserted again update the existing rows
+    Database.insert_data_intraday(db, 'MSFT', data_intraday)
+    Database.insert_data_daily(db, 'MSFT', data_daily)
+    Database.insert_data_news(db, data_stock_news)
+
+    assert Database.get_data_intraday(db, 'MSFT', start='2019-05-24') == \
+        [('2019-05-24 16:00:00', 126.22, 126.34, 126.03, 126.03, 809795)]
+    assert [row[0] for row in Database.get_data_daily(db, 'MSFT')] == ['2019-05-23', '2019-05-24']
+    assert Database.get_last_trade_day(db, 'MSFT') == '2019-05-24'
+    assert Database.get_last_intraday_time(db, 'MSFT') == '2019-05-24 16:00:00'
+    assert len(Database.get_data_news(db, 'TSLA')) == 1
+
+    arrays = Database.get_data_daily_arrays(db, 'MSFT', start='2019-05-24')
+    assert arrays['date'].tolist() == ['2019-05-24'] and arrays['volume'].tolist() == [14123358]
+
+    market_news, data = retrieve_price_news(db, ('MSFT', 'GOOG'), start='2019-05-01')
+    assert len(market_news) == 1 and len(data['GOOG']['daily']) == 0
+    assert data['MSFT']['daily']['close'].tolist() == [126.18, 126.24]
+
+    # Later starts are served from the cached result, until data is inserted
+    hits = Database.cache_stats()['hits']
+    assert Database.get_data_daily(db, 'MSFT', start='2019-05-24') == Database.get_data_daily(db, 'MSFT')[1:]
+    assert not _cache.enabled or Database.cache_stats()['hits'] == hits + 2
+
+    # The bulk loader upserts the same way
+    Database.load_data_daily(db, 'MSFT', data_daily + [data_daily[0][:2] + ("127.0000",) + data_daily[0][3:]])
+    assert Database.get_data_daily(db, 'MSFT', start='2019-05-24')[0][1] == 127.0
+    assert len(Database.get_data_daily(db, 'MSFT')) == 2
+
 
 if __name__ == '__main__':
-    main()
+    # python database.py [migrate | test [engine] | benchmark [engine]]
+    if sys.argv[1:] == ['migrate']:
+        migrate()
+    elif sys.argv[1:2] == ['test']:
+        test(*sys.argv[2:3])
+    elif sys.argv[1:2] == ['benchmark']:
+        logging.basicConfig(level=logging.INFO)
+        benchmark_bulk_load(*sys.argv[2:3])
+    else:
+        main()
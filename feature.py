@@ -1,21 +1,31 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from typing import Sequence, List, Tuple, Dict
 
+import numpy as np
 import pandas as pd
-from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
 
-from config import db_init, data_path
+from config import db_init, feature_build
 from database import Database, retrieve_price_news
+from feature_store import FeatureStore
+from incremental import IncrementalTA
 from indicator import Indicator
-from util import get_last_line, pop_last_line
+from indicator_numpy import NumpyIndicator
+from sentiment import SentimentCache
+from util import available_cores
 
 
 logger = logging.getLogger(__name__)
 
-_data_folder = data_path['root_path'] + 'feature/'
 _since_this_date = '2018-01-01'
+_store = FeatureStore()
+_sentiment = SentimentCache()
+
+_news_feature_names = ('date', 'n_news', 'mst', 'nnt', 'npt', 'rnt', 'msc', 
+                       'nnc', 'npc', 'rnc', 'mss', 'nns', 'nps', 'rns')
 
 
 def build_news_feature(date_string: str, news: Sequence[tuple]) -> tuple:
@@ -28,13 +38,13 @@ def build_news_feature(date_string: str, news: Sequence[tuple]) -> tuple:
     def divide(n1: int, n2: int) -> float:
         return n1 / n2 if n2 != 0 else -1.0
 
-    analyzer, threshold = SentimentIntensityAnalyzer(), 0.05
+    threshold = 0.05
     col_names = ('date_time', 'title', 'content', 'sentiment')
 
     df = pd.DataFrame(news, columns=col_names, dtype=object)
     df.fillna('', inplace=True)
-    df['title_score'] = df['title'].map(lambda x: analyzer.polarity_scores(x)['compound'])
-    df['content_score'] = df['content'].map(lambda x: analyzer.polarity_scores(x)['compound'])
+    df['title_score'] = _sentiment.scores(df['title'].tolist())
+    df['content_score'] = _sentiment.scores(df['content'].tolist())
 
     num_news = len(news)
 
@@ -50,7 +60,7 @@ def build_news_feature(date_string: str, news: Sequence[tuple]) -> tuple:
     num_pos_sentiment = sum(df['sentiment'] == 'Positive')
     ratio_neg_sentiment = round(divide(num_neg_sentiment, num_neg_sentiment + num_pos_sentiment), 4)
     
-    mean_score_title, mean_score_content, mean_score_sentiment = 0, 0, 0
+    mean_score_title, mean_score_content, mean_score_sentiment = 0.0, 0.0, 0.0
     if num_news > 0:
         mean_score_title = round(df['title_score'].mean(), 4)
         mean_score_content = round(df['content_score'].mean(), 4)
@@ -62,41 +72,75 @@ def build_news_feature(date_string: str, news: Sequence[tuple]) -> tuple:
             mean_score_sentiment, num_neg_sentiment, num_pos_sentiment, ratio_neg_sentiment)
 
 
-def build_ta_feature(symbol: str, daily: Sequence[tuple], 
-                     save_feature: bool = True) -> pd.DataFrame:
-    '''Build features using the daily time series data. Indicators like EMA
-       should be computed using the complete set of data (instead of a subset)
-        
-       @param: symbol: stock symbol that the daily data belongs to
-       @param: daily: daily time series data for a symbol
-       @param: save_feature: whether to save the features to file
+def _daily_frame(daily) -> pd.DataFrame:
+    '''Typed data frame of daily data given as a data frame, dict of column arrays
+       or sequence of tuples
     '''
-    logger.info('Build ta feature for: %s. Last daily date: %s', symbol, daily[-1][0])
-
     col_dtype = {'date': object, 'open': 'float64', 'high': 'float64', 'low': 'float64',
                  'close': 'float64', 'adj_close': 'float64', 'volume': 'int32'}
-    df = pd.DataFrame(daily, columns=col_dtype.keys(), dtype=object)
-    df = df.astype(col_dtype, copy=True)
 
-    high, low, close, volume = df['high'], df['low'], df['close'], df['volume']
+    if isinstance(daily, pd.DataFrame):
+        return daily.astype(col_dtype)
+
+    # Typed column arrays are used without conversion
+    df = pd.DataFrame(daily, columns=list(col_dtype.keys()))
+    return df.astype(col_dtype, copy=False)
+
+
+def _ta_features(indicator, high, low, close, volume) -> Dict[str, object]:
+    '''Ta features computed by the indicators of the provided implementation, 
+       Indicator on series or NumpyIndicator on (date x symbol) arrays
+    '''
+    feature = {}
 
     # Overlap Studies 
-    upperband, middleband, lowerband = Indicator.BBANDS(close, timeperiod=5)
-    df['ub_r'], df['mb_r'], df['lb_r'] = upperband / close, middleband / close, lowerband / close
-    df['trima_r'] = Indicator.TRIMA(close, timeperiod=30) / close
-    df['wma_r'] = Indicator.WMA(close, timeperiod=30) / close
+    upperband, middleband, lowerband = indicator.BBANDS(close, timeperiod=5)
+    feature['ub_r'], feature['mb_r'], feature['lb_r'] = upperband / close, middleband / close, lowerband / close
+    feature['trima_r'] = indicator.TRIMA(close, timeperiod=30) / close
+    feature['wma_r'] = indicator.WMA(close, timeperiod=30) / close
 
     # Momentum Indicator
-    macd, macdsignal, macdhist = Indicator.MACD(close, fastperiod=12, slowperiod=26, signalperiod=9)
-    df['macdhist'] = macdhist
-    df['ppo'] = Indicator.PPO(close, fastperiod=12, slowperiod=26)
-    df['rsi'] = Indicator.RSI(close, timeperiod=14)
+    macd, macdsignal, macdhist = indicator.MACD(close, fastperiod=12, slowperiod=26, signalperiod=9)
+    feature['macdhist'] = macdhist
+    feature['ppo'] = indicator.PPO(close, fastperiod=12, slowperiod=26)
+    feature['rsi'] = indicator.RSI(close, timeperiod=14)
 
     # Volume Indicator
-    df['adosc'] = Indicator.ADOSC(high, low, close, volume * 1.0, fastperiod=3, slowperiod=10)
+    feature['adosc'] = indicator.ADOSC(high, low, close, volume * 1.0, fastperiod=3, slowperiod=10)
 
     # Volatility Indicator
-    df['natr'] = Indicator.NATR(high, low, close, timeperiod=14)
+    feature['natr'] = indicator.NATR(high, low, close, timeperiod=14)
+
+    return feature
+
+
+def _save_ta_state(symbol: str, daily) -> None:
+    '''Save the state of the incremental engine advanced over the daily data, so
+       that update_ta_feature after a full build only processes the new bars
+    '''
+    engine = IncrementalTA()
+    engine.update(daily)
+    engine.save(symbol)
+
+
+def build_ta_feature(symbol: str, daily: Sequence[tuple], 
+                     save_feature: bool = True) -> pd.DataFrame:
+    '''Build features using the daily time series data. Indicators like EMA
+       should be computed using the complete set of data (instead of a subset)
+        
+       @param: symbol: stock symbol that the daily data belongs to
+       @param: daily: daily time series data for a symbol, as a data frame, 
+                      dict of column arrays or sequence of tuples
+       @param: save_feature: whether to save the features to file, with the state of
+                             the incremental engine
+    '''
+    df = _daily_frame(daily)
+    bars = {name: df[name].to_numpy() for name in df.columns}
+
+    logger.info('Build ta feature for: %s. Last daily date: %s', symbol, df['date'].iloc[-1])
+
+    for name, values in _ta_features(Indicator, df['high'], df['low'], df['close'], df['volume']).items():
+        df[name] = values
 
     # Drop rows with NaN values
     df.dropna(axis=0, how='any', inplace=True)
@@ -106,61 +150,236 @@ def build_ta_feature(symbol: str, daily: Sequence[tuple],
     df.drop(columns=col_drop, inplace=True)
 
     if save_feature:
-        df.to_csv(_data_folder + '{0}_ta.csv'.format(symbol), float_format='%.4f', index=False)
+        _store.write('ta', symbol, df)
+        _save_ta_state(symbol, bars)
 
     return df
 
 
+def build_ta_feature_panel(daily: Dict[str, object], save_feature: bool = True) -> Dict[str, pd.DataFrame]:
+    '''Build ta features of many symbols in one batched pass. The daily data are
+       aligned on the union of dates into (date x symbol) arrays, NaN where a symbol
+       has no bar, and each indicator is computed once for all symbols. A symbol 
+       with a shorter history gets the same features as by build_ta_feature
+
+       @param: daily: daily time series data of each symbol, as for build_ta_feature
+       @param: save_feature: whether to save the features to file
+       @return: ta features of each symbol, as by build_ta_feature
+    '''
+    columns = {}
+    for symbol, data in daily.items():
+        if not isinstance(data, (pd.DataFrame, dict)):
+            data = _daily_frame(data)
+        columns[symbol] = {name: np.asarray(data[name], dtype='float64') 
+                           for name in ('adj_close', 'high', 'low', 'close', 'volume')}
+        columns[symbol]['date'] = np.asarray(data['date'], dtype=object)
+
+    dates = np.unique(np.concatenate([data['date'].astype(str) for data in columns.values()]))
+
+    logger.info('Build ta feature for %d symbols on %d dates', len(columns), len(dates))
+
+    panel, rows = {}, {}
+    for name in ('high', 'low', 'close', 'volume'):
+        panel[name] = np.full((len(dates), len(columns)), np.nan)
+
+    for j, (symbol, data) in enumerate(columns.items()):
+        rows[symbol] = np.searchsorted(dates, data['date'].astype(str))
+        for name in panel:
+            panel[name][rows[symbol], j] = data[name]
+
+    feature = _ta_features(NumpyIndicator, panel['high'], panel['low'], panel['close'], panel['volume'])
+
+    result = {}
+    for j, (symbol, data) in enumerate(columns.items()):
+        values = {name: feature[name][rows[symbol], j] for name in feature}
+
+        # Drop rows with NaN values, keeping the row labels of the daily data
+        valid = ~np.isnan(np.column_stack(list(values.values()))).any(axis=1)
+        index = daily[symbol].index[valid] if isinstance(daily[symbol], pd.DataFrame) else np.flatnonzero(valid)
+
+        df = pd.DataFrame({'date': pd.Series(data['date'][valid], index=index, dtype=object),
+                           'adj_close': data['adj_close'][valid],
+                           **{name: values[name][valid] for name in values}}, index=index)
+
+        if save_feature:
+            _store.write('ta', symbol, df)
+            _save_ta_state(symbol, data)
+
+        result[symbol] = df
+
+    return result
+
+
+def _bucket_sums(values: np.ndarray, starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    '''Sum of each contiguous bucket of values. Buckets of the same length are summed
+       together row by row, which adds up the values in the same order as a sum of
+       each bucket on its own
+    '''
+
+    sums = np.zeros(len(lengths))
+
+    for length in np.unique(lengths[lengths > 0]):
+        buckets = np.flatnonzero(lengths == length)
+        sums[buckets] = values[starts[buckets, None] + np.arange(length)].sum(axis=1)
+
+    return sums
+
+
+def build_news_feature_array(trade_days: Sequence[str], news_data: Sequence[tuple]) -> pd.DataFrame:
+    '''Vectorized build_news_feature for all trade days. Each news is bound to the
+       last trade day not later than it (or the first trade day) with one sorted 
+       search, then each feature of all days is computed with one grouped reduction
+
+       @param: trade_days: Sequence of trade days in ascending order
+       @param: news_data: collection of news, as a data frame or sequence of tuples,
+                          ordered by timestamp
+       @return: data frame with one row of features for each trade day
+    '''
+
+    threshold = 0.05
+    col_names = ('date_time', 'title', 'content', 'sentiment')
+
+    df = pd.DataFrame(news_data, columns=col_names, dtype=object)
+    df.fillna('', inplace=True)
+
+    trade_days = np.asarray(trade_days, dtype=str)
+    bucket = np.searchsorted(trade_days[1:], df['date_time'].to_numpy(dtype=str), side='right')
+
+    # Keep the news of each day contiguous
+    order = np.argsort(bucket, kind='stable')
+    bucket = bucket[order]
+
+    title_score = _sentiment.scores(df['title'].tolist())[order]
+    content_score = _sentiment.scores(df['content'].tolist())[order]
+    sentiment = df['sentiment'].to_numpy()[order]
+
+    def count(mask: np.ndarray) -> np.ndarray:
+        return np.bincount(bucket[mask], minlength=len(trade_days))
+
+    def ratio(n1: np.ndarray, n2: np.ndarray) -> np.ndarray:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.round(np.where(n2 != 0, n1 / np.maximum(n2, 1), -1.0), 4)
+
+    def mean(values: np.ndarray) -> np.ndarray:
+        return np.round(np.where(num_news > 0, values / np.maximum(num_news, 1), 0.0), 4)
+
+    num_news = np.bincount(bucket, minlength=len(trade_days))
+    starts = np.cumsum(num_news) - num_news
+
+    num_neg_title, num_pos_title = count(title_score <= -threshold), count(title_score >= threshold)
+    num_neg_content, num_pos_content = count(content_score <= -threshold), count(content_score >= threshold)
+    num_neg_sentiment, num_pos_sentiment = count(sentiment == 'Negative'), count(sentiment == 'Positive')
+
+    features = (
+        trade_days, num_news,
+        mean(_bucket_sums(title_score, starts, num_news)), num_neg_title, num_pos_title, 
+        ratio(num_neg_title, num_neg_title + num_pos_title),
+        mean(_bucket_sums(content_score, starts, num_news)), num_neg_content, num_pos_content, 
+        ratio(num_neg_content, num_neg_content + num_pos_content),
+        mean(num_pos_sentiment - num_neg_sentiment), num_neg_sentiment, num_pos_sentiment,
+        ratio(num_neg_sentiment, num_neg_sentiment + num_pos_sentiment),
+    )
+
+    return pd.DataFrame(dict(zip(_news_feature_names, features)))
+
+
 def build_news_feature_all(symbol: str, trade_days: Tuple[str], news_data: Sequence[tuple],
                            save_feature: bool = True) -> pd.DataFrame:
     '''Build features on news for the provide trade days
        
        @param: symbol: stock symbol that the news data belongs to
        @param: trade_days: Sequence of trade days. Must be in ascending order
-       @param: news_data: collection of news. Timestamp of the news must be in ascending order
+       @param: news_data: collection of news, as a data frame or sequence of tuples. 
+                          Timestamp of the news must be in ascending order
        @param: save_feature: whether to save the features to file
     '''
     logger.info('Build news feature for %s, from %s to %s', symbol, trade_days[0], trade_days[-1])
 
+    if isinstance(news_data, pd.DataFrame):
+        news_data = list(news_data.itertuples(index=False, name=None))
+
     if not list(trade_days) == sorted(list(trade_days)):
         logger.error('Trade days not in ascending order')
     if news_data != sorted(news_data, key = lambda x: x[0]):
         logger.error('News not ordered by date')
-    
-    news_feature, idx = [], 0
 
-    for i, date_string in enumerate(trade_days[:-1]):
-        next_trade_day = trade_days[i + 1]
-        news = []
+    news_feature = build_news_feature_array(trade_days, news_data)
+    logger.info('Sentiment scores: %s', _sentiment.stats())
 
-        # Get all news between current and next trade day
-        # and bind them to the current trade day
-        while idx < len(news_data) and news_data[idx][0] < next_trade_day:
-            news.append(news_data[idx])
-            idx += 1
+    if save_feature:
+        _store.write('news', symbol, news_feature)
 
-        news_feature.append(build_news_feature(date_string, news))
+    return news_feature
 
-    # Bind all remaining news to the last trade day
-    news_feature.append(build_news_feature(trade_days[-1], news_data[idx:]))
 
-    feature_name = ['date', 'n_news', 'mst', 'nnt', 'npt', 'rnt', 'msc', 
-                    'nnc', 'npc', 'rnc', 'mss', 'nns', 'nps', 'rns']
-    
-    news_feature = pd.DataFrame(news_feature, columns=feature_name)
+def _build_ta_job(symbol: str, daily: Dict[str, np.ndarray]) -> float:
+    start_time = time.monotonic()
+    build_ta_feature(symbol, daily)
+    return time.monotonic() - start_time
 
-    if save_feature:
-        news_feature.to_csv(_data_folder + '{0}_news.csv'.format(symbol), 
-                            float_format='%.4f', index=False)
 
-    return news_feature
+def _build_news_job(symbol: str, trade_days: np.ndarray, news: Dict[str, np.ndarray]) -> float:
+    start_time = time.monotonic()
+    build_news_feature_all(symbol, tuple(trade_days), pd.DataFrame(news))
+    return time.monotonic() - start_time
+
+
+def _update_job(symbol: str) -> float:
+    start_time = time.monotonic()
+
+    if symbol != 'Market':
+        update_ta_feature(symbol=symbol)
+    update_news_feature(symbol=symbol)
+
+    return time.monotonic() - start_time
+
+
+def _run_jobs(jobs: Dict[tuple, tuple], max_workers: int = 0) -> Dict[tuple, float]:
+    '''Run feature jobs in a pool of processes, or in this process with one worker
+
+       @param: jobs: function and arguments of each job, by name of the job
+       @param: max_workers: number of processes. If 0, use feature_build['max_workers']
+       @return: seconds spent by each successful job
+    '''
+
+    max_workers = max_workers or feature_build['max_workers'] or available_cores()
+    max_workers = min(max_workers, len(jobs))
+    start_time, timing = time.monotonic(), {}
+
+    if max_workers <= 1:
+        for name, (func, *args) in jobs.items():
+            try:
+                timing[name] = func(*args)
+            except Exception:
+                logger.exception('Failed to run feature job %s', name)
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(func, *args): name for name, (func, *args) in jobs.items()}
+
+            for future in as_completed(futures):
+                try:
+                    timing[futures[future]] = future.result()
+                except Exception:
+                    logger.exception('Failed to run feature job %s', futures[future])
+
+    for name in sorted(timing, key=timing.get, reverse=True):
+        logger.info('Feature job %s: %.2f seconds', name, timing[name])
+
+    logger.info('Complete %d feature jobs with %d workers in %.1f seconds, %.1f seconds of work',
+                len(jobs), max_workers, time.monotonic() - start_time, sum(timing.values()))
+
+    return timing
 
 
-def build_feature_all(symbols: Sequence[str] = ()):
+def build_feature_all(symbols: Sequence[str] = (), max_workers: int = 0, ta_panel: bool = None):
     '''Construct features based on public news and technical analysis of 
-       price/volume for the provided symbols
+       price/volume for the provided symbols. The ta and news features of each
+       symbol are built by separate jobs, given only the column arrays they use
        
        @param: symbols: sequence of symbols to build feature. If empty, use all symbols
+       @param: max_workers: number of processes. If 0, use feature_build['max_workers']
+       @param: ta_panel: whether to build the ta features of all symbols in one pass
+                         instead of a job per symbol. If None, use feature_build['ta_panel']
     '''
     logger.info('Called')
 
@@ -168,32 +387,63 @@ def build_feature_all(symbols: Sequence[str] = ()):
 
     # Trade days may vary for different symbols
     # Subject to future change
-    trade_days = list(zip(*symbol_data[next(iter(symbol_data))]['daily']))[0]
+    trade_days = symbol_data[next(iter(symbol_data))]['daily']['date'].to_numpy(dtype='U10')
 
-    # Build features for market news
-    market_news_feature = build_news_feature_all('Market', trade_days, market_news)
+    def columns(df: pd.DataFrame) -> Dict[str, np.ndarray]:
+        return {name: df[name].to_numpy() for name in df.columns}
+
+    # Build features for market news and for each symbol
+    jobs = {('Market', 'news'): (_build_news_job, 'Market', trade_days, columns(market_news))}
     
-    # Build features for each symbol
+    if ta_panel is None:
+        ta_panel = feature_build['ta_panel']
+
     for symbol in symbol_data:
-        news_feature = build_news_feature_all(symbol, trade_days, symbol_data[symbol]['news'])
-        feature = build_ta_feature(symbol, symbol_data[symbol]['daily'])
+        jobs[(symbol, 'news')] = (_build_news_job, symbol, trade_days, columns(symbol_data[symbol]['news']))
+        if not ta_panel:
+            jobs[(symbol, 'ta')] = (_build_ta_job, symbol, columns(symbol_data[symbol]['daily']))
+
+    if ta_panel:
+        start_time = time.monotonic()
+        build_ta_feature_panel({symbol: data['daily'] for symbol, data in symbol_data.items()})
+        logger.info('Build ta features in one pass: %.2f seconds', time.monotonic() - start_time)
+
+    _run_jobs(jobs, max_workers)
 
 
 def update_ta_feature(symbol: str):
-    '''Update ta features for the specified symbol with the latest daily time series data'''
+    '''Update ta features for the specified symbol with the latest daily time series data.
+       Only the new bars are processed by the incremental engine. Its state is rebuilt
+       from the complete data if it does not match the stored features
+    '''
     logger.info('Called for %s', symbol)
 
     db = db_init['db']
 
     last_trade_day = Database.get_last_trade_day(db, symbol)
-    last_ta_line = get_last_line(_data_folder + '{0}_ta.csv'.format(symbol))
-    last_ta_day = last_ta_line.split(',')[0]
+    last_ta_day = _store.last_date('ta', symbol)
 
     logger.info('Last trade day: %s, last ta day: %s', last_trade_day, last_ta_day)
 
     if last_ta_day < last_trade_day:
-        data = Database.get_data_daily(db, symbol, start=_since_this_date)
-        build_ta_feature(symbol, data)
+        engine = IncrementalTA.load(symbol)
+
+        if engine is None or engine.state['date'] != last_ta_day:
+            logger.info('Rebuild the indicator state for %s', symbol)
+
+            engine = IncrementalTA()
+            data = Database.get_data_daily_arrays(db, symbol, start=_since_this_date)
+            _store.write('ta', symbol, engine.update(data))
+        else:
+            data = Database.get_data_daily_arrays(db, symbol, start=last_ta_day)
+            new_bars = data['date'] > last_ta_day
+
+            feature = engine.update({name: values[new_bars] for name, values in data.items()})
+            _store.append('ta', symbol, feature)
+
+            logger.info('Add %d ta features for %s', len(feature), symbol)
+
+        engine.save(symbol)
 
 
 def update_news_feature(symbol: str):
@@ -216,11 +466,9 @@ def update_news_feature(symbol: str):
     from_date, to_date = (news[0][0], news[-1][0]) if len(news) > 0 else ('-', '-')
     logger.info('Get %d news, from %s to %s', len(news), from_date, to_date)
 
-    # Get the date for the last news feature in file to determine whether the
+    # Get the date for the last news feature in store to determine whether the
     # newly built news feature should override the existing one or simply append
-    new_feature_file = _data_folder + '{0}_news.csv'.format(symbol)
-    last_news_line = get_last_line(new_feature_file)
-    last_news_day = last_news_line.split(',')[0]
+    last_news_day = _store.last_date('news', symbol)
 
     logger.info('Last trade day: %s, last news day: %s', last_trade_day, last_news_day)
     if last_news_day > last_trade_day:
@@ -228,29 +476,114 @@ def update_news_feature(symbol: str):
 
     if last_news_day == last_trade_day:
         logger.info('Override the news feature for %s', last_news_day)
-        pop_last_line(new_feature_file)
     else:
         logger.info('Add the news feature for %s', last_trade_day)
 
-    with open(new_feature_file, 'a') as f:
-        f.write(','.join(map(str, news_feature)) + '\n')
+    _store.append('news', symbol, pd.DataFrame([news_feature], columns=_news_feature_names))
+
 
+def update_feature(max_workers: int = 0):
+    '''Update the features of all symbols and the market with the latest data. The
+       jobs only read the database, in child processes with more than one worker:
+       the query cache of this process is not warmed by them, so later steps in this
+       process, e.g. trading, query the tables again
 
-def update_feature():
+       @param: max_workers: number of processes. If 0, use feature_build['max_workers']
+    '''
     logger.info('Start updating feature')
     # build_feature_all()
     
     symbols = db_init['symbols']
 
-    for symbol in symbols:
-        update_ta_feature(symbol=symbol)
-        update_news_feature(symbol=symbol)
-    
-    update_news_feature(symbol='Market')
+    # The embedded database can only be opened by one process
+    if Database.engine() != 'mysql':
+        max_workers = 1
+
+    _run_jobs({(symbol, 'update'): (_update_job, symbol) for symbol in tuple(symbols) + ('Market',)},
+              max_workers)
 
     logger.info('Complete feature update')
     
 
+def _test_news_feature(n_days: int = 300, seed: int = 0):
+    '''Parity of the vectorized news features with build_news_feature applied 
+       to the news of each trade day
+    '''
+
+    rng = np.random.default_rng(seed)
+    trade_days = tuple(np.datetime_as_string(np.datetime64('2019-01-02') + np.arange(n_days)))
+
+    words = ('gain', 'loss', 'strong', 'weak', 'record', 'fear', 'beat', 'miss', 'stock', 'rally')
+    date_time = np.datetime64('2018-12-30T00:00') + np.sort(rng.integers(0, (n_days + 3) * 1440, 5 * n_days))
+    news_data = [(str(t).replace('T', ' ') + ':00', ' '.join(rng.choice(words, 3)), 
+                  ' '.join(rng.choice(words, 6)), rng.choice(('Positive', 'Negative', 'Neutral')))
+                 for t in date_time if rng.random() < 0.5]
+
+    # Bind news to trade days one day at a time
+    expected, idx = [], 0
+
+    for i, date_string in enumerate(trade_days):
+        news = []
+        while idx < len(news_data) and (i == n_days - 1 or news_data[idx][0] < trade_days[i + 1]):
+            news.append(news_data[idx])
+            idx += 1
+
+        expected.append(build_news_feature(date_string, news))
+
+    expected = pd.DataFrame(expected, columns=_news_feature_names)
+    actual = build_news_feature_array(trade_days, news_data)
+
+    for name in _news_feature_names:
+        assert actual[name].tolist() == expected[name].tolist(), name
+
+    logger.info('Vectorized news features match on %d days, %d news', n_days, len(news_data))
+
+
+def _test_ta_feature_panel(n_days: int = 800, seed: int = 0):
+    '''Parity of the panel ta features with build_ta_feature of each symbol, for
+       symbols with shorter histories and missing days
+    '''
+
+    rng = np.random.default_rng(seed)
+    dates = np.datetime_as_string(np.datetime64('2016-01-01') + np.arange(n_days))
+    daily = {}
+
+    for symbol, first_day in (('AAPL', 0), ('MSFT', 0), ('AMZN', 40), ('UBER', 600), ('LYFT', 760)):
+        days = np.arange(first_day, n_days)
+        days = days[rng.random(len(days)) < 0.95]
+        close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, len(days))))
+        spread = close * rng.uniform(0, 0.03, len(days))
+
+        daily[symbol] = {
+            'date'     : dates[days],
+            'open'     : close + rng.normal(0, 0.5, len(days)),
+            'high'     : close + spread,
+            'low'      : close - spread,
+            'close'    : close,
+            'adj_close': close,
+            'volume'   : rng.integers(1e6, 1e7, len(days)),
+        }
+
+    actual = build_ta_feature_panel(daily, save_feature=False)
+
+    for symbol, data in daily.items():
+        expected = build_ta_feature(symbol, data, save_feature=False)
+
+        assert actual[symbol]['date'].tolist() == expected['date'].tolist(), symbol
+        assert actual[symbol].columns.tolist() == expected.columns.tolist(), symbol
+        assert actual[symbol].index.tolist() == expected.index.tolist(), symbol
+
+        for name in expected.columns[1:]:
+            assert np.allclose(actual[symbol][name], expected[name], rtol=1e-9, atol=1e-9), (symbol, name)
+
+    logger.info('Panel ta features match on %d symbols, %d days', len(daily), n_days)
+
+
+def test():
+    _test_news_feature()
+    _test_ta_feature_panel()
+
+
 if __name__ == '__main__':
     # update_feature()
     build_feature_all()
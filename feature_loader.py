@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+from collections import OrderedDict
+from typing import Sequence, List, Tuple, Dict
+
+import numpy as np
+import pandas as pd
+
+from config import feature_loader
+from feature_store import FeatureStore
+
+
+logger = logging.getLogger(__name__)
+
+
+def build_labels(adj_closes: Sequence[np.ndarray], threshold: float = 0.001) -> List[np.ndarray]:
+    '''Labels of the price change in the next day, for many symbols at once: 1 for
+       a change above the threshold, -1 below the negative threshold, 0 otherwise
+       and for the last day
+
+       @param: adj_closes: adjusted close prices of each symbol, in time order
+       @return: labels of each symbol
+    '''
+
+    lengths = np.array([len(x) for x in adj_closes])
+    adj_close = np.concatenate([np.asarray(x, dtype='float64') for x in adj_closes] + [np.empty(0)])
+
+    # Change to the next day, undefined for the last day of each symbol
+    poc = np.full(len(adj_close), np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        poc[:-1] = adj_close[1:] / adj_close[:-1] - 1
+    poc[np.cumsum(lengths)[lengths > 0] - 1] = np.nan
+
+    labels = np.where(poc > threshold, 1, np.where(poc < -threshold, -1, 0))
+
+    return np.split(labels, np.cumsum(lengths)[:-1])
+
+
+class FeatureLoader(object):
+    '''Feature matrices of the symbols for modeling, kept in memory: ta features,
+       news features of the symbol (suffix _s) and of the market (suffix _m), and
+       adj_close last, as by model.load_feature. The market news features are read
+       once for all symbols. A matrix is built again once the stored features it
+       was built from change, and at most max_symbols matrices are kept
+    '''
+
+    def __init__(self, store: FeatureStore = None, max_symbols: int = 0):
+        self.store = store or FeatureStore()
+        self.max_symbols = max_symbols or feature_loader['max_symbols']
+
+        self._lock = threading.Lock()
+        self._market = ((), None)
+        self._matrices = OrderedDict()
+        self._stats = {'hits': 0, 'misses': 0, 'market_reads': 0}
+
+
+    def _versions(self, symbol: str) -> tuple:
+        return (self.store.version('ta', symbol), self.store.version('news', symbol),
+                self.store.version('news', 'Market'))
+
+
+    def _market_news(self, version: tuple) -> pd.DataFrame:
+        if self._market[1] is None or self._market[0] != version:
+            self._market = (version, self.store.read('news', 'Market'))
+            self._stats['market_reads'] += 1
+
+        return self._market[1]
+
+
+    def _build(self, symbol: str, versions: tuple) -> dict:
+        ta = self.store.read('ta', symbol)
+        news = self.store.read('news', symbol)
+        market = self._market_news(versions[2])
+
+        dates = ta['date'].to_numpy(dtype=object)
+
+        ta_columns = [name for name in ta.columns if name not in ('date', 'adj_close')]
+        news_columns = [name for name in news.columns if name != 'date']
+        market_columns = [name for name in market.columns if name != 'date']
+
+        overlap = set(news_columns) & set(market_columns)
+        columns = (ta_columns + [name + '_s' if name in overlap else name for name in news_columns]
+                   + [name + '_m' if name in overlap else name for name in market_columns] + ['adj_close'])
+
+        # News of the symbol by ta date, and market news by date of the symbol news
+        news_rows = pd.Index(news['date']).get_indexer(dates)
+        has_news = news_rows >= 0
+
+        market_rows = np.full(len(dates), -1)
+        market_rows[has_news] = pd.Index(market['date']).get_indexer(news['date'])[news_rows[has_news]]
+
+        def take(df: pd.DataFrame, names: List[str], rows: np.ndarray) -> np.ndarray:
+            values = df[names].to_numpy(dtype='float64', na_value=np.nan).reshape(len(df), len(names))
+            out = np.full((len(rows), len(names)), np.nan)
+            out[rows >= 0] = values[rows[rows >= 0]]
+            return out
+
+        values = np.hstack([ta[ta_columns].to_numpy(dtype='float64'),
+                            take(news, news_columns, news_rows),
+                            take(market, market_columns, market_rows),
+                            ta[['adj_close']].to_numpy(dtype='float64')])
+
+        if np.isnan(values).any():
+            logger.warning('Feature matrix contains NaN: %s', symbol)
+
+        return {'dates': dates, 'columns': columns, 'values': values}
+
+
+    def load_all(self, symbols: Sequence[str]) -> Dict[str, dict]:
+        '''Feature matrices of the symbols, with the labels of all symbols built at once
+
+           @return: dates, columns, float values and labels 'Y' of each symbol
+        '''
+
+        result = {}
+
+        with self._lock:
+            built = []
+
+            for symbol in symbols:
+                versions = self._versions(symbol)
+                cached = self._matrices.get(symbol)
+
+                if cached is not None and cached[0] == versions:
+                    self._matrices.move_to_end(symbol)
+                    self._stats['hits'] += 1
+                else:
+                    cached = (versions, self._build(symbol, versions))
+                    self._matrices[symbol] = cached
+                    self._stats['misses'] += 1
+                    built.append(symbol)
+
+                result[symbol] = cached[1]
+
+            if built:
+                labels = build_labels([result[symbol]['values'][:, -1] for symbol in built])
+                for symbol, Y in zip(built, labels):
+                    result[symbol]['Y'] = Y
+
+            while len(self._matrices) > self.max_symbols:
+                self._matrices.popitem(last=False)
+
+        return result
+
+
+    def load(self, symbol: str) -> dict:
+        return self.load_all((symbol,))[symbol]
+
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+
+def test(n_days: int = 400, seed: int = 0):
+    '''Parity of the loaded matrices and labels with model.load_feature and the
+       labels built by pandas, and reloading of changed features
+    '''
+
+    import tempfile
+    import model
+    from feature import build_news_feature_array, build_ta_feature
+
+    rng = np.random.default_rng(seed)
+    dates = np.datetime_as_string(np.datetime64('2018-01-01') + np.arange(n_days))
+    news_data = [(str(date) + ' 10:00:00', 'record gain', 'weak loss', 'Positive') 
+                 for date in dates if rng.random() < 0.3]
+
+    with tempfile.TemporaryDirectory() as root_path:
+        store = FeatureStore(root_path + '/')
+        loader = FeatureLoader(store, max_symbols=2)
+
+        store.write('news', 'Market', build_news_feature_array(tuple(dates), news_data))
+
+        symbols = ('AAPL', 'MSFT', 'UBER')
+        for i, symbol in enumerate(symbols):
+            close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, n_days)))
+            daily = {'date': dates, 'open': close, 'high': close * 1.01, 'low': close * 0.99, 
+                     'close': close, 'adj_close': close, 'volume': rng.integers(1e6, 1e7, n_days)}
+
+            store.write('ta', symbol, build_ta_feature(symbol, daily, save_feature=False).iloc[i * 50:])
+            store.write('news', symbol, build_news_feature_array(tuple(dates[::i + 1]), news_data[:100]))
+
+        model._store, stored = store, model._store
+
+        try:
+            for symbol, matrix in loader.load_all(symbols).items():
+                expected = model.load_feature(symbol)
+
+                poc = expected['adj_close'].pct_change(periods=1).shift(-1)
+                Y = np.where(poc > 0.001, 1, np.where(poc < -0.001, -1, 0))
+
+                assert matrix['columns'] == list(expected.columns), symbol
+                assert list(matrix['dates']) == list(expected.index), symbol
+                assert np.array_equal(matrix['values'], expected.to_numpy(dtype='float64'), equal_nan=True), symbol
+                assert np.array_equal(matrix['Y'], Y), symbol
+
+            # Market news read once, matrices kept up to max_symbols
+            loader.load('UBER')
+            assert loader.stats() == {'hits': 1, 'misses': 3, 'market_reads': 1}
+
+            # Changed features are read again
+            store.write('news', 'Market', build_news_feature_array(tuple(dates), news_data[:10]))
+            assert np.array_equal(loader.load('UBER')['values'], model.load_feature('UBER').to_numpy(dtype='float64'),
+                                  equal_nan=True)
+            assert loader.stats()['market_reads'] == 2
+        finally:
+            model._store = stored
+
+    logger.info('Feature loader: %s', loader.stats())
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    test()
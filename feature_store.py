@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+import glob
+import logging
+import os
+import sys
+import threading
+from typing import Sequence, List, Tuple, Dict
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from config import data_path, db_init, feature_store
+
+
+logger = logging.getLogger(__name__)
+
+_store_folder = data_path['root_path'] + 'feature_store/'
+_csv_folder = data_path['root_path'] + 'feature/'
+
+
+class FeatureStore(object):
+    '''Typed, compressed Parquet store of features. Each kind of feature (ta, news)
+       is a dataset partitioned by symbol, {kind}/symbol={symbol}/part-00000.parquet,
+       ordered by date. Appended rows are written as new parts
+    '''
+
+    def __init__(self, root_path: str = _store_folder):
+        self.root_path = root_path
+        # Reentrant, as append rewrites the partition through write
+        self._lock = threading.RLock()
+
+
+    def _partition(self, kind: str, symbol: str) -> str:
+        return os.path.join(self.root_path, kind, 'symbol=' + symbol)
+
+
+    def _parts(self, kind: str, symbol: str) -> List[str]:
+        return sorted(glob.glob(os.path.join(self._partition(kind, symbol), 'part-*.parquet')))
+
+
+    def _write_part(self, kind: str, symbol: str, df: pd.DataFrame, part: int) -> None:
+        partition = self._partition(kind, symbol)
+        os.makedirs(partition, exist_ok=True)
+
+        part_file = os.path.join(partition, 'part-{0:05d}.parquet'.format(part))
+        temp_file = '{0}.{1}.tmp'.format(part_file, threading.get_ident())
+
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        pq.write_table(table, temp_file, compression=feature_store['compression'])
+        os.replace(temp_file, part_file)
+
+
+    def write(self, kind: str, symbol: str, df: pd.DataFrame) -> None:
+        '''Replace all features of the symbol
+
+           @param: kind: kind of feature, e.g. ta or news
+           @param: df: features with a leading 'date' column, ordered by date
+        '''
+
+        with self._lock:
+            for part_file in self._parts(kind, symbol):
+                os.remove(part_file)
+
+            self._write_part(kind, symbol, df, 0)
+
+
+    def append(self, kind: str, symbol: str, df: pd.DataFrame) -> None:
+        '''Add features of later dates. Stored features of the same or later dates
+           are replaced, which rewrites the partition. The stored features are read
+           and written under the lock, so that no concurrent append is lost
+        '''
+
+        if len(df) == 0:
+            return
+
+        with self._lock:
+            last_date = self.last_date(kind, symbol)
+
+            if last_date and df['date'].iloc[0] <= last_date:
+                stored = self.read(kind, symbol, end=df['date'].iloc[0], inclusive_end=False)
+                self.write(kind, symbol, pd.concat([stored, df], ignore_index=True))
+                return
+
+            parts = self._parts(kind, symbol)
+            part = int(os.path.basename(parts[-1])[5:10]) + 1 if parts else 0
+
+            self._write_part(kind, symbol, df, part)
+
+            # Keep the number of files small
+            if part + 1 >= feature_store['max_parts']:
+                parts = self._parts(kind, symbol)
+                df = ds.dataset(parts, format='parquet').to_table().to_pandas()
+
+                for part_file in parts:
+                    os.remove(part_file)
+
+                self._write_part(kind, symbol, df, 0)
+
+
+    def read(self, kind: str, symbol: str, columns: Sequence[str] = None, start: str = '',
+             end: str = '', inclusive_end: bool = True) -> pd.DataFrame:
+        '''Read features of the symbol, only the parts, row groups and columns needed
+
+           @param: columns: columns to read besides 'date'. If None, read all columns
+           @param: start: read features not earlier than this date, yyyy-mm-dd
+           @param: end: read features not later than this date, yyyy-mm-dd
+           @param: inclusive_end: whether features of the end date are read
+           @return: data frame ordered by date, empty if nothing is stored
+        '''
+
+        parts = self._parts(kind, symbol)
+
+        if len(parts) == 0:
+            return pd.DataFrame(columns=['date'] + list(columns or []))
+
+        dataset = ds.dataset(parts, format='parquet')
+        date, condition = ds.field('date'), None
+
+        if start:
+            condition = date >= start
+        if end:
+            before = date <= end if inclusive_end else date < end
+            condition = before if condition is None else condition & before
+
+        if columns is not None:
+            columns = ['date'] + [column for column in columns if column != 'date']
+
+        return dataset.to_table(columns=columns, filter=condition).to_pandas()
+
+
+    def version(self, kind: str, symbol: str) -> tuple:
+        '''Name, modification time and size of each part, changed by any write'''
+
+        version = []
+        for part_file in self._parts(kind, symbol):
+            stat = os.stat(part_file)
+            version.append((os.path.basename(part_file), stat.st_mtime_ns, stat.st_size))
+
+        return tuple(version)
+
+
+    def last_date(self, kind: str, symbol: str) -> str:
+        '''Date of the latest stored features, empty if nothing is stored'''
+
+        parts = self._parts(kind, symbol)
+
+        if len(parts) == 0:
+            return ''
+
+        # Parts are ordered by date, only the last one is read
+        last_date = pc.max(pq.read_table(parts[-1], columns=['date'])['date']).as_py()
+
+        return last_date or ''
+
+
+def import_csv(symbols: Sequence[str] = (), csv_folder: str = _csv_folder) -> None:
+    '''Import the features previously saved as csv files into the store
+
+       @param: symbols: symbols whose features to import. If empty, use all symbols
+    '''
+
+    store = FeatureStore()
+
+    for symbol in ('Market',) + tuple(symbols or db_init['symbols']):
+        for kind in ('ta', 'news'):
+            csv_file = csv_folder + '{0}_{1}.csv'.format(symbol, kind)
+
+            if not os.path.exists(csv_file):
+                continue
+
+            try:
+                store.write(kind, symbol, pd.read_csv(csv_file, sep=',', dtype={'date': str}))
+                logger.info('Import %s into the feature store', csv_file)
+            except pd.errors.EmptyDataError:
+                logger.warning('Skip empty feature file %s', csv_file)
+
+
+if __name__ == '__main__':
+    # python feature_store.py import
+    if sys.argv[1:] == ['import']:
+        logging.basicConfig(level=logging.INFO)
+        import_csv()
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import sys
+import time
+from typing import Sequence, List, Tuple, Dict
+
+import numpy as np
+import sklearn
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.utils.fixes import parse_version
+
+from config import forest_inference
+
+
+logger = logging.getLogger(__name__)
+
+# Trees keep class counts at the nodes before 1.4, normalized by predict_proba, and
+# class fractions since then, returned as they are
+_normalize_value = parse_version(sklearn.__version__) < parse_version('1.4')
+
+
+class FlatForest(object):
+    '''Fitted random forest exported to flat node arrays of all trees, evaluated for
+       many rows and all trees at once. Probabilities are those of predict_proba of
+       the forest with n_jobs=1: rows cast to float32, split when x <= threshold,
+       class fractions of the leaves added tree by tree, then divided by the number
+       of trees
+
+       @param: clf: fitted RandomForestClassifier
+    '''
+
+    def __init__(self, clf: RandomForestClassifier):
+        self.classes_ = clf.classes_
+        self.n_features_in_ = clf.n_features_in_
+
+        n_classes = len(clf.classes_)
+        trees = [estimator.tree_ for estimator in clf.estimators_]
+        offsets = np.cumsum([0] + [tree.node_count for tree in trees])
+
+        features, thresholds, lefts, rights, missing_left, values = [], [], [], [], [], []
+
+        for tree, offset in zip(trees, offsets):
+            is_leaf = tree.children_left < 0
+            nodes = np.arange(tree.node_count)
+
+            # Leaves point to themselves, so that all rows take the same number of steps
+            features.append(np.where(is_leaf, 0, tree.feature))
+            thresholds.append(np.where(is_leaf, np.inf, tree.threshold))
+            lefts.append(np.where(is_leaf, nodes, tree.children_left) + offset)
+            rights.append(np.where(is_leaf, nodes, tree.children_right) + offset)
+            missing_left.append(getattr(tree, 'missing_go_to_left', np.zeros(tree.node_count, dtype='uint8')) != 0)
+
+            # As by DecisionTreeClassifier.predict_proba
+            value = tree.value[:, 0, :n_classes].astype('float64')
+            if _normalize_value:
+                normalizer = value.sum(axis=1)[:, np.newaxis]
+                normalizer[normalizer == 0.0] = 1.0
+                value = value / normalizer
+            values.append(value)
+
+        self.roots = offsets[:-1].astype('intp')
+        self.feature = np.concatenate(features).astype('intp')
+        self.threshold = np.concatenate(thresholds)
+        self.missing_left = np.concatenate(missing_left)
+        self.value = np.concatenate(values)
+        self.max_depth = max([tree.max_depth for tree in trees] + [0])
+
+        # Children of node i at 2 * i (left) and 2 * i + 1 (right)
+        self.children = np.column_stack([np.concatenate(lefts), np.concatenate(rights)]).astype('intp').ravel()
+
+
+    def _apply(self, X: np.ndarray) -> np.ndarray:
+        # Leaves of the rows by tree, (tree x row). Features are laid out by column so
+        # that the rows of a tree read nearby values
+        n_rows = len(X)
+        columns = np.ascontiguousarray(X.T).ravel()
+        row = np.arange(n_rows)
+        has_nan = np.isnan(columns).any()
+
+        node = np.repeat(self.roots[:, np.newaxis], n_rows, axis=1)
+
+        for _ in range(self.max_depth):
+            x = columns.take(self.feature.take(node) * n_rows + row)
+            go_right = x > self.threshold.take(node)
+            if has_nan:
+                go_right |= np.isnan(x) & ~self.missing_left.take(node)
+            node = self.children.take(2 * node + go_right)
+
+        return node
+
+
+    def apply(self, X: np.ndarray) -> np.ndarray:
+        '''Global index of the leaf reached by each row in each tree, (row x tree)'''
+
+        X = np.asarray(X, dtype='float32').reshape(-1, self.n_features_in_)
+        return self._apply(X).T
+
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        '''Probabilities of the classes in the order of classes_, (row x class)
+
+           @param: X: features, (row x feature)
+        '''
+
+        X = np.asarray(X, dtype='float32').reshape(-1, self.n_features_in_)
+        proba = np.empty((len(X), len(self.classes_)))
+
+        chunk = max(1, forest_inference['max_elements'] // max(len(self.roots), 1))
+
+        for start in range(0, len(X), chunk):
+            leaves = self._apply(X[start:start + chunk])
+
+            # Added in tree order: numpy sums pairwise only along the contiguous axis,
+            # the leading tree axis is summed one tree after another
+            proba[start:start + chunk] = self.value.take(leaves, axis=0).sum(axis=0)
+
+        proba /= len(self.roots)
+
+        return proba
+
+
+def test(n_rows: int = 2000, seed: int = 0):
+    '''Exact parity with predict_proba and apply of the forest, for rows at the split
+       thresholds, missing values, binary classes and deeper trees
+    '''
+
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(n_rows, 8))
+    y = np.where(X[:, 0] + rng.normal(0, 0.5, n_rows) > 0.3, 1, np.where(X[:, 1] > 0.5, -1, 0))
+
+    cases = [({'n_estimators': 500, 'max_depth': 3, 'max_features': 'sqrt'}, y),
+             ({'n_estimators': 50, 'max_depth': None, 'max_features': 'sqrt'}, y),
+             ({'n_estimators': 100, 'max_depth': 5, 'max_features': None}, np.sign(X[:, 2]).astype(int))]
+
+    for param, labels in cases:
+        clf = RandomForestClassifier(**param, random_state=seed).fit(X[:n_rows // 2], labels[:n_rows // 2])
+        forest = FlatForest(clf)
+
+        # Rows on the thresholds of the splits, where float32 rounding matters
+        on_split = X[n_rows // 2:].copy()
+        tree = clf.estimators_[0].tree_
+        for i, node in enumerate(np.flatnonzero(tree.children_left >= 0)[:len(on_split)]):
+            on_split[i, tree.feature[node]] = tree.threshold[node]
+
+        # Missing values go the way of the split in training, as by sklearn
+        missing = X[n_rows // 2:].copy()
+        missing[rng.random(missing.shape) < 0.1] = np.nan
+
+        for rows in (X[n_rows // 2:], on_split, missing, X[:1]):
+            assert np.array_equal(forest.predict_proba(rows), clf.predict_proba(rows)), param
+            assert np.array_equal(forest.apply(rows) - forest.roots, clf.apply(rows)), param
+
+    logger.info('Flat forest matches predict_proba on %d cases', len(cases))
+
+
+def benchmark(n_train: int = 500, n_rows: Sequence[int] = (1, 1000, 100000), repeat: int = 3):
+    '''Single-row latency and bulk throughput of the flat forest against predict_proba
+       of the forest of Model.param
+    '''
+
+    from model import Model
+
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(n_train + max(n_rows), 40))
+    y = np.where(X[:, 0] + rng.normal(0, 1, len(X)) > 0.3, 1, np.where(X[:, 1] > 0.5, -1, 0))
+
+    clf = RandomForestClassifier(**Model.param, n_jobs=1).fit(X[:n_train], y[:n_train])
+
+    start_time = time.monotonic()
+    forest = FlatForest(clf)
+    logger.info('Export %d trees, %d nodes: %.2f ms', len(clf.estimators_), len(forest.feature),
+                (time.monotonic() - start_time) * 1000)
+
+    for n in n_rows:
+        rows = X[n_train:n_train + n]
+        timing = {}
+
+        for name, predict in (('sklearn', clf.predict_proba), ('flat', forest.predict_proba)):
+            elapsed = []
+            for _ in range(repeat):
+                start_time = time.monotonic()
+                predict(rows)
+                elapsed.append(time.monotonic() - start_time)
+            timing[name] = min(elapsed)
+
+        logger.info('%7d rows: sklearn %9.2f ms, flat %9.2f ms (%.1fx), %.0f rows/s', n, timing['sklearn'] * 1000,
+                    timing['flat'] * 1000, timing['sklearn'] / timing['flat'], n / timing['flat'])
+
+
+if __name__ == '__main__':
+    # python forest_inference.py [test|benchmark]
+    logging.basicConfig(level=logging.INFO)
+
+    if sys.argv[1:] == ['benchmark']:
+        benchmark()
+    else:
+        test()
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import math
+import os
+from typing import Sequence, List, Tuple, Dict
+
+import numpy as np
+import pandas as pd
+
+from config import data_path
+
+
+logger = logging.getLogger(__name__)
+
+_state_folder = data_path['root_path'] + 'indicator_state/'
+
+# Columns of the ta features, as built by feature.build_ta_feature
+ta_columns = ('date', 'adj_close', 'ub_r', 'mb_r', 'lb_r', 'trima_r', 'wma_r',
+              'macdhist', 'ppo', 'rsi', 'adosc', 'natr')
+
+# Number of latest closes kept for the rolling windows, the longest being TRIMA/WMA
+_window = 30
+
+# Index of the first bar with all features, the lookback of MACD(12, 26, 9)
+_first_feature = 26 - 1 + 9 - 1
+
+_trima_weights = np.convolve(np.ones(15), np.ones(16)) / (15 * 16)
+_wma_weights = np.arange(1, 31) / (30 * 31 / 2)
+
+
+def _is_zero(value: float) -> bool:
+    return -1e-8 < value < 1e-8
+
+
+def _ema(prev: float, value: float, k: float) -> float:
+    return (value - prev) * k + prev
+
+
+class IncrementalTA(object):
+    '''Streaming version of the ta features of feature.build_ta_feature. The recursive
+       state of each indicator (EMA of MACD, Wilder smoothing of RSI/NATR, AD line
+       and EMA of ADOSC) and the latest closes for the rolling windows (BBANDS, TRIMA,
+       WMA, PPO) are advanced bar by bar, seeded the same way as talib does
+    '''
+
+    def __init__(self, state: dict = None):
+        self.state = state or {
+            'n'      : 0,       # number of bars seen
+            'date'   : '',      # date of the last bar
+            'closes' : [],      # latest closes, at most _window
+            'macd'   : {'fast': 0.0, 'slow': 0.0, 'signal': 0.0, 'seed': []},
+            'rsi'    : {'gain': 0.0, 'loss': 0.0},
+            'atr'    : {'atr': 0.0},
+            'adosc'  : {'ad': 0.0, 'fast': 0.0, 'slow': 0.0},
+        }
+
+
+    def _step(self, high: float, low: float, close: float, volume: float) -> tuple:
+        '''Advance the state by one bar
+
+           @return: features of the bar, None if not all features are available yet
+        '''
+
+        state = self.state
+        t, closes = state['n'], state['closes']
+        prev_close = closes[-1] if closes else close
+
+        closes.append(close)
+        if len(closes) > _window:
+            del closes[0]
+
+        # MACD(12, 26, 9): both EMA are seeded with a SMA at bar 25, the fast one
+        # with the 12 latest closes. The signal is seeded with the SMA of 9 MACD
+        macd = state['macd']
+        if t == 25:
+            macd['slow'] = sum(closes[-26:]) / 26
+            macd['fast'] = sum(closes[-12:]) / 12
+        elif t > 25:
+            macd['slow'] = _ema(macd['slow'], close, 2 / 27)
+            macd['fast'] = _ema(macd['fast'], close, 2 / 13)
+
+        if t >= 25:
+            value = macd['fast'] - macd['slow']
+
+            if t < _first_feature:
+                macd['seed'].append(value)
+            elif t == _first_feature:
+                macd['signal'] = (sum(macd['seed']) + value) / 9
+                macd['seed'] = []
+            else:
+                macd['signal'] = _ema(macd['signal'], value, 2 / 10)
+
+            macdhist = value - macd['signal']
+
+        # RSI(14) and ATR(14) with Wilder smoothing, seeded with the average
+        # gain/loss and true range of the first 14 changes
+        rsi, atr = state['rsi'], state['atr']
+        if t > 0:
+            change = close - prev_close
+            true_range = max(high, prev_close) - min(low, prev_close)
+
+            if t < 14:
+                rsi['gain'] += max(change, 0.0)
+                rsi['loss'] -= min(change, 0.0)
+                atr['atr'] += true_range
+            elif t == 14:
+                rsi['gain'] = (rsi['gain'] + max(change, 0.0)) / 14
+                rsi['loss'] = (rsi['loss'] - min(change, 0.0)) / 14
+                atr['atr'] = (atr['atr'] + true_range) / 14
+            else:
+                rsi['gain'] = (rsi['gain'] * 13 + max(change, 0.0)) / 14
+                rsi['loss'] = (rsi['loss'] * 13 - min(change, 0.0)) / 14
+                atr['atr'] = (atr['atr'] * 13 + true_range) / 14
+
+        # ADOSC(3, 10): both EMA of the AD line are seeded with its first value
+        adosc = state['adosc']
+        if high - low > 0:
+            adosc['ad'] += ((close - low) - (high - close)) / (high - low) * volume
+
+        if t == 0:
+            adosc['fast'] = adosc['slow'] = adosc['ad']
+        else:
+            adosc['fast'] = 2 / 4 * adosc['ad'] + (1 - 2 / 4) * adosc['fast']
+            adosc['slow'] = 2 / 11 * adosc['ad'] + (1 - 2 / 11) * adosc['slow']
+
+        state['n'] += 1
+
+        if t < _first_feature:
+            return None
+
+        window = np.array(closes)
+
+        # BBANDS(5, 2, 2)
+        middle = window[-5:].sum() / 5
+        variance = (window[-5:] ** 2).sum() / 5 - middle ** 2
+        stddev = math.sqrt(variance) if variance >= 1e-8 else 0.0
+
+        fast, slow = window[-12:].sum() / 12, window[-26:].sum() / 26
+        ppo = (fast - slow) / slow * 100 if not _is_zero(slow) else 0.0
+
+        total = rsi['gain'] + rsi['loss']
+        rsi_value = 100 * (rsi['gain'] / total) if not _is_zero(total) else 0.0
+        natr = atr['atr'] / close * 100 if not _is_zero(close) else 0.0
+
+        return ((middle + 2 * stddev) / close, middle / close, (middle - 2 * stddev) / close,
+                window @ _trima_weights / close, window @ _wma_weights / close,
+                macdhist, ppo, rsi_value, adosc['fast'] - adosc['slow'], natr)
+
+
+    def update(self, daily) -> pd.DataFrame:
+        '''Advance the indicators by the new daily bars
+
+           @param: daily: daily data later than the last bar seen, as a data frame or
+                          dict of column arrays with the columns of database.daily_columns
+           @return: ta features of the new bars, with ta_columns
+        '''
+
+        columns = [np.asarray(daily[name]) for name in ('date', 'adj_close', 'high', 'low', 'close', 'volume')]
+        rows = []
+
+        for date, adj_close, high, low, close, volume in zip(*columns):
+            feature = self._step(float(high), float(low), float(close), float(volume))
+            self.state['date'] = str(date)
+
+            if feature is not None:
+                rows.append((str(date), float(adj_close)) + feature)
+
+        return pd.DataFrame(rows, columns=ta_columns)
+
+
+    def save(self, symbol: str, state_folder: str = _state_folder) -> None:
+        os.makedirs(state_folder, exist_ok=True)
+
+        state_file = state_folder + '{0}.json'.format(symbol)
+        with open(state_file + '.tmp', 'w') as f:
+            json.dump(self.state, f)
+        os.replace(state_file + '.tmp', state_file)
+
+
+    @classmethod
+    def load(cls, symbol: str, state_folder: str = _state_folder):
+        '''Engine with the saved state of the symbol, None if never saved'''
+
+        state_file = state_folder + '{0}.json'.format(symbol)
+
+        if not os.path.exists(state_file):
+            return None
+
+        with open(state_file, 'r') as f:
+            return cls(json.load(f))
+
+
+def test(n_bars: int = 600, seed: int = 0):
+    '''Parity of the incremental features with a full recompute by build_ta_feature,
+       advancing one bar at a time and through a saved state
+    '''
+
+    import tempfile
+    from feature import build_ta_feature
+
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, n_bars)))
+    spread = close * rng.uniform(0, 0.03, n_bars)
+
+    daily = {
+        'date'     : np.datetime_as_string(np.datetime64('2018-01-01') + np.arange(n_bars)),
+        'open'     : close + rng.normal(0, 0.5, n_bars),
+        'high'     : close + spread,
+        'low'      : close - spread,
+        'close'    : close,
+        'adj_close': close,
+        'volume'   : rng.integers(1e6, 1e7, n_bars),
+    }
+
+    expected = build_ta_feature('TEST', daily, save_feature=False).reset_index(drop=True)
+
+    # Cold start on part of the history, then one bar at a time
+    engine, split = IncrementalTA(), n_bars // 2
+    parts = [engine.update({name: values[:split] for name, values in daily.items()})]
+
+    with tempfile.TemporaryDirectory() as state_folder:
+        for i in range(split, n_bars):
+            engine.save('TEST', state_folder + '/')
+            engine = IncrementalTA.load('TEST', state_folder + '/')
+            parts.append(engine.update({name: values[i : i + 1] for name, values in daily.items()}))
+
+    actual = pd.concat(parts, ignore_index=True)
+
+    assert actual['date'].tolist() == expected['date'].tolist()
+
+    for column in ta_columns[1:]:
+        assert np.allclose(actual[column], expected[column], rtol=1e-9, atol=1e-9), column
+
+    logger.info('Incremental ta features match the full recompute on %d bars', n_bars)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    test()
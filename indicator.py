@@ -1,12 +1,25 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import sys
+import time
+from typing import Sequence, List, Tuple, Dict
 
 import numpy as np
-import talib
 
+from config import indicator
+from indicator_numpy import NumpyIndicator
 
-class Indicator(object):
+try:
+    import talib
+except ImportError:
+    talib = None
+
+
+logger = logging.getLogger(__name__)
+
+
+class TalibIndicator(object):
     '''Wrapper for various useful indicators
        See https://mrjbq7.github.io/ta-lib/
     '''
@@ -161,5 +174,255 @@ class Indicator(object):
         return talib.TRANGE(high, low, close)
 
 
+def _create_backend(backend: str):
+    if backend == 'talib':
+        if talib is not None:
+            return TalibIndicator
+
+        logger.warning('talib is not installed, use the numpy indicators')
+        return NumpyIndicator
+
+    if backend == 'numpy':
+        return NumpyIndicator
+
+    raise ValueError('Unsupported indicator backend: {0}'.format(backend))
+
+
+_backend = _create_backend(indicator['backend'])
+
+
+class Indicator(object):
+    '''Various useful indicators, computed by the backend set in config.indicator:
+       talib, or vectorized numpy which also takes 2-D arrays (time x series)
+    '''
+
+    @classmethod
+    def use_backend(cls, backend: str) -> None:
+        '''Switch to the indicators of the backend, 'talib' or 'numpy' '''
+
+        global _backend
+        _backend = _create_backend(backend)
+
+
+    @classmethod
+    def backend(cls) -> str:
+        return 'talib' if _backend is TalibIndicator else 'numpy'
+
+
+    # Overlap Studies Functions
+    @classmethod
+    def BBANDS(cls, close, timeperiod=5, nbdevup=2, nbdevdn=2, matype=0):
+        return _backend.BBANDS(close, timeperiod, nbdevup, nbdevdn, matype)
+
+
+    @classmethod
+    def DEMA(cls, close, timeperiod=30):
+        return _backend.DEMA(close, timeperiod)
+
+
+    @classmethod
+    def MA(cls, close, timeperiod=30, matype=0):
+        return _backend.MA(close, timeperiod, matype)
+
+
+    @classmethod
+    def SMA(cls, close, timeperiod=30):
+        return _backend.SMA(close, timeperiod)
+
+
+    @classmethod
+    def TEMA(cls, close, timeperiod=30):
+        return _backend.TEMA(close, timeperiod)
+
+
+    @classmethod
+    def TRIMA(cls, close, timeperiod=30):
+        return _backend.TRIMA(close, timeperiod)
+
+
+    @classmethod
+    def WMA(cls, close, timeperiod=30):
+        return _backend.WMA(close, timeperiod)
+
+
+    # Momentum Indicator Functions
+    @classmethod
+    def APO(cls, close, fastperiod=12, slowperiod=26, matype=0):
+        return _backend.APO(close, fastperiod, slowperiod, matype)
+
+
+    @classmethod
+    def MACD(cls, close, fastperiod=12, slowperiod=26, signalperiod=9):
+        return _backend.MACD(close, fastperiod, slowperiod, signalperiod)
+
+
+    @classmethod
+    def MOM(cls, close, timeperiod=10):
+        return _backend.MOM(close, timeperiod)
+
+
+    @classmethod
+    def PPO(cls, close, fastperiod=12, slowperiod=26, matype=0):
+        return _backend.PPO(close, fastperiod, slowperiod, matype)
+
+
+    @classmethod
+    def ROC(cls, close, timeperiod=10):
+        return _backend.ROC(close, timeperiod)
+
+
+    @classmethod
+    def RSI(cls, close, timeperiod=14):
+        return _backend.RSI(close, timeperiod)
+
+
+    # Volume Indicator Functions
+    @classmethod
+    def AD(cls, high, low, close, volume):
+        return _backend.AD(high, low, close, volume)
+
+
+    @classmethod
+    def ADOSC(cls, high, low, close, volume, fastperiod=3, slowperiod=10):
+        return _backend.ADOSC(high, low, close, volume, fastperiod, slowperiod)
+
+
+    @classmethod
+    def OBV(cls, close, volume):
+        return _backend.OBV(close, volume)
+
+
+    # Volatility Indicator Functions
+    @classmethod
+    def ATR(cls, high, low, close, timeperiod=14):
+        return _backend.ATR(high, low, close, timeperiod)
+
+
+    @classmethod
+    def NATR(cls, high, low, close, timeperiod=14):
+        return _backend.NATR(high, low, close, timeperiod)
+
+
+    @classmethod
+    def TRANGE(cls, high, low, close):
+        return _backend.TRANGE(high, low, close)
+
+
+#############################################################
+# Parity of the numpy indicators with talib
+
+def _random_bars(n_bars: int, n_series: int, seed: int = 0) -> Dict[str, np.ndarray]:
+    '''Random daily bars of a batch of series, (n_bars x n_series) arrays'''
+
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, (n_bars, n_series)), axis=0))
+    spread = close * rng.uniform(0, 0.03, (n_bars, n_series))
+
+    return {
+        'high'  : close + spread,
+        'low'   : close - spread,
+        'close' : close,
+        'volume': rng.integers(1e6, 1e7, (n_bars, n_series)) * 1.0,
+    }
+
+
+def _cases() -> List[tuple]:
+    '''Name, inputs and parameters of the indicators to compare'''
+
+    cases = [
+        ('BBANDS', ('close',), (5, 2, 2)), ('BBANDS', ('close',), (20, 1.5, 2.5)),
+        ('DEMA', ('close',), (30,)), ('SMA', ('close',), (30,)), ('TEMA', ('close',), (30,)), 
+        ('TRIMA', ('close',), (30,)), ('TRIMA', ('close',), (15,)), ('WMA', ('close',), (30,)),
+        ('MACD', ('close',), (12, 26, 9)), ('MACD', ('close',), (26, 12, 5)), 
+        ('MOM', ('close',), (10,)), ('ROC', ('close',), (10,)), ('RSI', ('close',), (14,)),
+        ('AD', ('high', 'low', 'close', 'volume'), ()), 
+        ('ADOSC', ('high', 'low', 'close', 'volume'), (3, 10)),
+        ('OBV', ('close', 'volume'), ()), ('ATR', ('high', 'low', 'close'), (14,)),
+        ('NATR', ('high', 'low', 'close'), (14,)), ('TRANGE', ('high', 'low', 'close'), ()),
+    ]
+
+    # Moving averages of all supported types
+    for matype in range(6):
+        cases += [('MA', ('close',), (30, matype)), ('BBANDS', ('close',), (5, 2, 2, matype)),
+                  ('APO', ('close',), (12, 26, matype)), ('PPO', ('close',), (12, 26, matype))]
+
+    return cases
+
+
+def test(n_bars: int = 800, seed: int = 0):
+    '''Parity of the numpy indicators on a batch of series with talib applied to
+       the bars of each series, for series with shorter histories and missing bars
+    '''
+
+    if talib is None:
+        raise ImportError('talib is required to test the numpy indicators')
+
+    bars = _random_bars(n_bars, 6, seed)
+    rng = np.random.default_rng(seed)
+
+    # Shorter histories, a history shorter than most lookbacks and missing bars
+    for j, first_bar in enumerate((0, 0, 50, 300, n_bars - 20, 0)):
+        for values in bars.values():
+            values[:first_bar, j] = np.nan
+    bars['close'][rng.random(n_bars) < 0.05, 5] = np.nan
+
+    for name, inputs, params in _cases():
+        actual = getattr(NumpyIndicator, name)(*[bars[x] for x in inputs], *params)
+        actual = actual if isinstance(actual, tuple) else (actual,)
+
+        for j in range(bars['close'].shape[1]):
+            valid = ~np.any([np.isnan(bars[x][:, j]) for x in inputs], axis=0)
+
+            expected = getattr(TalibIndicator, name)(*[bars[x][valid, j] for x in inputs], *params)
+            expected = expected if isinstance(expected, tuple) else (expected,)
+
+            for a, e in zip(actual, expected):
+                assert np.isnan(a[~valid, j]).all(), (name, params, j)
+                assert np.array_equal(np.isnan(a[valid, j]), np.isnan(e)), (name, params, j)
+                assert np.allclose(a[valid, j], e, rtol=1e-9, atol=1e-9, equal_nan=True), (name, params, j)
+
+    logger.info('Numpy indicators match talib on %d cases', len(_cases()))
+
+
+def benchmark(lengths: Sequence[int] = (100, 1000, 10000), n_series: int = 100, repeat: int = 3):
+    '''Seconds to compute each indicator on n_series series of each length, by talib
+       one series at a time and by numpy on one (length x n_series) array
+    '''
+
+    if talib is None:
+        raise ImportError('talib is required to benchmark the numpy indicators')
+
+    def best_time(func) -> float:
+        timing = []
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            func()
+            timing.append(time.perf_counter() - start_time)
+        return min(timing)
+
+    for n_bars in lengths:
+        bars = _random_bars(n_bars, n_series)
+        columns = [{x: values[:, j].copy() for x, values in bars.items()} for j in range(n_series)]
+        total = [0.0, 0.0]
+
+        for name, inputs, params in _cases():
+            talib_time = best_time(lambda: [getattr(TalibIndicator, name)(*[c[x] for x in inputs], *params) 
+                                            for c in columns])
+            numpy_time = best_time(lambda: getattr(NumpyIndicator, name)(*[bars[x] for x in inputs], *params))
+            total[0], total[1] = total[0] + talib_time, total[1] + numpy_time
+
+            logger.info('%-6s %-16s %6d bars: talib %.5f, numpy %.5f seconds', 
+                        name, params, n_bars, talib_time, numpy_time)
+
+        logger.info('All indicators, %d series of %d bars: talib %.4f, numpy %.4f seconds',
+                    n_series, n_bars, total[0], total[1])
+
+
 if __name__ == '__main__':
-    pass
+    # python indicator.py [test | benchmark]
+    logging.basicConfig(level=logging.INFO)
+
+    if sys.argv[1:] == ['test']:
+        test()
+    elif sys.argv[1:] == ['benchmark']:
+        benchmark()
@@ -0,0 +1,422 @@
+# -*- coding: utf-8 -*-
+
+import logging
+from typing import Sequence, List, Tuple, Dict
+
+import numpy as np
+import pandas as pd
+from scipy.signal import lfilter
+
+
+logger = logging.getLogger(__name__)
+
+
+#############################################################
+# Batches of series are 2-D arrays (time x series). The bars of each series are
+# packed at the top of its column before computing, so that a series with a
+# shorter history or missing bars (NaN) is computed on its own bars, like a
+# separate talib call. Results are NaN where talib has no output. A pandas
+# Series gives a Series, like talib does
+
+def _is_zero(x: np.ndarray) -> np.ndarray:
+    return (-1e-8 < x) & (x < 1e-8)
+
+
+def _apply(kernel, inputs: Sequence, *params):
+    '''Run the kernel on packed 2-D inputs and scatter its outputs back in time'''
+
+    index = inputs[0].index if isinstance(inputs[0], pd.Series) else None
+    arrays = [np.asarray(x, dtype='float64') for x in inputs]
+    is_1d = arrays[0].ndim == 1
+    arrays = [x.reshape(len(x), -1) for x in arrays]
+
+    invalid = np.zeros(arrays[0].shape, dtype=bool)
+    for x in arrays:
+        invalid |= np.isnan(x)
+
+    # Valid bars first, in time order. Nothing to move without a missing bar
+    packed = invalid.any()
+    if packed:
+        order = np.argsort(invalid, axis=0, kind='stable')
+        invalid = np.take_along_axis(invalid, order, axis=0)
+        arrays = [np.where(invalid, np.nan, np.take_along_axis(x, order, axis=0)) for x in arrays]
+
+    outputs = kernel(*arrays, *params)
+    single = isinstance(outputs, np.ndarray)
+
+    results = []
+    for out in ((outputs,) if single else outputs):
+        if packed:
+            y, out = out, np.full(out.shape, np.nan)
+            np.put_along_axis(out, order, np.where(invalid, np.nan, y), axis=0)
+
+        out = out[:, 0] if is_1d else out
+        results.append(out if index is None else pd.Series(out, index=index))
+
+    return results[0] if single else tuple(results)
+
+
+def _weighted(x: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    '''Weighted sum of the latest len(weights) bars at each bar from len(weights) - 1
+       on, the first weight for the oldest bar. Computed by a linear filter
+    '''
+
+    n = len(weights)
+    out = np.full(x.shape, np.nan)
+    if len(x) >= n:
+        out[n - 1:] = lfilter(weights[::-1], [1.0], x, axis=0)[n - 1:]
+
+    return out
+
+
+def _rolling_sum(x: np.ndarray, n: int) -> np.ndarray:
+    '''Sum of the latest n bars at each bar from n - 1 on, by differences of the
+       running sum like talib does
+    '''
+
+    out = np.full(x.shape, np.nan)
+    if len(x) >= n:
+        total = np.cumsum(x, axis=0)
+        out[n - 1] = total[n - 1]
+        out[n:] = total[n:] - total[:len(x) - n]
+
+    return out
+
+
+def _sma(x: np.ndarray, n: int) -> np.ndarray:
+    return _rolling_sum(x, n) / n
+
+
+def _recursive(x: np.ndarray, k: float, start: int, seed: np.ndarray) -> np.ndarray:
+    '''y[start] = seed, then y[t] = k * x[t] + (1 - k) * y[t - 1], e.g. EMA and
+       Wilder smoothing. Computed for all series at once by a linear filter
+    '''
+
+    out = np.full(x.shape, np.nan)
+    if start >= len(x):
+        return out
+
+    out[start] = seed
+    if start + 1 < len(x):
+        out[start + 1:] = lfilter([k], [1, k - 1], x[start + 1:], axis=0, zi=[(1 - k) * seed])[0]
+
+    return out
+
+
+def _lagged(x: np.ndarray, n: int) -> np.ndarray:
+    out = np.full(x.shape, np.nan)
+    out[n:] = x[:len(x) - n]
+    return out
+
+
+#############################################################
+# Kernels on packed 2-D arrays
+
+def _ema(close, timeperiod, first=0):
+    # Seeded with the SMA of the first values, from the first valid row
+    start = first + timeperiod - 1
+    return _recursive(close, 2 / (timeperiod + 1), start, close[first : start + 1].sum(axis=0) / timeperiod)
+
+
+def _dema(close, timeperiod):
+    ema = _ema(close, timeperiod)
+    return 2 * ema - _ema(ema, timeperiod, timeperiod - 1)
+
+
+def _tema(close, timeperiod):
+    ema1 = _ema(close, timeperiod)
+    ema2 = _ema(ema1, timeperiod, timeperiod - 1)
+    ema3 = _ema(ema2, timeperiod, 2 * (timeperiod - 1))
+
+    return 3 * ema1 - 3 * ema2 + ema3
+
+
+def _ma(close, timeperiod, matype):
+    return _moving_averages[matype](close, timeperiod)
+
+
+def _bbands(close, timeperiod, nbdevup, nbdevdn, matype):
+    # The deviation is always around the simple moving average. The mean square
+    # is summed per window, a difference of running sums of squares is not exact enough
+    mean = _sma(close, timeperiod)
+    variance = _weighted(close * close, np.full(timeperiod, 1 / timeperiod)) - mean ** 2
+    stddev = np.where(variance >= 1e-8, np.sqrt(np.maximum(variance, 0)), 0.0)
+    stddev[np.isnan(variance)] = np.nan
+
+    middle = mean if matype == 0 else _ma(close, timeperiod, matype)
+
+    return middle + nbdevup * stddev, middle, middle - nbdevdn * stddev
+
+
+def _trima(close, timeperiod):
+    # SMA of SMA, the periods differing by one for an even period
+    n1, n2 = (timeperiod + 1) // 2, timeperiod // 2 + 1
+    return _weighted(close, np.convolve(np.ones(n1), np.ones(n2)) / (n1 * n2))
+
+
+def _wma(close, timeperiod):
+    return _weighted(close, np.arange(1, timeperiod + 1) / (timeperiod * (timeperiod + 1) / 2))
+
+
+def _macd(close, fastperiod, slowperiod, signalperiod):
+    if slowperiod < fastperiod:
+        fastperiod, slowperiod = slowperiod, fastperiod
+
+    # Both EMA are seeded with a SMA at the first bar of the slow EMA
+    start = slowperiod - 1
+    slow = _recursive(close, 2 / (slowperiod + 1), start, close[:slowperiod].sum(axis=0) / slowperiod)
+    fast = _recursive(close, 2 / (fastperiod + 1), start,
+                      close[start - fastperiod + 1 : start + 1].sum(axis=0) / fastperiod)
+    macd = fast - slow
+
+    first = start + signalperiod - 1
+    signal = _recursive(macd, 2 / (signalperiod + 1), first,
+                        macd[start : first + 1].sum(axis=0) / signalperiod)
+    macd[:first] = np.nan
+
+    return macd, signal, macd - signal
+
+
+def _apo(close, fastperiod, slowperiod, matype):
+    if slowperiod < fastperiod:
+        fastperiod, slowperiod = slowperiod, fastperiod
+
+    return _ma(close, fastperiod, matype) - _ma(close, slowperiod, matype)
+
+
+def _ppo(close, fastperiod, slowperiod, matype):
+    if slowperiod < fastperiod:
+        fastperiod, slowperiod = slowperiod, fastperiod
+
+    fast, slow = _ma(close, fastperiod, matype), _ma(close, slowperiod, matype)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ppo = np.where(_is_zero(slow), 0.0, (fast - slow) / slow * 100)
+    ppo[np.isnan(slow)] = np.nan
+
+    return ppo
+
+
+def _mom(close, timeperiod):
+    return close - _lagged(close, timeperiod)
+
+
+def _roc(close, timeperiod):
+    prev = _lagged(close, timeperiod)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        roc = np.where(prev != 0, (close / prev - 1) * 100, 0.0)
+    roc[np.isnan(prev)] = np.nan
+
+    return roc
+
+
+def _rsi(close, timeperiod):
+    change = np.full(close.shape, np.nan)
+    change[1:] = close[1:] - close[:-1]
+    gain, loss = np.maximum(change, 0.0), np.maximum(-change, 0.0)
+
+    start = timeperiod
+    avg_gain = _recursive(gain, 1 / timeperiod, start, gain[1 : start + 1].sum(axis=0) / timeperiod)
+    avg_loss = _recursive(loss, 1 / timeperiod, start, loss[1 : start + 1].sum(axis=0) / timeperiod)
+
+    total = avg_gain + avg_loss
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rsi = np.where(_is_zero(total), 0.0, 100 * (avg_gain / total))
+    rsi[np.isnan(total)] = np.nan
+
+    return rsi
+
+
+def _true_range(high, low, close):
+    prev_close = np.full(close.shape, np.nan)
+    prev_close[1:] = close[:-1]
+
+    return np.maximum(np.maximum(high - low, np.abs(prev_close - high)), np.abs(prev_close - low))
+
+
+def _atr(high, low, close, timeperiod):
+    true_range = _true_range(high, low, close)
+
+    start = timeperiod
+    return _recursive(true_range, 1 / timeperiod, start, true_range[1 : start + 1].sum(axis=0) / timeperiod)
+
+
+def _natr(high, low, close, timeperiod):
+    atr = _atr(high, low, close, timeperiod)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        natr = np.where(_is_zero(close), 0.0, atr / close * 100)
+    natr[np.isnan(atr)] = np.nan
+
+    return natr
+
+
+def _ad(high, low, close, volume):
+    spread = high - low
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        flow = np.where(spread > 0, ((close - low) - (high - close)) / spread * volume, 0.0)
+
+    return np.cumsum(flow, axis=0)
+
+
+def _obv(close, volume):
+    flow = np.zeros(close.shape)
+    flow[0] = volume[0]
+    flow[1:] = np.sign(close[1:] - close[:-1]) * volume[1:]
+
+    return np.cumsum(flow, axis=0)
+
+
+def _adosc(high, low, close, volume, fastperiod, slowperiod):
+    ad = _ad(high, low, close, volume)
+
+    # Both EMA are seeded with the first value of the AD line
+    fast = _recursive(ad, 2 / (fastperiod + 1), 0, ad[0])
+    slow = _recursive(ad, 2 / (slowperiod + 1), 0, ad[0])
+
+    adosc = fast - slow
+    adosc[:max(fastperiod, slowperiod) - 1] = np.nan
+
+    return adosc
+
+
+# Moving averages by talib MA_Type, KAMA, MAMA and T3 are not supported
+_moving_averages = {0: _sma, 1: _ema, 2: _wma, 3: _dema, 4: _tema, 5: _trima}
+
+
+def _check_matype(matype: int) -> None:
+    if matype not in _moving_averages:
+        raise ValueError('Unsupported moving average type: {0}'.format(matype))
+
+
+class NumpyIndicator(object):
+    '''Vectorized NumPy version of the indicators of Indicator. Each function takes
+       series as 1-D arrays, or batches of series as 2-D arrays (time x series)
+    '''
+
+    # Overlap Studies Functions
+    @staticmethod
+    def BBANDS(close, timeperiod=5, nbdevup=2, nbdevdn=2, matype=0):
+        # Bollinger Bands
+        _check_matype(matype)
+        return _apply(_bbands, (close,), timeperiod, nbdevup, nbdevdn, matype)
+
+
+    @staticmethod
+    def DEMA(close, timeperiod=30):
+        # Double Exponential Moving Average
+        return _apply(_dema, (close,), timeperiod)
+
+
+    @staticmethod
+    def MA(close, timeperiod=30, matype=0):
+        # Moving average
+        _check_matype(matype)
+        return _apply(_ma, (close,), timeperiod, matype)
+
+
+    @staticmethod
+    def SMA(close, timeperiod=30):
+        # Simple Moving Average
+        return _apply(_sma, (close,), timeperiod)
+
+
+    @staticmethod
+    def TEMA(close, timeperiod=30):
+        # Triple Exponential Moving Average
+        return _apply(_tema, (close,), timeperiod)
+
+
+    @staticmethod
+    def TRIMA(close, timeperiod=30):
+        # Triangular Moving Average
+        return _apply(_trima, (close,), timeperiod)
+
+
+    @staticmethod
+    def WMA(close, timeperiod=30):
+        # Weighted Moving Average
+        return _apply(_wma, (close,), timeperiod)
+
+
+    # Momentum Indicator Functions
+    @staticmethod
+    def APO(close, fastperiod=12, slowperiod=26, matype=0):
+        # Absolute Price Oscillator
+        _check_matype(matype)
+        return _apply(_apo, (close,), fastperiod, slowperiod, matype)
+
+
+    @staticmethod
+    def MACD(close, fastperiod=12, slowperiod=26, signalperiod=9):
+        # Moving Average Convergence/Divergence
+        return _apply(_macd, (close,), fastperiod, slowperiod, signalperiod)
+
+
+    @staticmethod
+    def MOM(close, timeperiod=10):
+        # Momentum
+        return _apply(_mom, (close,), timeperiod)
+
+
+    @staticmethod
+    def PPO(close, fastperiod=12, slowperiod=26, matype=0):
+        # Percentage Price Oscillator
+        _check_matype(matype)
+        return _apply(_ppo, (close,), fastperiod, slowperiod, matype)
+
+
+    @staticmethod
+    def ROC(close, timeperiod=10):
+        # Rate of change : ((price/prevPrice)-1)*100
+        return _apply(_roc, (close,), timeperiod)
+
+
+    @staticmethod
+    def RSI(close, timeperiod=14):
+        # Relative Strength Index
+        return _apply(_rsi, (close,), timeperiod)
+
+
+    # Volume Indicator Functions
+    @staticmethod
+    def AD(high, low, close, volume):
+        # Chaikin A/D Line
+        return _apply(_ad, (high, low, close, volume))
+
+
+    @staticmethod
+    def ADOSC(high, low, close, volume, fastperiod=3, slowperiod=10):
+        # Chaikin A/D Oscillator
+        return _apply(_adosc, (high, low, close, volume), fastperiod, slowperiod)
+
+
+    @staticmethod
+    def OBV(close, volume):
+        # On Balance Volume
+        return _apply(_obv, (close, volume))
+
+
+    # Volatility Indicator Functions
+    @staticmethod
+    def ATR(high, low, close, timeperiod=14):
+        # Average True Range
+        return _apply(_atr, (high, low, close), timeperiod)
+
+
+    @staticmethod
+    def NATR(high, low, close, timeperiod=14):
+        # Normalized Average True Range
+        return _apply(_natr, (high, low, close), timeperiod)
+
+
+    @staticmethod
+    def TRANGE(high, low, close):
+        # True Range
+        return _apply(_true_range, (high, low, close))
+
+
+if __name__ == '__main__':
+    pass
@@ -3,6 +3,7 @@
 import logging
 
 from config import log_path
+from database import Database
 from dataCollection import collect_data
 from feature import update_feature
 from transaction import trade
@@ -34,6 +35,8 @@ def main():
     except:
         logging.exception('Critical error occurs')
 
+    logging.info('Database connection pool: %s', Database.pool_stats())
+    logging.info('Database query cache: %s', Database.cache_stats())
     logging.info('Complete main function')
 
 
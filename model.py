@@ -5,17 +5,31 @@ from typing import Sequence, List, Tuple, Dict
 
 import pandas as pd
 from sklearn.ensemble import RandomForestClassifier
-from sklearn.metrics import accuracy_score
 
-from config import data_path
+from config import forest_inference, model_registry
+from feature_loader import FeatureLoader
+from feature_store import FeatureStore
+from forest_inference import FlatForest
+from model_registry import ModelRegistry
 
 
 logger = logging.getLogger(__name__)
 
-_data_folder = data_path['root_path'] + 'feature/'
+_store = FeatureStore()
+_loader = FeatureLoader(_store)
+_registry = ModelRegistry()
 
 
 class Model(object):
+    # Random forest of the model
+    param = {
+        'n_estimators': 500,
+        'max_depth'   : 3,
+        'max_features': 'sqrt', # int, float, 'sqrt', 'log2' or None
+        'random_state': 0,
+    }
+
+
     def __init__(self, symbol: str):
         self.symbol = symbol
 
@@ -23,44 +37,53 @@ class Model(object):
     def load_data(self):
         logger.info('Modeling - load data for %s', self.symbol)
 
-        threshold = 0.001
+        # Features with adj_close last, labels of the price change in the next day
+        feature = _loader.load(self.symbol)
+        index = pd.Index(feature['dates'], name='date')
 
-        data = load_feature(self.symbol)
-        col_dataX = list(data.columns)[:-1]
-        
-        data['poc'] = data['adj_close'].pct_change(periods=1)
-        data['poc'] = data['poc'].shift(-1)  # Price change in the next day
-        data['Y'] = 0
-        data.loc[data['poc'] > threshold, 'Y'] = 1
-        data.loc[data['poc'] < -threshold, 'Y'] = -1
+        data = pd.DataFrame(feature['values'][:, :-1], index=index, columns=feature['columns'][:-1])
+        dataY = pd.Series(feature['Y'], index=index, name='Y')
 
-        self.dataX_today = data[col_dataX].tail(1)
-        self.dataX = data[:-1][col_dataX]
-        self.dataY = data[:-1]['Y']
+        self.dataX_today = data.tail(1)
+        self.dataX = data[:-1]
+        self.dataY = dataY[:-1]
 
         if len(self.dataX_today) > 0:
             logger.info('Modeling - date for prediction: %s', self.dataX_today.index[0])
 
 
-    def fit(self):
+    def fit(self, n_jobs: int = None):
+        '''Fit the random forest, with n_jobs threads if provided'''
         logger.info('Modeling - build model for %s', self.symbol)
 
-        param = {
-            'n_estimators': 500,
-            'max_depth'   : 3,
-            'max_features': 'auto', # int, float, 'auto', 'sqrt', 'log2' or None
-            'random_state': 0,
-        }
+        param = self.param
 
-        self._clf = RandomForestClassifier(**param)
-
-        if len(self.dataX) > 0:
+        if len(self.dataX) == 0:
+            self._clf = RandomForestClassifier(**param)
+        elif model_registry['enabled']:
+            self._clf = _registry.fit(self.symbol, param, self.dataX, self.dataY, n_jobs=n_jobs)
+        else:
+            self._clf = RandomForestClassifier(**param, n_jobs=n_jobs)
             self._clf.fit(self.dataX, self.dataY)
 
+        # Flat node arrays of the fitted trees, for the prediction of a single row
+        self._forest = None
+        if forest_inference['enabled'] and len(self.dataX) > 0:
+            self._forest = FlatForest(self._clf)
+
     
+    @classmethod
+    def registry_stats(cls) -> Dict[str, float]:
+        '''Models loaded, extended and refitted by the registry, with fit time saved'''
+        return _registry.stats()
+
+
     def predict_proba(self):
         if len(self.dataX_today) > 0:
-            prob = self._clf.predict_proba(self.dataX_today)[0]
+            if self._forest is not None:
+                prob = self._forest.predict_proba(self.dataX_today.to_numpy())[0]
+            else:
+                prob = self._clf.predict_proba(self.dataX_today)[0]
             # In case of binary classes
             if len(prob) == 2: prob = [prob[0], 0, prob[1]]
         else:
@@ -71,14 +94,23 @@ class Model(object):
         return prob
 
 
-def load_feature(symbol: str) -> pd.DataFrame:
-    ta_file = _data_folder + '{0}_ta.csv'.format(symbol)
-    symbol_news_file = _data_folder + '{0}_news.csv'.format(symbol)
-    market_news_file = _data_folder + 'Market_news.csv'
+def preload_feature(symbols: Sequence[str]) -> None:
+    '''Load the features of the symbols at once, reading the market news once'''
+
+    _loader.load_all(symbols)
+    logger.info('Feature loader: %s', _loader.stats())
+
+
+def load_feature(symbol: str, start: str = '', end: str = '') -> pd.DataFrame:
+    '''Load ta, news and market news features of the symbol from the feature store
+
+       @param: start: load features not earlier than this date, yyyy-mm-dd
+       @param: end: load features not later than this date, yyyy-mm-dd
+    '''
 
-    ta_feature = pd.read_csv(ta_file, sep=',', index_col='date')
-    symbol_news_feature = pd.read_csv(symbol_news_file, sep=',', index_col='date')
-    market_news_feature = pd.read_csv(market_news_file, sep=',', index_col='date')
+    ta_feature = _store.read('ta', symbol, start=start, end=end).set_index('date')
+    symbol_news_feature = _store.read('news', symbol, start=start, end=end).set_index('date')
+    market_news_feature = _store.read('news', 'Market', start=start, end=end).set_index('date')
 
     news_feature = symbol_news_feature.join(market_news_feature, on='date', 
                                     how='left', lsuffix='_s', rsuffix='_m')
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import logging
+import os
+import threading
+import time
+from typing import Sequence, List, Tuple, Dict
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+
+from config import data_path, model_registry
+
+
+logger = logging.getLogger(__name__)
+
+_registry_folder = data_path['root_path'] + 'model_registry/'
+
+
+def _digest(param: dict, dataX: pd.DataFrame, dataY: pd.Series) -> str:
+    '''sha1 of the parameters and the training data, including dates and columns'''
+
+    sha1 = hashlib.sha1(repr(sorted(param.items())).encode('utf-8'))
+    sha1.update('\x00'.join(map(str, dataX.columns)).encode('utf-8'))
+    sha1.update('\x00'.join(map(str, dataX.index)).encode('utf-8'))
+    sha1.update(np.ascontiguousarray(dataX.to_numpy(dtype='float64')).tobytes())
+    sha1.update(np.ascontiguousarray(dataY.to_numpy(dtype='int64')).tobytes())
+
+    return sha1.hexdigest()
+
+
+def grow_forest(clf: RandomForestClassifier, dataX, dataY, n_jobs: int = None,
+                trees_per_update: int = 0, max_estimators: int = 0) -> bool:
+    '''Add trees fitted on the rows to the fitted forest with warm start, instead
+       of refitting every tree
+
+       @param: trees_per_update: number of trees added. If 0, use model_registry['trees_per_update']
+       @param: max_estimators: number of trees the forest may grow to. If 0, use
+                               model_registry['max_estimators']
+       @return: False if the forest cannot grow, for other classes than those it was
+                fitted on or beyond max_estimators trees
+    '''
+
+    n_trees = len(clf.estimators_) + (trees_per_update or model_registry['trees_per_update'])
+
+    if set(np.unique(dataY)) != set(clf.classes_) or n_trees > (max_estimators or model_registry['max_estimators']):
+        return False
+
+    clf.set_params(warm_start=True, n_estimators=n_trees, n_jobs=n_jobs)
+    clf.fit(dataX, dataY)
+    clf.set_params(warm_start=False)
+
+    return True
+
+
+class ModelRegistry(object):
+    '''Fitted random forests kept by symbol, with a hash of the parameters and the
+       training data they were fitted on. The same data loads the stored model.
+       When rows were only appended, trees fitted on all rows are added to the
+       stored forest with warm start instead of refitting every tree
+    '''
+
+    def __init__(self, root_path: str = _registry_folder):
+        self.root_path = root_path
+
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'warm_starts': 0, 'refits': 0, 'fit_seconds': 0.0, 'saved_seconds': 0.0}
+
+
+    def _model_file(self, symbol: str) -> str:
+        return os.path.join(self.root_path, '{0}.joblib'.format(symbol))
+
+
+    def _load(self, symbol: str) -> dict:
+        model_file = self._model_file(symbol)
+
+        if not os.path.exists(model_file):
+            return None
+
+        try:
+            return joblib.load(model_file)
+        except Exception:
+            logger.exception('Failed to load the stored model of %s', symbol)
+            return None
+
+
+    def _save(self, symbol: str, entry: dict) -> None:
+        os.makedirs(self.root_path, exist_ok=True)
+
+        model_file = self._model_file(symbol)
+        temp_file = '{0}.{1}.{2}.tmp'.format(model_file, os.getpid(), threading.get_ident())
+
+        joblib.dump(entry, temp_file)
+        os.replace(temp_file, model_file)
+
+
+    def _count(self, kind: str, fit_seconds: float, saved_seconds: float) -> None:
+        with self._lock:
+            self._stats[kind] += 1
+            self._stats['fit_seconds'] += fit_seconds
+            self._stats['saved_seconds'] += max(saved_seconds, 0.0)
+
+
+    def fit(self, symbol: str, param: dict, dataX: pd.DataFrame, dataY: pd.Series, 
+            n_jobs: int = None) -> RandomForestClassifier:
+        '''Random forest fitted on the training data, loaded or extended from the
+           stored model of the symbol when possible
+
+           @param: param: parameters of RandomForestClassifier
+           @param: dataX: features, indexed by date in time order
+           @param: dataY: labels of the features
+           @param: n_jobs: number of threads of the forest, not part of the hash
+        '''
+
+        start_time = time.monotonic()
+        digest = _digest(param, dataX, dataY)
+        entry = self._load(symbol)
+
+        if entry is not None and entry['digest'] == digest:
+            self._count('hits', 0.0, entry['fit_seconds'] - (time.monotonic() - start_time))
+            logger.info('Load the stored model of %s, %d trees', symbol, len(entry['clf'].estimators_))
+
+            return entry['clf'].set_params(n_jobs=n_jobs)
+
+        n_rows = entry['n_rows'] if entry is not None else 0
+        clf = entry['clf'] if entry is not None else None
+
+        # Only rows appended since the stored model, with the same classes and a forest
+        # that may still grow
+        appended = (clf is not None and 0 < n_rows < len(dataX)
+                    and entry['param'] == param
+                    and _digest(param, dataX.iloc[:n_rows], dataY.iloc[:n_rows]) == entry['digest']
+                    and grow_forest(clf, dataX, dataY, n_jobs=n_jobs))
+
+        if appended:
+            fit_seconds = time.monotonic() - start_time
+            self._count('warm_starts', fit_seconds, entry['fit_seconds'] - fit_seconds)
+
+            logger.info('Add %d trees to the model of %s for %d new rows, %.2f seconds',
+                        model_registry['trees_per_update'], symbol, len(dataX) - n_rows, fit_seconds)
+
+            # Cost of a full refit is kept as the reference for the saved time
+            full_fit_seconds = entry['fit_seconds']
+        else:
+            clf = RandomForestClassifier(**param, n_jobs=n_jobs)
+            clf.fit(dataX, dataY)
+
+            fit_seconds = full_fit_seconds = time.monotonic() - start_time
+            self._count('refits', fit_seconds, 0.0)
+
+            logger.info('Fit the model of %s on %d rows, %.2f seconds', symbol, len(dataX), fit_seconds)
+
+        self._save(symbol, {'digest': digest, 'n_rows': len(dataX), 'param': dict(param),
+                            'clf': clf, 'fit_seconds': full_fit_seconds})
+
+        return clf
+
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self._stats)
+
+
+def test(n_rows: int = 300, seed: int = 0):
+    '''Stored models are loaded for the same data, extended for appended rows and
+       refitted for changed rows
+    '''
+
+    import tempfile
+
+    rng = np.random.default_rng(seed)
+    index = np.datetime_as_string(np.datetime64('2019-01-01') + np.arange(n_rows + 10))
+    dataX = pd.DataFrame(rng.normal(size=(n_rows + 10, 5)), index=index, columns=list('abcde'))
+    dataY = pd.Series(np.sign(dataX['a'] + rng.normal(0, 0.5, n_rows + 10)).astype(int), index=index)
+
+    param = {'n_estimators': 100, 'max_depth': 3, 'max_features': 'sqrt', 'random_state': 0}
+
+    with tempfile.TemporaryDirectory() as root_path:
+        registry = ModelRegistry(root_path)
+        X, y = dataX.iloc[:n_rows], dataY.iloc[:n_rows]
+
+        clf = registry.fit('TEST', param, X, y)
+        assert registry.stats()['refits'] == 1
+
+        # Same data, same model as a fresh fit
+        stored = registry.fit('TEST', param, X, y)
+        assert registry.stats()['hits'] == 1
+        assert np.array_equal(stored.predict_proba(X), clf.predict_proba(X))
+
+        # Appended rows, more trees
+        extended = registry.fit('TEST', param, dataX, dataY)
+        assert registry.stats()['warm_starts'] == 1
+        assert len(extended.estimators_) == 100 + model_registry['trees_per_update']
+
+        # Changed rows, a fresh fit
+        changed = dataY.copy()
+        changed.iloc[0] = -changed.iloc[0]
+        registry.fit('TEST', param, dataX, changed)
+        assert registry.stats()['refits'] == 2
+
+    logger.info('Model registry: %s', registry.stats())
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    test()
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Callable, Dict
+
+from config import api_rate_limit, ingestion
+
+
+logger = logging.getLogger(__name__)
+
+
+class ThrottledError(Exception):
+    '''Raised when an api provider rejects a call due to its rate limit'''
+
+
+class RateLimiter(object):
+    '''Sliding window allowing at most `calls` requests in any `period` seconds. The
+       times of the last `calls` requests are kept, and a request waits until the
+       oldest of them is `period` seconds old
+    '''
+
+    def __init__(self, calls: int, period: float):
+        self.calls = calls
+        self.period = period
+
+        self._times = deque(maxlen=calls)
+        self._lock = threading.Lock()
+
+
+    def acquire(self) -> float:
+        '''Block until a request is allowed
+
+           @return: number of seconds spent waiting
+        '''
+
+        waited = 0.0
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+
+                if len(self._times) < self.calls or now - self._times[0] >= self.period:
+                    self._times.append(now)
+                    return waited
+
+                delay = self._times[0] + self.period - now
+
+            time.sleep(delay)
+            waited += delay
+
+
+    def drain(self):
+        '''Allow no request for a whole period, e.g. after being throttled by the provider'''
+
+        with self._lock:
+            self._times.extend([time.monotonic()] * self.calls)
+
+
+class Scheduler(object):
+    '''Run fetch jobs concurrently in a thread pool, while api calls of each
+       provider are paced by a separate rate limiter
+    '''
+
+    def __init__(self, rate_limit: Dict[str, dict] = None, max_workers: int = 0):
+        rate_limit = api_rate_limit if rate_limit is None else rate_limit
+
+        self.limiters = {provider: RateLimiter(**limit) for provider, limit in rate_limit.items()}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or ingestion['max_workers'])
+
+
+    def call(self, provider: str, func: Callable, *args, **kwargs):
+        '''Call the function once the provider allows it. Retry with exponential
+           backoff if the call is throttled
+
+           @param: provider: name of the api provider, e.g. alpha_vantage. Calls
+                             are not paced for providers without rate limit
+           @param: func: function making exactly one api call to the provider
+        '''
+
+        limiter, max_retries = self.limiters.get(provider), ingestion['max_retries']
+
+        for attempt in range(max_retries + 1):
+            if limiter: limiter.acquire()
+
+            try:
+                return func(*args, **kwargs)
+            except ThrottledError:
+                if attempt == max_retries:
+                    raise
+
+                delay = min(ingestion['backoff_max'], ingestion['backoff_base'] * 2 ** attempt)
+                delay *= random.uniform(0.5, 1.0)
+
+                logger.warning('Throttled by %s, retry in %.1f seconds (%d/%d)',
+                               provider, delay, attempt + 1, max_retries)
+
+                # Other workers should slow down as well
+                if limiter: limiter.drain()
+                time.sleep(delay)
+
+
+    def submit(self, func: Callable, *args, **kwargs) -> Future:
+        return self._executor.submit(func, *args, **kwargs)
+
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown(wait=True)
+
+
+def test(calls: int = 5, period: float = 1.0, n_calls: int = 16, n_threads: int = 4):
+    '''No window of `period` seconds sees more than `calls` requests, from the first
+       one on, when requested from several threads at once
+    '''
+
+    limiter, times, lock = RateLimiter(calls, period), [], threading.Lock()
+
+    def request():
+        limiter.acquire()
+        with lock: times.append(time.monotonic())
+
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        for _ in range(n_calls): executor.submit(request)
+
+    times.sort()
+
+    # Times are taken just after acquire, hence the tolerance
+    gaps = [times[i + calls] - times[i] for i in range(len(times) - calls)]
+    assert min(gaps) >= period - 0.01, min(gaps)
+
+    logger.info('%d requests at most %d per %.1f seconds, in %.2f seconds', n_calls, calls, period,
+                times[-1] - times[0])
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    test()
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from typing import Sequence, List, Tuple, Dict
+
+import numpy as np
+from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+
+from config import data_path
+
+
+logger = logging.getLogger(__name__)
+
+_cache_file = data_path['root_path'] + 'sentiment.sqlite'
+
+# Number of digests looked up in one query, below the sqlite variable limit
+_lookup_batch_size = 500
+
+create_table_scores = \
+'''
+CREATE TABLE IF NOT EXISTS compound_scores (
+    digest BLOB PRIMARY KEY,     /* sha1 of the text */
+    score REAL NOT NULL
+)
+'''
+
+select_scores = 'SELECT digest, score FROM compound_scores WHERE digest IN ({params})'
+
+insert_scores = 'INSERT OR IGNORE INTO compound_scores (digest, score) VALUES (?, ?)'
+
+
+class SentimentCache(object):
+    '''VADER compound scores of texts, computed once by a shared analyzer and kept
+       by sha1 of the text in memory and in a sqlite file shared by all processes
+    '''
+
+    def __init__(self, cache_file: str = _cache_file):
+        self.cache_file = cache_file
+
+        self._pid = os.getpid()
+        self._analyzer = None
+        self._scores = {}
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0}
+
+
+    def _connect(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_file)), exist_ok=True)
+
+        connect = sqlite3.connect(self.cache_file, timeout=30)
+        connect.execute(create_table_scores)
+
+        return connect
+
+
+    def _lookup(self, digests: Sequence[bytes]) -> Dict[bytes, float]:
+        scores = {}
+        connect = self._connect()
+
+        for i in range(0, len(digests), _lookup_batch_size):
+            batch = digests[i : i + _lookup_batch_size]
+            params = ', '.join('?' * len(batch))
+            scores.update(connect.execute(select_scores.format(params=params), batch).fetchall())
+
+        connect.close()
+        return scores
+
+
+    def _store(self, scores: Dict[bytes, float]) -> None:
+        connect = self._connect()
+
+        with connect:
+            connect.executemany(insert_scores, scores.items())
+
+        connect.close()
+
+
+    def scores(self, texts: Sequence[str]) -> np.ndarray:
+        '''Compound score of each text, scoring only the texts never seen before'''
+
+        digests = [hashlib.sha1(text.encode('utf-8')).digest() for text in texts]
+
+        with self._lock:
+            # Neither the analyzer nor the connection is shared with a forked process
+            if self._pid != os.getpid():
+                self._pid, self._analyzer = os.getpid(), None
+
+            missing = list(set(digest for digest in digests if digest not in self._scores))
+
+            if missing:
+                self._scores.update(self._lookup(missing))
+
+            new_scores = {}
+
+            for text, digest in zip(texts, digests):
+                if digest not in self._scores and digest not in new_scores:
+                    if self._analyzer is None:
+                        self._analyzer = SentimentIntensityAnalyzer()
+
+                    new_scores[digest] = self._analyzer.polarity_scores(text)['compound']
+
+            if new_scores:
+                self._store(new_scores)
+                self._scores.update(new_scores)
+
+            self._stats['misses'] += len(new_scores)
+            self._stats['hits'] += len(texts) - len(new_scores)
+
+            return np.array([self._scores[digest] for digest in digests], dtype='float64')
+
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            stats = dict(self._stats)
+
+        stats['hit_ratio'] = stats['hits'] / max(1, stats['hits'] + stats['misses'])
+
+        return stats
+
+
+if __name__ == '__main__':
+    pass
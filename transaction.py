@@ -1,14 +1,17 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 
 import pandas as pd
 
-from config import db_init, data_path
+from config import db_init, data_path, model_build
 from database import Database
-from model import Model
-from util import get_last_line, pop_last_line
+from model import Model, preload_feature
+from util import available_cores, get_last_line, pop_last_line
 
 
 logger = logging.getLogger(__name__)
@@ -216,9 +219,34 @@ def finalize_transaction():
         f.write(','.join(curr_prob) + '\n')
 
 
-def predict_price_change():
+def _predict_job(symbol: str, n_jobs: int) -> tuple:
+    '''Train the model of the symbol and predict the probabilities of price change
+
+       @return: rounded probabilities, registry counts of this job and seconds spent
+    '''
+    start_time = time.monotonic()
+    before = Model.registry_stats()
+
+    model = Model(symbol)
+    model.load_data()
+    model.fit(n_jobs=n_jobs)
+
+    neg, neu, pos = model.predict_proba()
+    prob = tuple(map(lambda x: round(x, 4), (neg, neu, pos)))
+
+    after = Model.registry_stats()
+    return prob, {name: after[name] - before[name] for name in after}, time.monotonic() - start_time
+
+
+def predict_price_change(max_workers: int = 0):
     '''Train model and predict probability of price change in the next day for each symbol.
-       If run on the non-trading day, e.g. weekends, the current probabilities are updated
+       If run on the non-trading day, e.g. weekends, the current probabilities are updated.
+
+       The cores are shared between symbols by a fixed rule, not by timing: as many
+       symbols as cores are trained at once in a pool of processes, and the cores
+       left over (budget // processes) are used by the threads of each forest
+
+       @param: max_workers: number of cores. If 0, use model_build['max_workers']
     '''
     logger.info('Called')
     
@@ -230,15 +258,28 @@ def predict_price_change():
         logger.info('Update the current predicted probabilities')
         pop_last_line(_prob_pred_file)
 
-    prob_pred = {}
+    budget = max_workers or model_build['max_workers'] or available_cores()
+    workers = max(1, min(budget, len(symbols)))
+    n_jobs = max(1, budget // workers)
 
-    for symbol in symbols:
-        model = Model(symbol)
-        model.load_data()
-        model.fit()
-        
-        neg, neu, pos = model.predict_proba()
-        prob_pred[symbol] = tuple(map(lambda x: round(x, 4), (neg, neu, pos)))
+    logger.info('Train %d models with %d processes of %d threads', len(symbols), workers, n_jobs)
+
+    start_time = time.monotonic()
+
+    # Loaded once here, the processes forked for the jobs share the loaded features.
+    # Where fork is not available, each process loads the features of its jobs
+    preload_feature(symbols)
+
+    if workers <= 1:
+        results = {symbol: _predict_job(symbol, n_jobs) for symbol in symbols}
+    else:
+        context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            futures = {symbol: executor.submit(_predict_job, symbol, n_jobs) for symbol in symbols}
+            results = {symbol: future.result() for symbol, future in futures.items()}
+
+    prob_pred = {symbol: results[symbol][0] for symbol in symbols}
 
     # Log probability predictions for the next trading day
     prob = ['NA'] + [v for symbol in symbols for v in prob_pred[symbol]]
@@ -246,6 +287,15 @@ def predict_price_change():
     with open(_prob_pred_file, 'a') as f:
         f.write(','.join(map(str, prob)) + '\n')
 
+    stats = {}
+    for _, job_stats, _ in results.values():
+        for name, value in job_stats.items():
+            stats[name] = stats.get(name, 0) + value
+
+    logger.info('Train %d models in %.1f seconds, %.1f seconds of work', len(symbols),
+                time.monotonic() - start_time, sum(seconds for _, _, seconds in results.values()))
+    logger.info('Model registry: %s', stats)
+
 
 def trade():
     logger.info('Start trading process')
@@ -1,11 +1,14 @@
 # -*- coding: utf-8 -*-
 
+import os
 import time
 from typing import Sequence, List, Tuple, Dict
 from collections import deque
 from datetime import datetime
 from functools import wraps
 
+import numpy as np
+import pandas as pd
 import pytz
 
 
@@ -31,6 +34,55 @@ def standardize_datetime(date_string: str, fmt: str, include_time: bool = True,
     return date_time.strftime('%Y-%m-%d')
 
 
+def standardize_datetime_array(date_strings: Sequence[str], fmt: str, include_time: bool = True,
+                               to_timezone: str = '') -> List[str]:
+    '''Vectorized version of standardize_datetime, converting all date strings 
+       in one pass. Date strings without timezone are assumed to be in UTC when 
+       converted to another timezone
+
+       @param: date_strings: sequence of date strings to be standardized
+       @param: fmt: format of the provided date strings
+       @param: include_time: whether to include time with format hh:mm:ss
+       @param: to_timezone: convert dates to the specified timezone, e.g. US/Eastern
+    '''
+
+    out_fmt = '%Y-%m-%d %H:%M:%S' if include_time else '%Y-%m-%d'
+    values = None
+
+    if not to_timezone and fmt in ('%Y-%m-%d', '%Y-%m-%d %H:%M:%S'):
+        # ISO format is parsed natively by numpy. Zero-padded date strings 
+        # are already in the standard format once validated
+        try:
+            values = np.array(date_strings, dtype='datetime64[s]')
+        except ValueError:
+            pass
+
+        width = 19 if include_time else 10
+
+        if values is not None and fmt == out_fmt and set(map(len, date_strings)) <= {width}:
+            return list(date_strings)
+
+    if values is None:
+        try:
+            date_time = pd.to_datetime(pd.Series(date_strings, dtype=object), format=fmt, 
+                                       utc=bool(to_timezone))
+        except ValueError:
+            # Mixed utc offsets can only be kept one by one
+            return [standardize_datetime(d, fmt, include_time, to_timezone) for d in date_strings]
+
+        if to_timezone:
+            date_time = date_time.dt.tz_convert(to_timezone).dt.tz_localize(None)
+        elif date_time.dt.tz is not None:
+            date_time = date_time.dt.tz_localize(None)
+
+        values = date_time.to_numpy(dtype='datetime64[s]')
+
+    if include_time:
+        return [v.replace('T', ' ') for v in np.datetime_as_string(values, unit='s').tolist()]
+
+    return np.datetime_as_string(values.astype('datetime64[D]')).tolist()
+
+
 def validate_date_fmt(date_string: str, fmt: str) -> bool:
     '''Validate date format
 
@@ -86,4 +138,13 @@ def get_last_n_lines(filepath: str, n: int) -> Tuple[str]:
     with open(filepath, 'r') as f:
         last_n_lines = deque(f, n)
 
-    return map(lambda line: line.strip(), last_n_lines)
\ No newline at end of file
+    return map(lambda line: line.strip(), last_n_lines)
+
+
+def available_cores() -> int:
+    '''Number of cores this process may run on'''
+
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+
+    return os.cpu_count() or 1